@@ -3,6 +3,21 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Run it with an ASGI server, e.g.
+
+    gunicorn config.asgi:application -k uvicorn_worker.UvicornWorker
+
+(the Docker image does this when APP_SERVER=asgi). Download views are
+async, so slow readers do not pin a worker thread.
+
+Django's ASGIHandler receives the whole request body into a temporary
+file before middleware and views run, so the upload handler's quota check
+would only see the body after it has arrived. UploadBodyGate therefore
+answers /api/files/upload/ before the body is read: 411 without
+Content-Length, 413 above ASGI_UPLOAD_MAX_BYTES (the resumable upload API
+reserves quota before any data and takes bounded chunks). Uploads under
+the limit are still written to disk twice (spool, then staging).
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -13,4 +28,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported after setup: the gate reverses URLs and pulls in models
+from storage.middleware import UploadBodyGate
+
+application = UploadBodyGate(django_application)
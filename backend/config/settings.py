@@ -22,6 +22,101 @@ load_dotenv(BASE_DIR / '.env')
 _storage = os.environ.get("STORAGE_ROOT")
 STORAGE_ROOT = (Path(_storage) if _storage else (BASE_DIR / "data/storage")).resolve()
 
+# Where file bodies live: storage.backends.LocalStorageBackend (STORAGE_ROOT)
+# or storage.backends.S3StorageBackend (any S3-compatible service, needs boto3).
+# Upload staging always stays on local disk under STORAGE_ROOT
+STORAGE_BACKEND = os.environ.get(
+    'STORAGE_BACKEND', 'storage.backends.LocalStorageBackend'
+)
+STORAGE_S3_BUCKET = os.environ.get('STORAGE_S3_BUCKET', '')
+STORAGE_S3_PREFIX = os.environ.get('STORAGE_S3_PREFIX', '')
+STORAGE_S3_ENDPOINT_URL = os.environ.get('STORAGE_S3_ENDPOINT_URL', '')
+STORAGE_S3_REGION = os.environ.get('STORAGE_S3_REGION', '')
+STORAGE_S3_ACCESS_KEY_ID = os.environ.get('STORAGE_S3_ACCESS_KEY_ID', '')
+STORAGE_S3_SECRET_ACCESS_KEY = os.environ.get('STORAGE_S3_SECRET_ACCESS_KEY', '')
+# 'path' for MinIO-style endpoints, 'virtual' / 'auto' for AWS
+STORAGE_S3_ADDRESSING_STYLE = os.environ.get('STORAGE_S3_ADDRESSING_STYLE', 'auto')
+# multipart upload: part size (min 5 MiB) and parts uploaded in parallel
+STORAGE_S3_PART_SIZE = int(os.environ.get('STORAGE_S3_PART_SIZE', str(16 * 1024 * 1024)))
+STORAGE_S3_CONCURRENCY = int(os.environ.get('STORAGE_S3_CONCURRENCY', '4'))
+
+# Content-addressed storage: identical uploads share one blob on disk
+STORAGE_DEDUP = os.environ.get('STORAGE_DEDUP', '1') == '1'
+
+# Files of a user are spread over N levels of 2-hex-char subdirectories
+# taken from stored_name (<user>/ab/cd/abcd...ext) so no directory grows to
+# millions of entries. 0 = flat layout. Existing files keep their paths
+# until `manage.py relayout_storage` moves them
+STORAGE_FANOUT_LEVELS = int(os.environ.get('STORAGE_FANOUT_LEVELS', '2'))
+
+# At-rest compression of new uploads: '' = off, 'gzip' or 'zstd' (needs
+# zstandard). Already-compressed formats (by extension), files smaller than
+# MIN_SIZE and files that do not shrink below MAX_RATIO are stored as is.
+# Clients that accept the encoding get the stored bytes without decoding
+STORAGE_COMPRESSION = os.environ.get('STORAGE_COMPRESSION', '')
+STORAGE_COMPRESSION_LEVEL = (
+    int(os.environ['STORAGE_COMPRESSION_LEVEL'])
+    if os.environ.get('STORAGE_COMPRESSION_LEVEL') else None
+)
+STORAGE_COMPRESSION_MIN_SIZE = int(
+    os.environ.get('STORAGE_COMPRESSION_MIN_SIZE', '4096')
+)
+STORAGE_COMPRESSION_MAX_RATIO = float(
+    os.environ.get('STORAGE_COMPRESSION_MAX_RATIO', '0.9')
+)
+
+# Renditions (thumbnails, PDF first page, text snippet) are generated by a
+# per-process thread pool right after upload; 0 = only on first request
+# (still in the pool, one thread: requests never render or wait, they get
+# 503 + Retry-After until it is ready). Images/PDFs larger than
+# MAX_SOURCE_BYTES get no thumbnails
+RENDITION_WORKERS = int(os.environ.get('RENDITION_WORKERS', '2'))
+RENDITION_MAX_SOURCE_BYTES = int(
+    os.environ.get('RENDITION_MAX_SOURCE_BYTES', str(200 * 1024 * 1024))
+)
+
+# Serve file bodies from nginx (X-Accel-Redirect) instead of gunicorn workers.
+# Must match the `internal` location in infra/nginx/nginx.conf; empty = off
+STORAGE_ACCEL_REDIRECT_PREFIX = os.environ.get('STORAGE_ACCEL_REDIRECT_PREFIX', '')
+
+# last_downloaded is buffered per process and flushed in batches;
+# 0 disables the buffer and writes on every download
+LAST_DOWNLOADED_FLUSH_INTERVAL = float(
+    os.environ.get('LAST_DOWNLOADED_FLUSH_INTERVAL', '5')
+)
+LAST_DOWNLOADED_BUFFER_SIZE = int(
+    os.environ.get('LAST_DOWNLOADED_BUFFER_SIZE', '1000')
+)
+
+# /metrics (Prometheus). Not proxied by nginx; if set, scrapers must send
+# `Authorization: Bearer <token>`. Multi-worker aggregation is enabled by the
+# PROMETHEUS_MULTIPROC_DIR env var (see Dockerfile and gunicorn.conf.py)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Storage quotas per level in bytes (empty = unlimited);
+# a per-user User.quota_bytes overrides the level default
+STORAGE_QUOTAS = {
+    level: int(os.environ[f'STORAGE_QUOTA_{level.upper()}'])
+    if os.environ.get(f'STORAGE_QUOTA_{level.upper()}') else None
+    for level in ('user', 'admin', 'senior_admin', 'superuser')
+}
+
+# Uploads are streamed straight into STORAGE_ROOT/.uploads and renamed into
+# place, instead of being spooled to the system temp dir and copied again
+FILE_UPLOAD_HANDLERS = ['storage.uploadhandlers.StagingFileUploadHandler']
+
+# Resumable uploads: stale sessions are purged by `manage.py purge_upload_sessions`
+UPLOAD_SESSION_TTL_HOURS = int(os.environ.get('UPLOAD_SESSION_TTL_HOURS', '24'))
+UPLOAD_CHUNK_MAX_BYTES = int(
+    os.environ.get('UPLOAD_CHUNK_MAX_BYTES', str(64 * 1024 * 1024))
+)
+# Under ASGI the body of /api/files/upload/ is received before the quota
+# check, so bigger single-request uploads are refused up front (see
+# config/asgi.py); clients use the resumable upload API for them
+ASGI_UPLOAD_MAX_BYTES = int(
+    os.environ.get('ASGI_UPLOAD_MAX_BYTES', str(UPLOAD_CHUNK_MAX_BYTES))
+)
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
 
@@ -44,14 +139,17 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 
 MIDDLEWARE = [
+    'storage.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'storage.middleware.StorageReservationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -90,6 +188,60 @@ DATABASES = {
     }
 }
 
+# Caches. Share-token lookups use their own alias so a shared backend
+# (e.g. django.core.cache.backends.redis.RedisCache + redis://...) can be
+# plugged in for multi-host deployments
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # shared by every worker on the host out of the box: a per-process cache
+    # would keep serving a revoked or deleted share link in the other workers
+    'shares': {
+        'BACKEND': os.environ.get(
+            'SHARE_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache',
+        ),
+        'LOCATION': os.environ.get('SHARE_CACHE_LOCATION', '/tmp/my_cloud_share_cache'),
+        'TIMEOUT': int(os.environ.get('SHARE_CACHE_TTL', '60')),
+        'KEY_PREFIX': 'my_cloud',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('SHARE_CACHE_MAX_ENTRIES', '10000')),
+        },
+    },
+    # shared by every worker on the host out of the box: a per-process cache
+    # would keep serving a logged-out or demoted user in the other workers
+    'auth': {
+        'BACKEND': os.environ.get(
+            'AUTH_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache',
+        ),
+        'LOCATION': os.environ.get('AUTH_CACHE_LOCATION', '/tmp/my_cloud_auth_cache'),
+        'TIMEOUT': int(os.environ.get('AUTH_CACHE_TTL', '60')),
+        'KEY_PREFIX': 'my_cloud',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('AUTH_CACHE_MAX_ENTRIES', '10000')),
+        },
+    },
+}
+
+# Sessions and request.user are read through the 'auth' cache; sessions are
+# still written to the DB. A logout, level/quota change or user delete drops
+# the entry, so the cache must be shared by all workers: the default file
+# cache is per host, use Redis/Memcached when running several hosts.
+# gunicorn.conf.py refuses to start several workers on LocMemCache
+SESSION_ENGINE = 'users.sessions'
+SESSION_CACHE_ALIAS = 'auth'
+# sessions remember the backend that logged them in: ModelBackend keeps
+# sessions created before the cached backend valid (they skip the cache)
+AUTHENTICATION_BACKENDS = [
+    'users.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Unknown tokens are cached too, to absorb brute-force scans of /api/share/
+SHARE_CACHE_NEGATIVE_TTL = int(os.environ.get('SHARE_CACHE_NEGATIVE_TTL', '30'))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,25 @@
+# Подхватывается gunicorn автоматически (./gunicorn.conf.py)
+import os
+
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # иначе livesum-гейджи (передачи в полёте) умершего воркера
+    # так и остались бы в /metrics
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(worker.pid)
+
+def on_starting(server):
+    # кэши 'auth' и 'shares' в памяти процесса: выход, смену уровня,
+    # удаление пользователя, отключение спецссылки увидел бы только
+    # воркер, который их обработал
+    if server.cfg.workers <= 1:
+        return
+
+    for name in ('AUTH_CACHE_BACKEND', 'SHARE_CACHE_BACKEND'):
+        if os.environ.get(name, '').endswith('LocMemCache'):
+            raise RuntimeError(
+                f'{name}=LocMemCache needs a single worker: '
+                'use the default file cache or Redis/Memcached'
+            )
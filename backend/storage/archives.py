@@ -0,0 +1,101 @@
+import logging
+import os
+import zipfile
+
+from django.utils import timezone
+
+from .backends import get_storage_backend
+from .compression import INCOMPRESSIBLE_EXTENSIONS, iter_content
+from .models import File
+from .services import record_download
+
+logger = logging.getLogger(__name__)
+
+
+class ZipStreamBuffer:
+    # Файловый объект без seek/tell: zipfile тогда пишет data descriptor
+    # после каждого entry и не возвращается назад — архив можно отдавать
+    # по кускам, не держа его ни в памяти, ни во временном файле.
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+ARCHIVE_BATCH = 500
+
+def iter_files_by_id(files, batch_size: int = ARCHIVE_BATCH):
+    # все файлы пользователя — пачками по id, а не списком: их могут быть
+    # сотни тысяч, а в памяти архиву нужен только текущий
+    last_id = 0
+    while True:
+        batch = list(files.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not batch:
+            return
+        yield from batch
+        last_id = batch[-1].id
+
+def archive_names(files):
+    # (file, имя в архиве); одинаковые original_name у пользователя —
+    # обычное дело
+    seen = set()
+    for f in files:
+        name = f.original_name.replace('/', '_').replace('\\', '_') or 'file'
+        stem, ext = os.path.splitext(name)
+        candidate = name
+        n = 1
+        while candidate.lower() in seen:
+            candidate = f'{stem} ({n}){ext}'
+            n += 1
+        seen.add(candidate.lower())
+        yield f, candidate
+
+def archive_entry(f: File, name: str) -> zipfile.ZipInfo:
+    modified = timezone.localtime(f.uploaded)
+    info = zipfile.ZipInfo(name, date_time=modified.timetuple()[:6])
+
+    _, ext = os.path.splitext(name)
+    # уже сжатые форматы: deflate их не уменьшит, только потратит CPU
+    if ext.lower() in INCOMPRESSIBLE_EXTENSIONS:
+        info.compress_type = zipfile.ZIP_STORED
+    else:
+        info.compress_type = zipfile.ZIP_DEFLATED
+
+    # по размеру zipfile решает, нужен ли entry-у ZIP64
+    info.file_size = f.size_bytes
+    return info
+
+def iter_zip(files):
+    buffer = ZipStreamBuffer()
+    backend = get_storage_backend()
+
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as archive:
+        for f, name in archive_names(files):
+            try:
+                backend.size(f.relative_path)
+            except FileNotFoundError:
+                logger.warning('File %s is missing in storage, skipped', f.id)
+                continue
+
+            with archive.open(archive_entry(f, name), 'w') as dst:
+                for chunk in iter_content(f):
+                    dst.write(chunk)
+                    data = buffer.take()
+                    if data:
+                        yield data
+
+            record_download(f)
+
+    # остаток последнего entry и central directory
+    yield buffer.take()
@@ -0,0 +1,312 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+READ_CHUNK = 64 * 1024
+
+
+class LocalStorageBackend:
+    # Файлы в STORAGE_ROOT на локальном диске (поведение по умолчанию).
+    # Все пути — относительные, как File.relative_path / Blob.relative_path
+    is_local = True
+
+    def path(self, rel_path: str) -> Path:
+        return Path(settings.STORAGE_ROOT) / rel_path
+
+    def exists(self, rel_path: str) -> bool:
+        return self.path(rel_path).exists()
+
+    def size(self, rel_path: str) -> int:
+        # FileNotFoundError, если файла нет
+        return self.path(rel_path).stat().st_size
+
+    def iter_range(self, rel_path: str, start: int, end: int):
+        with self.path(rel_path).open('rb') as src:
+            src.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = src.read(min(READ_CHUNK, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+    def save(self, rel_path: str, staged_path: Path) -> None:
+        # staging лежит в STORAGE_ROOT, поэтому это rename, а не копирование
+        target_path = self.path(rel_path)
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        if not staged_path.exists():
+            staged_path.parent.mkdir(parents=True, exist_ok=True)
+            staged_path.touch()
+        os.replace(staged_path, target_path)
+
+    def delete(self, rel_path: str) -> None:
+        self.path(rel_path).unlink(missing_ok=True)
+
+    def delete_many(self, rel_paths) -> None:
+        for rel_path in rel_paths:
+            self.delete(rel_path)
+
+    def scan(self, prefix: str = '', start_after: str = ''):
+        # (relative_path, size, mtime) по возрастанию relative_path —
+        # в том же порядке, что ORDER BY relative_path COLLATE "C".
+        # В памяти только содержимое одного каталога на уровень
+        yield from self._scan_dir(self.path(prefix), prefix, start_after)
+
+    def _scan_dir(self, dir_path: Path, rel_dir: str, start_after: str):
+        try:
+            with os.scandir(dir_path) as it:
+                # у каталога в ключе '/', иначе 'ab/...' встал бы раньше 'ab.txt'
+                entries = sorted(
+                    (e.name + '/' if e.is_dir(follow_symlinks=False) else e.name, e)
+                    for e in it
+                )
+        except FileNotFoundError:
+            return
+
+        for name, entry in entries:
+            rel_path = rel_dir + name
+            if name.endswith('/'):
+                # поддерево целиком до start_after — уже пройдено
+                if rel_path < start_after and not start_after.startswith(rel_path):
+                    continue
+                yield from self._scan_dir(entry.path, rel_path, start_after)
+            elif rel_path > start_after:
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                yield rel_path, stat.st_size, stat.st_mtime
+
+    def children(self, prefix: str = ''):
+        # содержимое одного уровня в порядке scan: (путь, размер, mtime),
+        # у каталогов путь с '/' на конце и размер None
+        try:
+            with os.scandir(self.path(prefix)) as it:
+                entries = sorted(
+                    (e.name + '/' if e.is_dir(follow_symlinks=False) else e.name, e)
+                    for e in it
+                )
+        except FileNotFoundError:
+            return
+
+        for name, entry in entries:
+            if name.endswith('/'):
+                yield prefix + name, None, None
+                continue
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            yield prefix + name, stat.st_size, stat.st_mtime
+
+    def iter_files(self, prefix: str):
+        # os.walk читает каталоги по одному, полный список файлов не строится
+        root = Path(settings.STORAGE_ROOT)
+        for dirpath, _, filenames in os.walk(self.path(prefix)):
+            for name in filenames:
+                yield str((Path(dirpath) / name).relative_to(root))
+
+    def remove_tree(self, prefix: str) -> None:
+        # к этому моменту файлов уже нет, остались пустые каталоги
+        root = self.path(prefix)
+        if root.exists():
+            for dirpath, _, _ in os.walk(root, topdown=False):
+                os.rmdir(dirpath)
+
+
+class S3StorageBackend:
+    # S3-совместимое хранилище (AWS, MinIO, ...). Нужен boto3.
+    # Ключ объекта — STORAGE_S3_PREFIX + relative_path
+    is_local = False
+
+    def __init__(self):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError as exc:
+            raise ImproperlyConfigured(
+                'S3StorageBackend requires boto3 (pip install boto3)'
+            ) from exc
+
+        if not settings.STORAGE_S3_BUCKET:
+            raise ImproperlyConfigured('STORAGE_S3_BUCKET is not set')
+
+        self.bucket = settings.STORAGE_S3_BUCKET
+        self.prefix = settings.STORAGE_S3_PREFIX
+        self.part_size = settings.STORAGE_S3_PART_SIZE
+        self.concurrency = settings.STORAGE_S3_CONCURRENCY
+        self.client = boto3.client(
+            's3',
+            endpoint_url=settings.STORAGE_S3_ENDPOINT_URL or None,
+            region_name=settings.STORAGE_S3_REGION or None,
+            aws_access_key_id=settings.STORAGE_S3_ACCESS_KEY_ID or None,
+            aws_secret_access_key=settings.STORAGE_S3_SECRET_ACCESS_KEY or None,
+            config=Config(
+                max_pool_connections=max(10, self.concurrency * 2),
+                s3={'addressing_style': settings.STORAGE_S3_ADDRESSING_STYLE},
+            ),
+        )
+
+    def key(self, rel_path: str) -> str:
+        return self.prefix + rel_path
+
+    def head(self, rel_path: str) -> dict:
+        try:
+            return self.client.head_object(
+                Bucket=self.bucket, Key=self.key(rel_path)
+            )
+        except self.client.exceptions.ClientError as exc:
+            if exc.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                raise FileNotFoundError(rel_path) from exc
+            raise
+
+    def path(self, rel_path: str) -> Path:
+        raise NotImplementedError('S3 objects have no local path')
+
+    def exists(self, rel_path: str) -> bool:
+        try:
+            self.head(rel_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def size(self, rel_path: str) -> int:
+        return self.head(rel_path)['ContentLength']
+
+    def iter_range(self, rel_path: str, start: int, end: int):
+        if end < start:
+            return
+
+        try:
+            obj = self.client.get_object(
+                Bucket=self.bucket,
+                Key=self.key(rel_path),
+                Range=f'bytes={start}-{end}',
+            )
+        except self.client.exceptions.NoSuchKey as exc:
+            raise FileNotFoundError(rel_path) from exc
+
+        body = obj['Body']
+        try:
+            yield from body.iter_chunks(READ_CHUNK)
+        finally:
+            body.close()
+
+    def save(self, rel_path: str, staged_path: Path) -> None:
+        size = staged_path.stat().st_size if staged_path.exists() else 0
+        key = self.key(rel_path)
+
+        if size > self.part_size:
+            self.multipart_upload(key, staged_path, size)
+        elif size:
+            with staged_path.open('rb') as src:
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=src)
+        else:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=b'')
+
+        staged_path.unlink(missing_ok=True)
+
+    def multipart_upload(self, key: str, staged_path: Path, size: int) -> None:
+        upload_id = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=key
+        )['UploadId']
+
+        def upload_part(number: int) -> dict:
+            # каждая часть читается своим дескриптором: части идут параллельно
+            with staged_path.open('rb') as src:
+                src.seek((number - 1) * self.part_size)
+                data = src.read(self.part_size)
+            result = self.client.upload_part(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                Body=data,
+            )
+            return {'PartNumber': number, 'ETag': result['ETag']}
+
+        numbers = range(1, (size + self.part_size - 1) // self.part_size + 1)
+        try:
+            with ThreadPoolExecutor(self.concurrency) as pool:
+                parts = list(pool.map(upload_part, numbers))
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts},
+            )
+        except Exception:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id
+            )
+            raise
+
+    def delete(self, rel_path: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(rel_path))
+
+    def delete_many(self, rel_paths) -> None:
+        keys = [{'Key': self.key(rel_path)} for rel_path in rel_paths]
+        # DeleteObjects принимает до 1000 ключей
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': keys[start:start + 1000], 'Quiet': True},
+            )
+
+    def iter_files(self, prefix: str):
+        paginator = self.client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=self.bucket, Prefix=self.key(prefix))
+        for page in pages:
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(self.prefix):]
+
+    def scan(self, prefix: str = '', start_after: str = ''):
+        # ListObjectsV2 и так отдаёт ключи в порядке байтов UTF-8
+        params = {'Bucket': self.bucket, 'Prefix': self.key(prefix)}
+        if start_after:
+            params['StartAfter'] = self.key(start_after)
+
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(**params):
+            for obj in page.get('Contents', []):
+                yield (
+                    obj['Key'][len(self.prefix):],
+                    obj['Size'],
+                    obj['LastModified'].timestamp(),
+                )
+
+    def children(self, prefix: str = ''):
+        # «каталоги» — общие префиксы ключей до следующего '/'
+        paginator = self.client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=self.bucket, Prefix=self.key(prefix), Delimiter='/'
+        )
+        for page in pages:
+            entries = [
+                (p['Prefix'][len(self.prefix):], None, None)
+                for p in page.get('CommonPrefixes', [])
+            ] + [
+                (
+                    obj['Key'][len(self.prefix):],
+                    obj['Size'],
+                    obj['LastModified'].timestamp(),
+                )
+                for obj in page.get('Contents', [])
+            ]
+            # в пределах страницы ключи и префиксы идут двумя списками
+            yield from sorted(entries)
+
+    def remove_tree(self, prefix: str) -> None:
+        # каталогов в S3 нет
+        pass
+
+
+@lru_cache(maxsize=None)
+def get_storage_backend():
+    return import_string(settings.STORAGE_BACKEND)()
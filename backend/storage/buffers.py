@@ -0,0 +1,111 @@
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import File
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH = 500
+
+
+class LastDownloadedBuffer:
+    # Копит время последнего скачивания в памяти процесса и пишет в БД
+    # пачками: повторные скачивания одного файла схлопываются в одну строку
+    # UPDATE, а горячий путь download_* вообще не ходит в БД.
+
+    def __init__(self):
+        self._pending: dict[int, datetime] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def max_pending(self) -> int:
+        return settings.LAST_DOWNLOADED_BUFFER_SIZE
+
+    def record(self, file_id: int, when: datetime) -> None:
+        with self._lock:
+            previous = self._pending.get(file_id)
+            if previous is None or when > previous:
+                self._pending[file_id] = when
+            pending = len(self._pending)
+            self._ensure_thread()
+
+        if pending >= 2 * self.max_pending:
+            # фоновый поток не успевает — пишем сами, чтобы буфер не рос
+            self.flush()
+        elif pending >= self.max_pending:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+
+            if not batch:
+                return 0
+
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception('Failed to flush last_downloaded buffer')
+                with self._lock:
+                    for file_id, when in batch.items():
+                        previous = self._pending.get(file_id)
+                        if previous is None or when > previous:
+                            self._pending[file_id] = when
+                return 0
+
+            return len(batch)
+
+    def _write(self, batch: dict[int, datetime]) -> None:
+        items = sorted(batch.items())
+
+        for start in range(0, len(items), FLUSH_BATCH):
+            chunk = items[start:start + FLUSH_BATCH]
+            new_value = Case(
+                *[When(id=file_id, then=Value(when)) for file_id, when in chunk],
+                output_field=DateTimeField(),
+            )
+            # другие воркеры могли уже записать более позднее время
+            File.objects.filter(id__in=[file_id for file_id, _ in chunk])\
+                .update(last_downloaded=Greatest(
+                    Coalesce(F('last_downloaded'), new_value),
+                    new_value,
+                ))
+
+    def _ensure_thread(self) -> None:
+        # после fork (воркеры gunicorn) поток нужно запускать заново
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        self._pid = os.getpid()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='last-downloaded-flusher',
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(settings.LAST_DOWNLOADED_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+
+
+last_downloaded_buffer = LastDownloadedBuffer()
+
+# при штатной остановке воркера дописываем всё, что накопилось
+atexit.register(last_downloaded_buffer.flush)
@@ -0,0 +1,159 @@
+import os
+import time
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .backends import get_storage_backend
+
+ENCODINGS = ('gzip', 'zstd')
+CODEC_CHUNK = 1024 * 1024
+# по началу файла решаем, есть ли смысл сжимать его целиком
+SAMPLE_BYTES = 1024 * 1024
+
+# уже сжатые форматы: повторное сжатие их не уменьшит, только потратит CPU
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.7z', '.apk', '.avif', '.bz2', '.docx', '.epub', '.flac', '.gif',
+    '.gz', '.heic', '.jar', '.jpeg', '.jpg', '.m4a', '.m4v', '.mkv',
+    '.mov', '.mp3', '.mp4', '.odp', '.ods', '.odt', '.ogg', '.opus',
+    '.png', '.pptx', '.rar', '.tgz', '.webm', '.webp', '.xlsx', '.xz',
+    '.zip', '.zst',
+}
+
+
+def zstandard_module():
+    try:
+        import zstandard
+    except ImportError as exc:
+        raise ImproperlyConfigured(
+            'STORAGE_COMPRESSION=zstd requires zstandard (pip install zstandard)'
+        ) from exc
+    return zstandard
+
+def compressor(encoding: str):
+    level = settings.STORAGE_COMPRESSION_LEVEL
+
+    if encoding == 'gzip':
+        return zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+
+    if encoding == 'zstd':
+        zstandard = zstandard_module()
+        return zstandard.ZstdCompressor(
+            level=3 if level is None else level
+        ).compressobj()
+
+    raise ValueError(f'Unknown encoding: {encoding}')
+
+def is_compressible(original_name: str, size_bytes: int) -> bool:
+    _, ext = os.path.splitext(original_name)
+    return (
+        settings.STORAGE_COMPRESSION in ENCODINGS
+        and size_bytes >= settings.STORAGE_COMPRESSION_MIN_SIZE
+        and ext.lower() not in INCOMPRESSIBLE_EXTENSIONS
+    )
+
+def worth_storing(stored_bytes: int, size_bytes: int) -> bool:
+    return stored_bytes <= size_bytes * settings.STORAGE_COMPRESSION_MAX_RATIO
+
+# сжимает src в dst. Возвращает (размер сжатого или None — сжимать
+# невыгодно, dst тогда удалён; затраченное CPU-время в мс)
+def compress_file(src: Path, dst: Path, encoding: str):
+    started = time.thread_time()
+    stored_bytes = None
+
+    with src.open('rb') as inp:
+        sample = inp.read(SAMPLE_BYTES)
+        probe = compressor(encoding)
+        probe_size = len(probe.compress(sample)) + len(probe.flush())
+
+        if worth_storing(probe_size, len(sample)):
+            inp.seek(0)
+            codec = compressor(encoding)
+            written = 0
+            with dst.open('wb') as out:
+                for chunk in iter(lambda: inp.read(CODEC_CHUNK), b''):
+                    written += out.write(codec.compress(chunk))
+                written += out.write(codec.flush())
+
+            if worth_storing(written, src.stat().st_size):
+                stored_bytes = written
+            else:
+                dst.unlink(missing_ok=True)
+
+    compress_ms = int((time.thread_time() - started) * 1000)
+    return stored_bytes, compress_ms
+
+
+class ChunkReader:
+    # file-like поверх итератора байтов — для zstandard.read_to_iter
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+def iter_decoded(encoding: str, chunks):
+    # выход ограничен CODEC_CHUNK на шаг: сильно сжатые данные (нули,
+    # повторы) не раздувают память при распаковке
+    if encoding == 'gzip':
+        codec = zlib.decompressobj(31)
+        for chunk in chunks:
+            while chunk:
+                data = codec.decompress(chunk, CODEC_CHUNK)
+                if data:
+                    yield data
+                chunk = codec.unconsumed_tail
+        data = codec.flush()
+        if data:
+            yield data
+        return
+
+    if encoding == 'zstd':
+        zstandard = zstandard_module()
+        yield from zstandard.ZstdDecompressor().read_to_iter(
+            ChunkReader(chunks),
+            read_size=CODEC_CHUNK,
+            write_size=CODEC_CHUNK,
+        )
+        return
+
+    raise ValueError(f'Unknown encoding: {encoding}')
+
+def iter_content(file_obj, start: int = 0, end: int = None):
+    # байты [start, end] исходного содержимого файла, в каком бы виде
+    # он ни лежал в хранилище
+    backend = get_storage_backend()
+    if end is None:
+        end = file_obj.size_bytes - 1
+
+    if not file_obj.encoding:
+        yield from backend.iter_range(file_obj.relative_path, start, end)
+        return
+
+    if end < start:
+        return
+
+    stored = backend.iter_range(
+        file_obj.relative_path, 0, file_obj.stored_bytes - 1
+    )
+    pos = 0
+    for data in iter_decoded(file_obj.encoding, stored):
+        data_end = pos + len(data)
+        if data_end > start:
+            yield data[max(start - pos, 0):end + 1 - pos]
+        pos = data_end
+        if pos > end:
+            return
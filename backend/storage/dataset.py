@@ -0,0 +1,246 @@
+import math
+import random
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+
+from users.models import User
+from users.services import adjust_storage_usage, set_user_level
+from .backends import get_storage_backend
+from .models import File
+from .services import stored_file_relative_path
+
+# Синтетические пользователи и файлы для замеров на больших объёмах
+# (manage.py generate_dataset). Всё выводится из одного random.Random,
+# так что при том же seed и префиксе данные те же, кроме сдвига дат
+# относительно момента запуска
+
+# доли уровней; первые четыре пользователя — по одному каждого уровня
+LEVEL_WEIGHTS = {
+    'user': 0.95,
+    'admin': 0.035,
+    'senior_admin': 0.01,
+    'superuser': 0.005,
+}
+
+# (вес, расширения, медиана размера в байтах, sigma логнормального)
+FILE_KINDS = (
+    (30, ('jpg', 'png', 'heic'), 2_500_000, 0.8),
+    (25, ('pdf', 'docx', 'xlsx', 'pptx'), 300_000, 1.2),
+    (25, ('txt', 'md', 'csv', 'json', 'py'), 8_000, 1.5),
+    (12, ('zip', '7z', 'rar'), 20_000_000, 1.5),
+    (8, ('mp4', 'mov', 'mkv'), 200_000_000, 1.0),
+)
+
+NAME_WORDS = (
+    'report', 'invoice', 'contract', 'notes', 'backup', 'draft', 'budget',
+    'presentation', 'thesis', 'vacation', 'meeting', 'summary', 'plan',
+    'design', 'export', 'scan', 'photo', 'project', 'final', 'archive',
+    'отчёт', 'договор', 'счёт', 'заметки', 'фото', 'проект', 'смета',
+)
+COMMENTS = (
+    'for review', 'final version', 'do not delete', 'sent to client',
+    'old copy', 'signed', 'черновик', 'на согласование', 'от бухгалтерии',
+)
+COMMENT_RATE = 0.2
+SHARE_RATE = 0.02
+DOWNLOADED_RATE = 0.3
+
+FILE_COLUMNS = (
+    'owner_id', 'original_name', 'stored_name', 'relative_path',
+    'size_bytes', 'encoding', 'stored_bytes', 'compress_ms', 'blob_id',
+    'comment', 'uploaded', 'last_downloaded', 'share_token', 'share_created',
+)
+
+
+class DatasetGenerator:
+
+    def __init__(self, users: int, files_per_user: int, seed: int,
+                 prefix: str, password: str, days: int,
+                 placeholders: bool, batch_size: int, report):
+        self.users = users
+        self.files_per_user = files_per_user
+        self.prefix = prefix
+        self.days = days
+        self.placeholders = placeholders
+        self.report = report
+        # и префикс в seed: с другим префиксом не совпадут stored_name
+        self.random = random.Random(f'{seed}:{prefix}')
+        self.now = timezone.now()
+        # хэш один на всех: make_password на каждого — минуты на миллион
+        self.password = make_password(password)
+        self.batch_size = max(1, batch_size)
+        self.created_users = self.created_files = 0
+
+        if placeholders:
+            self.backend = get_storage_backend()
+
+        self.kinds = [kind[1:] for kind in FILE_KINDS]
+        self.kind_weights = [kind[0] for kind in FILE_KINDS]
+
+    def run(self) -> tuple[int, int]:
+        users, levels, rows = [], [], []
+
+        for n in range(self.users):
+            user, level = self.make_user(n)
+            users.append(user)
+            levels.append(level)
+
+            # пачка ограничена числом строк, а не пользователей: файлы
+            # одного пользователя могут разойтись по нескольким пачкам
+            for _ in range(self.files_per_user):
+                rows.append(self.make_file(user))
+                if len(rows) >= self.batch_size:
+                    self.flush(users, levels, rows)
+
+            if len(users) >= self.batch_size:
+                self.flush(users, levels, rows)
+
+        if users or rows:
+            self.flush(users, levels, rows)
+
+        analyze((User, File))
+        return self.created_users, self.created_files
+
+    # вставляет накопленное одной транзакцией и очищает списки
+    def flush(self, users, levels, rows) -> None:
+        usage = {}
+        for row in rows:
+            owner, count, size = usage.get(id(row[0]), (row[0], 0, 0))
+            usage[id(owner)] = (owner, count + 1, size + row[4])
+
+        # пользователь, чьи файлы начались в прошлой пачке, уже вставлен
+        carried = [item for item in usage.values() if item[0].pk]
+        for owner, count, size in usage.values():
+            if not owner.pk:
+                owner.files_count, owner.used_bytes = count, size
+
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            # флаги уровней — той же функцией, что и в админке
+            for user, level in zip(users, levels):
+                if level != 'user':
+                    set_user_level(user, level)
+
+            file_rows = [(row[0].id, *row[1:]) for row in rows]
+            insert_rows(File, FILE_COLUMNS, file_rows)
+
+            for owner, count, size in carried:
+                adjust_storage_usage(owner.id, count, size)
+
+        if self.placeholders:
+            self.write_placeholders(file_rows)
+
+        self.created_users += len(users)
+        self.created_files += len(file_rows)
+        self.report(
+            f'Users {self.created_users}/{self.users}, files {self.created_files}'
+        )
+        users.clear()
+        levels.clear()
+        rows.clear()
+
+    def uuid(self) -> uuid.UUID:
+        return uuid.UUID(int=self.random.getrandbits(128), version=4)
+
+    def make_user(self, n: int) -> tuple[User, str]:
+        levels = list(LEVEL_WEIGHTS)
+        if n < len(levels):
+            level = levels[-1 - n]
+        else:
+            level = self.random.choices(levels, list(LEVEL_WEIGHTS.values()))[0]
+
+        username = f'{self.prefix}{n}'
+        user = User(
+            username=username,
+            full_name=f'Bench User {n}',
+            email=f'{username}@bench.invalid',
+            password=self.password,
+            storage_rel_path=f'{username}_{self.uuid()}/',
+            date_joined=self.now - timedelta(days=self.days),
+        )
+        return user, level
+
+    def make_name(self, ext: str) -> str:
+        rnd = self.random
+        if ext in ('jpg', 'heic', 'mov'):
+            return f'IMG_{rnd.randrange(10000):04d}.{ext}'
+        words = rnd.sample(NAME_WORDS, rnd.randint(1, 3))
+        if rnd.random() < 0.3:
+            words.append(str(rnd.randint(2015, self.now.year)))
+        return f'{"_".join(words)}.{ext}'
+
+    # строка File; вместо owner_id — сам пользователь: id у него
+    # появится только при вставке
+    def make_file(self, user: User) -> tuple:
+        rnd = self.random
+        extensions, median, sigma = rnd.choices(self.kinds, self.kind_weights)[0]
+        ext = rnd.choice(extensions)
+        size = max(0, int(rnd.lognormvariate(math.log(median), sigma)))
+
+        stored_name = f'{self.uuid().hex}.{ext}'
+        uploaded = self.now - timedelta(seconds=rnd.uniform(0, self.days * 86400))
+        age = (self.now - uploaded).total_seconds()
+
+        last_downloaded = None
+        if rnd.random() < DOWNLOADED_RATE:
+            last_downloaded = uploaded + timedelta(seconds=rnd.uniform(0, age))
+
+        share_token = share_created = None
+        if rnd.random() < SHARE_RATE:
+            share_token = self.uuid()
+            share_created = uploaded + timedelta(seconds=rnd.uniform(0, age))
+
+        comment = rnd.choice(COMMENTS) if rnd.random() < COMMENT_RATE else None
+
+        return (
+            user,
+            self.make_name(ext),
+            stored_name,
+            stored_file_relative_path(user.storage_rel_path, stored_name),
+            size, '', size, 0, None,
+            comment, uploaded, last_downloaded, share_token, share_created,
+        )
+
+    def write_placeholders(self, rows) -> None:
+        # разреженные файлы нужного размера: место на диске не занимают
+        for row in rows:
+            path = self.backend.path(row[3])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'wb') as f:
+                f.truncate(row[4])
+
+def insert_rows(model, columns, rows) -> None:
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = ', '.join(connection.ops.quote_name(c) for c in columns)
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # COPY на порядок быстрее INSERT
+            with cursor.cursor.copy(f'COPY {table} ({names}) FROM STDIN') as copy:
+                for row in rows:
+                    copy.write_row(row)
+            return
+
+        # прочие БД (sqlite в разработке): значения через поля модели
+        fields = [model._meta.get_field(c.removesuffix('_id')) for c in columns]
+        prepared = [
+            [f.get_db_prep_value(v, connection) for f, v in zip(fields, row)]
+            for row in rows
+        ]
+        cursor.executemany(
+            f'INSERT INTO {table} ({names}) '
+            f'VALUES ({", ".join(["%s"] * len(columns))})',
+            prepared,
+        )
+
+def analyze(models) -> None:
+    # статистика планировщика после загрузки миллионов строк устарела
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for model in models:
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
@@ -0,0 +1,345 @@
+import hashlib
+import heapq
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from operator import itemgetter
+
+from django.db import connection
+from django.db.models import F
+from django.db.models.functions import Collate
+from django.utils import timezone
+
+from .backends import get_storage_backend
+from .compression import iter_content
+from .models import (
+    STORAGE_PATH_COLLATION,
+    Blob,
+    File,
+    Rendition,
+    StorageCheck,
+    StoragePurge,
+    rendition_path,
+)
+from .services import (
+    UPLOADS_DIR_NAME,
+    delete_stored_files,
+    purge_unreferenced_blobs,
+    rendition_relative_path,
+)
+
+DB_CHUNK = 2000
+# сколько путей обход одного поддерева может опередить чтение из БД
+SCAN_PREFETCH = 10000
+# хранилище делится на поддеревья до этой глубины (каталоги
+# пользователей, .blobs/ab/) — их обходят параллельно
+SCAN_SPLIT_DEPTH = 2
+REPAIR_BATCH = 1000
+# прогон без обновлений дольше этого считается прерванным
+STORAGE_CHECK_STALE = timedelta(minutes=30)
+
+
+def path_order(expression):
+    # сравнение строк побайтово, как у backend.scan; иначе порядок
+    # зависит от collation базы и слияние двух потоков не сойдётся.
+    # Под эти выражения есть индексы storage_*_path
+    collation = {
+        'postgresql': STORAGE_PATH_COLLATION, 'sqlite': 'BINARY',
+    }.get(connection.vendor)
+    return Collate(expression, collation) if collation else expression
+
+def iter_rows(qs, kind: str, checkpoint: str):
+    rows = qs.filter(path__gt=checkpoint).order_by('path')\
+        .iterator(chunk_size=DB_CHUNK)
+    for path, *rest in rows:
+        yield (path, kind, *rest)
+
+# ожидаемое содержимое хранилища по БД: (path, kind, id, stored_bytes, ...)
+# по возрастанию path. Строки моложе начала прогона не проверяем:
+# их файлы обход мог уже пропустить
+def iter_expected(check: StorageCheck):
+    files = File.objects\
+        .filter(blob__isnull=True, uploaded__lt=check.created)\
+        .annotate(path=path_order(F('relative_path')))\
+        .values_list('path', 'id', 'stored_bytes')
+
+    blobs = Blob.objects\
+        .filter(created__lt=check.created)\
+        .annotate(path=path_order(F('relative_path')))\
+        .values_list('path', 'id', 'stored_bytes', 'digest', 'encoding', 'size_bytes')
+
+    renditions = Rendition.objects\
+        .filter(status=Rendition.STATUS_READY, updated__lt=check.created)\
+        .annotate(path=path_order(rendition_path()))\
+        .values_list('path', 'id', 'size_bytes')
+
+    return heapq.merge(
+        iter_rows(files, 'file', check.checkpoint),
+        iter_rows(blobs, 'blob', check.checkpoint),
+        iter_rows(renditions, 'rendition', check.checkpoint),
+        key=itemgetter(0),
+    )
+
+def split_stored(backend, checkpoint: str, prefix: str = '', depth: int = 1):
+    # по порядку путей: файлы верхних уровней — сразу списком, каталоги
+    # глубины SCAN_SPLIT_DEPTH — префиксами для отдельного обхода.
+    # staging незавершённых загрузок — не наша забота (purge_upload_sessions)
+    staging = f'{UPLOADS_DIR_NAME}/'
+    for path, size, mtime in backend.children(prefix):
+        if size is not None:
+            if path > checkpoint:
+                yield [(path, 'stored', size, mtime)]
+        elif path == staging:
+            continue
+        elif path < checkpoint and not checkpoint.startswith(path):
+            # поддерево целиком до checkpoint — уже пройдено
+            continue
+        elif depth < SCAN_SPLIT_DEPTH:
+            yield from split_stored(backend, checkpoint, path, depth + 1)
+        else:
+            yield path
+
+def scan_stored(backend, prefix: str, checkpoint: str):
+    for path, size, mtime in backend.scan(prefix, checkpoint):
+        yield path, 'stored', size, mtime
+
+def iter_stored(checkpoint: str, workers: int):
+    # поддеревья не пересекаются и идут по порядку, поэтому их можно
+    # обходить параллельно (до workers вперёд, каждое в своём потоке)
+    # и выдавать подряд — получается один отсортированный поток
+    backend = get_storage_backend()
+    running = deque()
+
+    for part in split_stored(backend, checkpoint):
+        if isinstance(part, str):
+            part = prefetch(scan_stored(backend, part, checkpoint), SCAN_PREFETCH)
+        running.append(part)
+        if len(running) >= workers:
+            yield from running.popleft()
+
+    while running:
+        yield from running.popleft()
+
+def prefetch(iterator, size: int):
+    # поток стартует сразу, а не при первом next(): так несколько
+    # поддеревьев обходятся одновременно; очередь ограничена, память тоже
+    items = queue.Queue(size)
+    done = object()
+    errors = []
+
+    def run():
+        try:
+            for item in iterator:
+                items.put(item)
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            items.put(done)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    def drain():
+        while (item := items.get()) is not done:
+            yield item
+
+        if errors:
+            raise errors[0]
+
+    return drain()
+
+def blob_checksum_ok(row) -> bool:
+    path, _, _, stored_bytes, digest, encoding, size_bytes = row
+    # iter_content нужны только эти поля
+    blob = Blob(
+        relative_path=path,
+        stored_bytes=stored_bytes,
+        encoding=encoding,
+        size_bytes=size_bytes,
+    )
+    sha256 = hashlib.sha256()
+    for chunk in iter_content(blob):
+        sha256.update(chunk)
+    return sha256.hexdigest() == digest
+
+
+class StorageChecker:
+    # Сверяет БД и хранилище слиянием двух отсортированных потоков: строк
+    # File/Blob/Rendition и backend.scan. Память не растёт с числом файлов,
+    # каждые batch_size путей прогресс сохраняется в StorageCheck
+
+    def __init__(self, check: StorageCheck, report, workers: int = 4,
+                 grace_seconds: int = 3600, batch_size: int = 1000):
+        self.check = check
+        self.report = report
+        self.workers = workers
+        self.grace_seconds = grace_seconds
+        self.batch_size = batch_size
+
+        self.backend = get_storage_backend()
+        self.pending = {}
+        self.orphan_paths = []
+        self.broken = {'file': [], 'blob': [], 'rendition': []}
+
+    def run(self) -> None:
+        # каталоги удалённых пользователей, которые ещё чистит воркер
+        self.purging = tuple(
+            StoragePurge.objects.exclude(status=StoragePurge.STATUS_DONE)
+            .values_list('relative_path', flat=True)
+        )
+
+        merged = heapq.merge(
+            iter_stored(self.check.checkpoint, self.workers),
+            iter_expected(self.check),
+            key=itemgetter(0),
+        )
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            self.pool = pool
+            path = None
+            for n, (path, items) in enumerate(
+                itertools.groupby(merged, key=itemgetter(0)), 1
+            ):
+                self.check_path(path, list(items))
+                if n % self.batch_size == 0:
+                    self.save_progress(path)
+
+            self.save_progress(path)
+
+        self.check.status = StorageCheck.STATUS_DONE
+        self.check.finished = timezone.now()
+        self.check.save()
+
+    def check_path(self, path: str, items) -> None:
+        stored = next((i for i in items if i[1] == 'stored'), None)
+        rows = [i for i in items if i[1] != 'stored']
+        self.check.checked += 1
+
+        if not rows:
+            self.orphan(*stored)
+            return
+
+        for row in rows:
+            kind, row_id, expected = row[1], row[2], row[3]
+
+            if stored is None:
+                self.check.missing += 1
+                self.report(f'missing {kind} {row_id} {path}')
+                self.broken[kind].append(row_id)
+            elif stored[2] != expected:
+                self.check.size_mismatches += 1
+                self.report(
+                    f'size {kind} {row_id} {path}: '
+                    f'expected {expected}, stored {stored[2]}'
+                )
+                # rendition можно сгенерировать заново, остальное — только отчёт
+                if kind == 'rendition':
+                    self.broken[kind].append(row_id)
+            elif kind == 'blob' and self.check.verify:
+                self.verify(row)
+
+    def orphan(self, path: str, kind: str, size: int, mtime: float) -> None:
+        # свежий файл может принадлежать загрузке, которая ещё не
+        # закоммитила строку в БД
+        if mtime > time.time() - self.grace_seconds:
+            return
+        if self.purging and path.startswith(self.purging):
+            return
+
+        self.check.orphans += 1
+        self.check.orphan_bytes += size
+        self.report(f'orphan {path} {size}')
+
+        if self.check.repair:
+            self.orphan_paths.append(path)
+            if len(self.orphan_paths) >= REPAIR_BATCH:
+                self.delete_orphans()
+
+    def verify(self, row) -> None:
+        self.pending[self.pool.submit(blob_checksum_ok, row)] = row
+        if len(self.pending) >= self.workers * 4:
+            done, _ = wait(self.pending, return_when=FIRST_COMPLETED)
+            self.collect(done)
+
+    def collect(self, done) -> None:
+        for future in done:
+            row = self.pending.pop(future)
+            try:
+                ok = future.result()
+            except FileNotFoundError:
+                # blob удалили, пока мы до него дошли
+                continue
+            if not ok:
+                self.check.checksum_mismatches += 1
+                self.report(f'checksum blob {row[2]} {row[0]}')
+
+    def save_progress(self, path) -> None:
+        # checkpoint сдвигается, только когда всё до него проверено
+        self.collect(list(self.pending))
+        if self.check.repair:
+            self.delete_orphans()
+            self.repair_broken()
+
+        if path is not None:
+            self.check.checkpoint = path
+        self.check.save()
+
+    def delete_orphans(self) -> None:
+        paths = self.orphan_paths
+        self.orphan_paths = []
+        if not paths:
+            return
+
+        # за время прогона на путь могла появиться строка
+        referenced = set(
+            File.objects.filter(relative_path__in=paths)
+            .values_list('relative_path', flat=True)
+        )
+        referenced.update(
+            Blob.objects.filter(relative_path__in=paths)
+            .values_list('relative_path', flat=True)
+        )
+        sources = {path.rpartition('.')[0] for path in paths}
+        referenced.update(
+            rendition_relative_path(source_path, kind)
+            for source_path, kind in Rendition.objects
+            .filter(source_path__in=sources).values_list('source_path', 'kind')
+        )
+
+        orphans = [path for path in paths if path not in referenced]
+        self.backend.delete_many(orphans)
+        self.check.repaired += len(orphans)
+
+    def repair_broken(self) -> None:
+        # данных нет — строки удаляются (со счётчиками квоты и ссылками
+        # blob-ов); перед этим ещё раз убеждаемся, что данных правда нет
+        file_ids, blob_ids, rendition_ids = (
+            self.broken['file'], self.broken['blob'], self.broken['rendition']
+        )
+        self.broken = {'file': [], 'blob': [], 'rendition': []}
+
+        files = [
+            f for f in File.objects.filter(id__in=file_ids, blob__isnull=True)
+            if not self.backend.exists(f.relative_path)
+        ]
+        delete_stored_files(files)
+        self.check.repaired += len(files)
+
+        for blob in Blob.objects.filter(id__in=blob_ids):
+            if self.backend.exists(blob.relative_path):
+                continue
+            delete_stored_files(list(File.objects.filter(blob=blob)))
+            # blob без файлов (ref_count 0) delete_stored_files не заденет
+            purge_unreferenced_blobs([blob.id])
+            self.check.repaired += 1
+
+        renditions = Rendition.objects.filter(id__in=rendition_ids)
+        paths = [
+            rendition_relative_path(r.source_path, r.kind) for r in renditions
+        ]
+        renditions.delete()
+        self.backend.delete_many(paths)
+        self.check.repaired += len(paths)
@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from storage.backends import get_storage_backend
+from storage.dataset import DatasetGenerator
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generate synthetic users and files for benchmarking ' \
+           '(deterministic for a given --seed and --prefix)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--files-per-user', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--prefix',
+            default='bench',
+            help='Username prefix; generated users are <prefix><n>',
+        )
+        parser.add_argument('--password', default='Bench#1')
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=3 * 365,
+            help='Upload dates are spread over this many days back',
+        )
+        parser.add_argument(
+            '--placeholders',
+            action='store_true',
+            help='Also create sparse files of the right size in storage',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100_000,
+            help='File rows inserted per transaction',
+        )
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f'Users with prefix {prefix!r} already exist, pick another --prefix'
+            )
+        if options['placeholders'] and not get_storage_backend().is_local:
+            raise CommandError('--placeholders needs local storage')
+
+        generator = DatasetGenerator(
+            users=options['users'],
+            files_per_user=options['files_per_user'],
+            seed=options['seed'],
+            prefix=prefix,
+            password=options['password'],
+            days=options['days'],
+            placeholders=options['placeholders'],
+            batch_size=options['batch_size'],
+            report=self.stdout.write,
+        )
+
+        started = time.monotonic()
+        users, files = generator.run()
+        self.stdout.write(
+            f'Created users: {users}, files: {files} '
+            f'in {time.monotonic() - started:.0f}s'
+        )
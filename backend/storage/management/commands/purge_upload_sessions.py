@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from storage.services import purge_stale_upload_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable upload sessions (and their staging files) ' \
+           'that have not received data for a while'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age-hours',
+            type=int,
+            default=settings.UPLOAD_SESSION_TTL_HOURS,
+        )
+
+    def handle(self, *args, **options):
+        purged = purge_stale_upload_sessions(
+            timedelta(hours=options['max_age_hours'])
+        )
+        self.stdout.write(f'Purged upload sessions: {purged}')
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from storage.models import StoragePurge
+from storage.services import (
+    claim_storage_purge,
+    run_storage_purge,
+    STORAGE_PURGE_BATCH,
+)
+
+
+class Command(BaseCommand):
+    help = 'Delete storage directories of removed users ' \
+           '(queued by admin_user_delete with delete_files=1)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=STORAGE_PURGE_BATCH,
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep polling for new purges instead of exiting',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=5,
+            help='Polling interval in seconds for --loop',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            purge = claim_storage_purge()
+
+            if purge is None:
+                if not options['loop']:
+                    return
+                time.sleep(options['interval'])
+                continue
+
+            run_storage_purge(purge, batch_size=options['batch_size'])
+            purge = StoragePurge.objects.get(id=purge.id)
+            self.stdout.write(
+                f'Purge {purge.id} ({purge.username}): {purge.status}, '
+                f'files deleted: {purge.files_deleted}'
+            )
@@ -0,0 +1,86 @@
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from storage.backends import get_storage_backend
+from storage.models import File
+from storage.services import (
+    delete_renditions,
+    relayout_stored_file,
+    stored_file_relative_path,
+)
+
+
+class Command(BaseCommand):
+    help = 'Move stored files into the STORAGE_FANOUT_LEVELS layout ' \
+           'while the service keeps running'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--grace-seconds',
+            type=int,
+            default=2 * settings.CACHES['shares']['TIMEOUT'],
+            help='How long old paths stay valid after a file is moved',
+        )
+
+    def handle(self, *args, **options):
+        if not get_storage_backend().is_local:
+            raise CommandError('Fan-out layout applies to local storage only')
+
+        grace = options['grace_seconds']
+        # (когда можно удалить, [старые пути])
+        retired = deque()
+        moved = 0
+        last_id = 0
+
+        while True:
+            # blob-ы (дедупликация) уже разложены по хэшу, их не трогаем
+            batch = list(
+                File.objects.filter(blob__isnull=True, id__gt=last_id)
+                .order_by('id')
+                .values_list(
+                    'id',
+                    'relative_path',
+                    'stored_name',
+                    'owner__storage_rel_path',
+                    'share_token',
+                )[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            old_paths = []
+            for file_id, old_rel, stored_name, owner_rel, token in batch:
+                new_rel = stored_file_relative_path(owner_rel, stored_name)
+                if new_rel == old_rel:
+                    continue
+
+                if relayout_stored_file(file_id, old_rel, new_rel, token):
+                    old_paths.append(old_rel)
+
+            moved += len(old_paths)
+            retired.append((time.monotonic() + grace, old_paths))
+            self.unlink_retired(retired, wait=False)
+
+            self.stdout.write(f'Processed up to id {last_id}, moved: {moved}')
+
+        self.unlink_retired(retired, wait=True)
+        self.stdout.write(f'Files moved: {moved}')
+
+    def unlink_retired(self, retired, wait: bool) -> None:
+        while retired:
+            deadline, old_paths = retired[0]
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                if not wait:
+                    return
+                time.sleep(delay)
+
+            retired.popleft()
+            get_storage_backend().delete_many(old_paths)
+            # по новому пути renditions сгенерируются заново
+            delete_renditions(old_paths)
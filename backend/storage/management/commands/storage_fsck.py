@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from storage.fsck import STORAGE_CHECK_STALE, StorageChecker
+from storage.models import StorageCheck
+
+
+class Command(BaseCommand):
+    help = 'Check that files, blobs and renditions in the database match ' \
+           'what is in storage: orphans, missing data, size mismatches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Also recompute sha256 of every blob',
+        )
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            help='Delete orphaned files and rows whose data is missing',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue the last interrupted run from its checkpoint',
+        )
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--grace-seconds',
+            type=int,
+            default=3600,
+            help='Files modified more recently are never reported as orphans',
+        )
+
+    def handle(self, *args, **options):
+        last = StorageCheck.objects.order_by('-id').first()
+
+        if (last and last.status == StorageCheck.STATUS_RUNNING
+                and last.updated > timezone.now() - STORAGE_CHECK_STALE):
+            raise CommandError(f'Check {last.id} is still running')
+
+        if options['resume'] and last and last.status != StorageCheck.STATUS_DONE:
+            check = last
+            check.status = StorageCheck.STATUS_RUNNING
+            check.error = ''
+            check.finished = None
+            self.stdout.write(
+                f'Resuming check {check.id} after {check.checkpoint!r}'
+            )
+        else:
+            check = StorageCheck.objects.create()
+
+        check.verify = options['verify']
+        check.repair = options['repair']
+
+        checker = StorageChecker(
+            check,
+            self.stdout.write,
+            workers=options['workers'],
+            grace_seconds=options['grace_seconds'],
+            batch_size=options['batch_size'],
+        )
+        try:
+            checker.run()
+        except BaseException as exc:
+            # в том числе Ctrl+C: прогон можно продолжить с --resume
+            check.status = StorageCheck.STATUS_FAILED
+            check.error = str(exc) or exc.__class__.__name__
+            check.finished = timezone.now()
+            check.save()
+            raise
+
+        self.stdout.write(
+            f'Check {check.id}: paths {check.checked}, '
+            f'orphans {check.orphans} ({check.orphan_bytes} bytes), '
+            f'missing {check.missing}, size mismatches {check.size_mismatches}, '
+            f'checksum mismatches {check.checksum_mismatches}, '
+            f'repaired {check.repaired}'
+        )
@@ -0,0 +1,220 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Под gunicorn каждый воркер — отдельный процесс со своими счётчиками.
+# При заданном PROMETHEUS_MULTIPROC_DIR prometheus_client пишет значения
+# в mmap-файлы этого каталога, а /metrics суммирует файлы всех воркеров
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+# 64 КиБ/с .. 1 ГиБ/с, шаг ×4
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 4 ** n for n in range(8))
+# по мелким файлам скорость не измерить: в ней одни накладные расходы
+THROUGHPUT_MIN_BYTES = 1024 * 1024
+
+REQUEST_SECONDS = Histogram(
+    'mycloud_http_request_duration_seconds',
+    'Time until the view returned a response (streamed bodies excluded)',
+    ['view', 'method'],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter(
+    'mycloud_http_requests',
+    'Requests by response status',
+    ['view', 'method', 'status'],
+)
+DB_QUERIES = Histogram(
+    'mycloud_http_request_db_queries',
+    'Database queries per request',
+    ['view'],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+DB_SECONDS = Histogram(
+    'mycloud_http_request_db_seconds',
+    'Time spent in database queries per request',
+    ['view'],
+    buckets=LATENCY_BUCKETS,
+)
+TRANSFER_BYTES = Counter(
+    'mycloud_transfer_bytes',
+    'File content bytes received or sent',
+    ['direction', 'view'],
+)
+TRANSFERS_IN_FLIGHT = Gauge(
+    'mycloud_transfers_in_flight',
+    'Uploads being received and downloads being sent',
+    ['direction'],
+    multiprocess_mode='livesum',
+)
+TRANSFER_THROUGHPUT = Histogram(
+    'mycloud_transfer_throughput_bytes_per_second',
+    f'Per-transfer throughput, transfers of {THROUGHPUT_MIN_BYTES} bytes or more',
+    ['direction'],
+    buckets=THROUGHPUT_BUCKETS,
+)
+AUTH_ATTEMPTS = Counter(
+    'mycloud_auth_attempts',
+    'Login and registration attempts',
+    ['action', 'result'],
+)
+
+
+class QueryStats:
+    # запросы к БД в пределах одного HTTP-запроса
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+# Под ASGI запросы к БД идут из потоков sync_to_async, у каждого своё
+# соединение, так что connection.execute_wrapper в middleware их не видит.
+# Поэтому обёртка стоит на каждом соединении постоянно, а QueryStats
+# текущего запроса берёт из contextvar — он доходит и до этих потоков
+current_query_stats = ContextVar('current_query_stats', default=None)
+
+def count_query(execute, sql, params, many, context):
+    stats = current_query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+def install_query_counter(sender, connection, **kwargs):
+    # connection_created приходит и при переподключении того же объекта
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def view_label(request) -> str:
+    # имя из urls.py: число значений ограничено, в отличие от пути
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unmatched'
+
+def observe_request(request, response, seconds: float, stats: QueryStats) -> None:
+    view = view_label(request)
+    REQUEST_SECONDS.labels(view, request.method).observe(seconds)
+    REQUESTS.labels(view, request.method, response.status_code).inc()
+    DB_QUERIES.labels(view).observe(stats.count)
+    DB_SECONDS.labels(view).observe(stats.seconds)
+
+def finish_transfer(direction: str, size: int, seconds: float) -> None:
+    if size >= THROUGHPUT_MIN_BYTES and seconds > 0:
+        TRANSFER_THROUGHPUT.labels(direction).observe(size / seconds)
+
+@contextmanager
+def upload_in_flight():
+    TRANSFERS_IN_FLIGHT.labels('upload').inc()
+    try:
+        yield
+    finally:
+        TRANSFERS_IN_FLIGHT.labels('upload').dec()
+
+def record_upload(request, size: int, seconds: float) -> None:
+    TRANSFER_BYTES.labels('upload', view_label(request)).inc(size)
+    finish_transfer('upload', size, seconds)
+
+def iter_counted(chunks, view: str):
+    # в полёте — с первого куска и до конца (или обрыва) передачи
+    sent = 0
+    started = None
+    try:
+        for chunk in chunks:
+            if started is None:
+                started = time.perf_counter()
+                TRANSFERS_IN_FLIGHT.labels('download').inc()
+            sent += len(chunk)
+            TRANSFER_BYTES.labels('download', view).inc(len(chunk))
+            yield chunk
+    finally:
+        if started is not None:
+            TRANSFERS_IN_FLIGHT.labels('download').dec()
+            finish_transfer('download', sent, time.perf_counter() - started)
+
+async def aiter_counted(chunks, view: str):
+    sent = 0
+    started = None
+    try:
+        async for chunk in chunks:
+            if started is None:
+                started = time.perf_counter()
+                TRANSFERS_IN_FLIGHT.labels('download').inc()
+            sent += len(chunk)
+            TRANSFER_BYTES.labels('download', view).inc(len(chunk))
+            yield chunk
+    finally:
+        if started is not None:
+            TRANSFERS_IN_FLIGHT.labels('download').dec()
+            finish_transfer('download', sent, time.perf_counter() - started)
+
+def track_download(request, response):
+    if response.status_code >= 300:
+        return response
+
+    view = view_label(request)
+
+    if getattr(response, 'file_to_stream', None) is not None:
+        # FileResponse под WSGI уходит через sendfile мимо Python —
+        # куски не видны, считаем Content-Length, когда сервер закроет ответ
+        size = int(response.get('Content-Length') or 0)
+        started = time.perf_counter()
+        close = response.close
+        closed = False
+        TRANSFERS_IN_FLIGHT.labels('download').inc()
+
+        def close_counted():
+            # close() могут вызвать и сервер, и тестовый клиент
+            nonlocal closed
+            if closed:
+                return close()
+            closed = True
+            try:
+                close()
+            finally:
+                TRANSFERS_IN_FLIGHT.labels('download').dec()
+                TRANSFER_BYTES.labels('download', view).inc(size)
+                finish_transfer('download', size, time.perf_counter() - started)
+
+        response.close = close_counted
+    elif response.streaming:
+        if response.is_async:
+            response.streaming_content = aiter_counted(
+                response.streaming_content, view
+            )
+        else:
+            response.streaming_content = iter_counted(
+                response.streaming_content, view
+            )
+    else:
+        TRANSFER_BYTES.labels('download', view).inc(len(response.content))
+
+    return response
+
+def metrics_response():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
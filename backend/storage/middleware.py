@@ -0,0 +1,122 @@
+import json
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.urls import reverse
+
+from users.services import release_storage
+from .metrics import QueryStats, current_query_stats, observe_request
+
+
+# Оба middleware умеют и sync, и async: иначе под ASGI Django соберёт
+# синхронную цепочку и async view снова уйдут в поток через async_to_sync
+
+class StorageReservationMiddleware:
+    # Место под multipart-загрузку резервирует upload handler ещё до чтения
+    # тела; здесь резерв снимается после ответа, чем бы запрос ни кончился
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        try:
+            return self.get_response(request)
+        finally:
+            reserved = getattr(request, 'storage_reserved', 0)
+            if reserved:
+                release_storage(request.user.id, reserved)
+
+    async def __acall__(self, request):
+        try:
+            return await self.get_response(request)
+        finally:
+            reserved = getattr(request, 'storage_reserved', 0)
+            if reserved:
+                await sync_to_async(release_storage)(request.user.id, reserved)
+
+
+class MetricsMiddleware:
+    # Длительность и число/время запросов к БД по каждому view. Стоит
+    # первым, чтобы учесть и остальные middleware (сессии, auth)
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = QueryStats()
+        started = time.perf_counter()
+        token = current_query_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_query_stats.reset(token)
+        observe_request(request, response, time.perf_counter() - started, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        started = time.perf_counter()
+        token = current_query_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_query_stats.reset(token)
+        observe_request(request, response, time.perf_counter() - started, stats)
+        return response
+
+
+class UploadBodyGate:
+    # ASGI-обёртка вокруг всего приложения (config/asgi.py). Django под ASGI
+    # принимает тело целиком до middleware и view, так что квоту upload
+    # handler проверил бы уже после приёма. Поэтому здесь, до чтения тела:
+    # /api/files/upload/ без Content-Length или больше
+    # ASGI_UPLOAD_MAX_BYTES отклоняется — большие файлы идут через
+    # /api/files/uploads/, где квота резервируется при создании сессии
+    def __init__(self, app):
+        self.app = app
+        self.path = reverse('files-upload')
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope['type'] == 'http'
+            and scope['method'] == 'POST'
+            and scope['path'] == self.path
+        ):
+            length = dict(scope['headers']).get(b'content-length', b'')
+            limit = settings.ASGI_UPLOAD_MAX_BYTES
+
+            if not length.isdigit():
+                return await self.reject(send, 411, 'Content-Length required')
+            if int(length) > limit:
+                return await self.reject(
+                    send, 413,
+                    f'Uploads over {limit} bytes must use /api/files/uploads/',
+                )
+
+        await self.app(scope, receive, send)
+
+    async def reject(self, send, status: int, detail: str) -> None:
+        body = json.dumps({'detail': detail}).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'connection', b'close'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
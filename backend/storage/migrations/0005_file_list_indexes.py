@@ -0,0 +1,40 @@
+# Generated by Django 5.2.10 on 2026-10-17 21:46
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # индексы по миллионам строк строятся без блокировки записи
+    atomic = False
+
+    dependencies = [
+        ('storage', '0004_blob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='file',
+            index=models.Index(fields=['owner', '-uploaded', '-id'], name='storage_file_owner_uploaded'),
+        ),
+        AddIndexConcurrently(
+            model_name='file',
+            index=models.Index(fields=['owner', 'original_name', 'id'], name='storage_file_owner_name'),
+        ),
+        AddIndexConcurrently(
+            model_name='file',
+            index=models.Index(fields=['owner', 'size_bytes', 'id'], name='storage_file_owner_size'),
+        ),
+        AddIndexConcurrently(
+            model_name='file',
+            index=models.Index(models.F('owner'), django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Lower('original_name'), 'text_pattern_ops'), name='storage_file_owner_name_prefix'),
+        ),
+        AddIndexConcurrently(
+            model_name='file',
+            index=models.Index(condition=models.Q(('share_token__isnull', False)), fields=['owner', '-uploaded', '-id'], name='storage_file_owner_shared'),
+        ),
+    ]
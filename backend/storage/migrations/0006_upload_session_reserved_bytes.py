@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-17 21:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0005_file_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='reserved_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.10 on 2026-10-17 22:04
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_stored_bytes(apps, schema_editor):
+    # всё, что загружено до этого, лежит несжатым
+    for model_name in ('Blob', 'File'):
+        model = apps.get_model('storage', model_name)
+        model.objects.update(stored_bytes=F('size_bytes'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0007_storage_purge'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='encoding',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='stored_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='compress_ms',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='encoding',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='stored_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(
+            backfill_stored_bytes, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.10 on 2026-10-17 22:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0008_storage_compression'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_path', models.CharField(max_length=500)),
+                ('kind', models.CharField(max_length=32)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('ready', 'Ready'), ('failed', 'Failed')], default='running', max_length=16)),
+                ('content_type', models.CharField(blank=True, default='', max_length=100)),
+                ('size_bytes', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('source_path', 'kind'), name='storage_rendition_source_kind')],
+            },
+        ),
+    ]
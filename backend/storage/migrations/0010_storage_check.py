@@ -0,0 +1,34 @@
+# Generated by Django 5.2.10 on 2026-10-17 22:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0009_rendition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageCheck',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='running', max_length=16)),
+                ('verify', models.BooleanField(default=False)),
+                ('repair', models.BooleanField(default=False)),
+                ('checkpoint', models.CharField(blank=True, default='', max_length=600)),
+                ('checked', models.BigIntegerField(default=0)),
+                ('orphans', models.BigIntegerField(default=0)),
+                ('orphan_bytes', models.BigIntegerField(default=0)),
+                ('missing', models.BigIntegerField(default=0)),
+                ('size_mismatches', models.BigIntegerField(default=0)),
+                ('checksum_mismatches', models.BigIntegerField(default=0)),
+                ('repaired', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.10 on 2026-10-17 22:39
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.operations import (
+    AddIndexConcurrently,
+    BtreeGinExtension,
+    TrigramExtension,
+)
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # индексы по миллионам строк строятся без блокировки записи
+    atomic = False
+
+    dependencies = [
+        ('storage', '0010_storage_check'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        BtreeGinExtension(),
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='file',
+            index=django.contrib.postgres.indexes.GinIndex(models.F('owner'), django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector(models.Func(models.F('original_name'), models.Value('[^[:alnum:]]+'), models.Value(' '), models.Value('g'), function='regexp_replace'), config='simple', weight='A'), '||', django.contrib.postgres.search.SearchVector('comment', config='simple', weight='B'), django.contrib.postgres.search.SearchConfig('simple')), name='storage_file_search'),
+        ),
+        AddIndexConcurrently(
+            model_name='file',
+            index=django.contrib.postgres.indexes.GinIndex(models.F('owner'), django.contrib.postgres.indexes.OpClass('original_name', 'gin_trgm_ops'), name='storage_file_name_trgm'),
+        ),
+    ]
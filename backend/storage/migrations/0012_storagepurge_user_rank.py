@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-17 23:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0011_file_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storagepurge',
+            name='user_rank',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.10 on 2026-10-17 23:08
+
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # индексы по миллионам строк строятся без блокировки записи
+    atomic = False
+
+    dependencies = [
+        ('storage', '0012_storagepurge_user_rank'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='blob',
+            index=models.Index(django.db.models.functions.comparison.Collate('relative_path', 'C'), name='storage_blob_path'),
+        ),
+        AddIndexConcurrently(
+            model_name='file',
+            index=models.Index(django.db.models.functions.comparison.Collate('relative_path', 'C'), condition=models.Q(('blob__isnull', True)), name='storage_file_path'),
+        ),
+        AddIndexConcurrently(
+            model_name='rendition',
+            index=models.Index(django.db.models.functions.comparison.Collate(django.db.models.functions.text.Concat('source_path', models.Value('.'), 'kind', output_field=models.CharField()), 'C'), name='storage_rendition_path'),
+        ),
+    ]
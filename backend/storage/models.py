@@ -1,6 +1,57 @@
 import uuid
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector
 from django.db import models
+from django.db.models import CharField, F, Func, Q, Value
+from django.db.models.functions import Collate, Concat, Lower
+
+# без стемминга: имена файлов и комментарии на разных языках
+FILE_SEARCH_CONFIG = 'simple'
+
+# tsvector поиска по файлам; запрос обязан строить то же выражение,
+# иначе индекс storage_file_search не используется
+def file_search_vector():
+    # report_2023-04.pdf -> report 2023 04 pdf: иначе парсер видит одно слово
+    words = Func(
+        F('original_name'), Value('[^[:alnum:]]+'), Value(' '), Value('g'),
+        function='regexp_replace',
+    )
+    return SearchVector(words, config=FILE_SEARCH_CONFIG, weight='A') \
+        + SearchVector('comment', config=FILE_SEARCH_CONFIG, weight='B')
+
+# storage_fsck идёт по путям в порядке байтов, как обход хранилища
+STORAGE_PATH_COLLATION = 'C'
+
+# путь данных rendition (storage.services.rendition_relative_path) в SQL
+def rendition_path():
+    return Concat('source_path', Value('.'), 'kind', output_field=CharField())
+
+class Blob(models.Model):
+    # sha256 содержимого; одинаковые файлы разных пользователей
+    # хранятся на диске один раз
+    digest = models.CharField(max_length=64, unique=True)
+    relative_path = models.CharField(max_length=500)
+
+    size_bytes = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+
+    # '' — лежит как есть, иначе gzip / zstd (см. storage.compression)
+    encoding = models.CharField(max_length=16, blank=True, default='')
+    stored_bytes = models.BigIntegerField(default=0)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                Collate('relative_path', STORAGE_PATH_COLLATION),
+                name='storage_blob_path',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.digest} (refs: {self.ref_count})'
 
 class File(models.Model):
     owner = models.ForeignKey(
@@ -15,6 +66,21 @@ class File(models.Model):
 
     size_bytes = models.BigIntegerField()
 
+    # сжатие при хранении: encoding и stored_bytes совпадают с blob-ом
+    # (если он есть), compress_ms — CPU, потраченное на сжатие при загрузке
+    encoding = models.CharField(max_length=16, blank=True, default='')
+    stored_bytes = models.BigIntegerField(default=0)
+    compress_ms = models.PositiveIntegerField(default=0)
+
+    # None у файлов, загруженных до появления blob-хранилища
+    blob = models.ForeignKey(
+        Blob,
+        on_delete=models.PROTECT,
+        related_name='files',
+        blank=True,
+        null=True,
+    )
+
     comment = models.TextField(blank=True, null=True)
 
     uploaded = models.DateTimeField(auto_now_add=True)
@@ -23,5 +89,196 @@ class File(models.Model):
     share_token = models.UUIDField(unique=True, blank=True, null=True)
     share_created = models.DateTimeField(blank=True, null=True)
 
+    class Meta:
+        # под keyset-пагинацию и фильтры list_files
+        indexes = [
+            models.Index(
+                fields=['owner', '-uploaded', '-id'],
+                name='storage_file_owner_uploaded',
+            ),
+            models.Index(
+                fields=['owner', 'original_name', 'id'],
+                name='storage_file_owner_name',
+            ),
+            models.Index(
+                fields=['owner', 'size_bytes', 'id'],
+                name='storage_file_owner_size',
+            ),
+            models.Index(
+                'owner', OpClass(Lower('original_name'), 'text_pattern_ops'),
+                name='storage_file_owner_name_prefix',
+            ),
+            models.Index(
+                fields=['owner', '-uploaded', '-id'],
+                name='storage_file_owner_shared',
+                condition=Q(share_token__isnull=False),
+            ),
+            # поиск (search_files): owner в GIN (btree_gin) — чтобы поиск
+            # по своим файлам не перебирал совпадения всех пользователей
+            GinIndex(
+                F('owner'), file_search_vector(),
+                name='storage_file_search',
+            ),
+            GinIndex(
+                F('owner'), OpClass('original_name', 'gin_trgm_ops'),
+                name='storage_file_name_trgm',
+            ),
+            # storage_fsck: файлы без blob-а по порядку путей
+            models.Index(
+                Collate('relative_path', STORAGE_PATH_COLLATION),
+                name='storage_file_path',
+                condition=Q(blob__isnull=True),
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.original_name} ({self.owner})'
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions',
+    )
+
+    original_name = models.CharField(max_length=255)
+    comment = models.TextField(blank=True, null=True)
+
+    # заявленный клиентом размер, проверяется при финализации
+    size_bytes = models.BigIntegerField(blank=True, null=True)
+    # место, зарезервированное под сессию в квоте владельца
+    reserved_bytes = models.BigIntegerField(default=0)
+
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.original_name} ({self.owner}, {self.id})'
+
+class StoragePurge(models.Model):
+    # Фоновое удаление каталога пользователя после admin_user_delete
+    # (delete_files=1): выполняет manage.py purge_user_storage
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    # сам пользователь к этому моменту уже удалён
+    user_id = models.BigIntegerField()
+    username = models.CharField(max_length=150)
+    # его ранг (users.services.get_user_rank): статус видят только те, кто
+    # мог им управлять. У записей до появления поля — 0, только superuser
+    user_rank = models.PositiveSmallIntegerField(default=0)
+    relative_path = models.CharField(max_length=255)
+
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+        db_index=True,
+    )
+    files_deleted = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+
+    created = models.DateTimeField(auto_now_add=True)
+    # обновляется после каждой пачки — по нему видно зависшие задачи
+    updated = models.DateTimeField(auto_now=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f'{self.username} ({self.status})'
+
+class Rendition(models.Model):
+    # Производное от содержимого (превью, кусок текста) — см.
+    # storage.renditions. Привязана к пути данных, а не к File: у файлов
+    # с общим blob-ом и renditions общие. Строка одновременно служит
+    # блокировкой, чтобы одну rendition не генерировали параллельно
+    STATUS_RUNNING = 'running'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    source_path = models.CharField(max_length=500)
+    kind = models.CharField(max_length=32)
+
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=STATUS_RUNNING,
+    )
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    size_bytes = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['source_path', 'kind'],
+                name='storage_rendition_source_kind',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                Collate(rendition_path(), STORAGE_PATH_COLLATION),
+                name='storage_rendition_path',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.source_path} {self.kind} ({self.status})'
+
+class StorageCheck(models.Model):
+    # Прогон manage.py storage_fsck: сверка строк БД с содержимым
+    # хранилища. checkpoint — последний проверенный путь, с него
+    # продолжает --resume после прерывания
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=STATUS_RUNNING,
+    )
+    verify = models.BooleanField(default=False)
+    repair = models.BooleanField(default=False)
+    checkpoint = models.CharField(max_length=600, blank=True, default='')
+
+    checked = models.BigIntegerField(default=0)
+    orphans = models.BigIntegerField(default=0)
+    orphan_bytes = models.BigIntegerField(default=0)
+    missing = models.BigIntegerField(default=0)
+    size_mismatches = models.BigIntegerField(default=0)
+    checksum_mismatches = models.BigIntegerField(default=0)
+    repaired = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
     def __str__(self):
-        return f'{self.original_name} ({self.owner})'
\ No newline at end of file
+        return f'{self.created:%Y-%m-%d %H:%M} ({self.status})'
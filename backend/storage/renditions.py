@@ -0,0 +1,249 @@
+import codecs
+import io
+import logging
+import mimetypes
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import lru_cache
+from importlib.util import find_spec
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+
+from .backends import get_storage_backend
+from .compression import iter_content
+from .models import File, Rendition
+from .services import new_staging_path, rendition_relative_path
+
+logger = logging.getLogger(__name__)
+
+THUMB_SIZES = (256, 1024)
+THUMB_KINDS = [f'thumb-{size}' for size in THUMB_SIZES]
+TEXT_KIND = 'text'
+TEXT_SNIPPET_BYTES = 4096
+THUMB_QUALITY = 80
+
+# текстовые форматы, у которых mimetype не text/*
+TEXT_CONTENT_TYPES = {
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'application/x-sh',
+    'application/x-yaml',
+    'application/yaml',
+}
+
+# rendition в running дольше этого — генератор упал, генерируем заново
+RENDITION_STALE = timedelta(minutes=2)
+
+_executor = None
+
+
+@lru_cache(maxsize=None)
+def has_module(name: str) -> bool:
+    # Pillow и pypdfium2 опциональны: без них превью просто нет
+    return find_spec(name) is not None
+
+def source_content_type(file_obj: File) -> str:
+    content_type, _ = mimetypes.guess_type(file_obj.original_name)
+    return content_type or ''
+
+def rendition_kinds(file_obj: File) -> list[str]:
+    content_type = source_content_type(file_obj)
+
+    if content_type.startswith('text/') or content_type in TEXT_CONTENT_TYPES:
+        return [TEXT_KIND]
+
+    if file_obj.size_bytes > settings.RENDITION_MAX_SOURCE_BYTES:
+        return []
+
+    # svg Pillow не открывает
+    if (content_type.startswith('image/') and content_type != 'image/svg+xml'
+            and has_module('PIL')):
+        return THUMB_KINDS
+
+    if (content_type == 'application/pdf'
+            and has_module('PIL') and has_module('pypdfium2')):
+        return THUMB_KINDS
+
+    return []
+
+def render_text(file_obj: File):
+    data = b''.join(iter_content(file_obj, 0, TEXT_SNIPPET_BYTES - 1))
+    # неполный последний символ (обрезали посреди UTF-8) отбрасывается
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    return decoder.decode(data).encode(), 'text/plain; charset=utf-8'
+
+def open_source(file_obj: File):
+    backend = get_storage_backend()
+    if backend.is_local and not file_obj.encoding:
+        return backend.path(file_obj.relative_path).open('rb')
+
+    # Pillow и pdfium нужен seek — копируем во временный файл
+    src = tempfile.TemporaryFile()
+    for chunk in iter_content(file_obj):
+        src.write(chunk)
+    src.seek(0)
+    return src
+
+def render_thumb(file_obj: File, size: int):
+    from PIL import Image, ImageOps
+
+    with open_source(file_obj) as src:
+        if source_content_type(file_obj) == 'application/pdf':
+            import pypdfium2
+
+            pdf = pypdfium2.PdfDocument(src)
+            try:
+                page = pdf[0]
+                width, height = page.get_size()
+                image = page.render(scale=size / max(width, height)).to_pil()
+            finally:
+                pdf.close()
+        else:
+            image = Image.open(src)
+            # JPEG сразу декодируется в уменьшенном масштабе
+            image.draft('RGB', (size, size))
+            image = ImageOps.exif_transpose(image)
+
+        image.thumbnail((size, size))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+
+        out = io.BytesIO()
+        image.save(out, 'WEBP', quality=THUMB_QUALITY)
+
+    return out.getvalue(), 'image/webp'
+
+def render(file_obj: File, kind: str):
+    if kind == TEXT_KIND:
+        return render_text(file_obj)
+    return render_thumb(file_obj, int(kind.removeprefix('thumb-')))
+
+# (rendition, claimed): claimed — генерировать должен вызывающий.
+# rendition None — строку удалили вместе с файлом, пока мы смотрели
+def claim_rendition(source_path: str, kind: str):
+    rendition = Rendition.objects\
+        .filter(source_path=source_path, kind=kind).first()
+
+    if rendition is None:
+        try:
+            with transaction.atomic():
+                return Rendition.objects.create(
+                    source_path=source_path, kind=kind
+                ), True
+        except IntegrityError:
+            # параллельно заявил другой запрос или поток
+            rendition = Rendition.objects\
+                .filter(source_path=source_path, kind=kind).first()
+
+    stale = timezone.now() - RENDITION_STALE
+    if (rendition is not None and rendition.status == Rendition.STATUS_RUNNING
+            and rendition.updated < stale):
+        claimed = Rendition.objects.filter(
+            id=rendition.id, status=rendition.status, updated=rendition.updated
+        ).update(updated=timezone.now())
+        if claimed:
+            return rendition, True
+
+    return rendition, False
+
+def build_rendition(file_obj: File, rendition: Rendition):
+    rel_path = rendition_relative_path(rendition.source_path, rendition.kind)
+
+    try:
+        data, content_type = render(file_obj, rendition.kind)
+    except Exception as exc:
+        # битые и неподдерживаемые файлы — обычное дело, повторять незачем
+        logger.warning(
+            'Rendition %s of file %s failed: %r', rendition.kind, file_obj.id, exc
+        )
+        Rendition.objects.filter(id=rendition.id).update(
+            status=Rendition.STATUS_FAILED,
+            error=str(exc) or exc.__class__.__name__,
+            updated=timezone.now(),
+        )
+        return Rendition.objects.filter(id=rendition.id).first()
+
+    staged_path = new_staging_path()
+    staged_path.parent.mkdir(parents=True, exist_ok=True)
+    staged_path.write_bytes(data)
+
+    backend = get_storage_backend()
+    try:
+        backend.save(rel_path, staged_path)
+    finally:
+        staged_path.unlink(missing_ok=True)
+
+    updated = Rendition.objects.filter(
+        id=rendition.id, status=Rendition.STATUS_RUNNING
+    ).update(
+        status=Rendition.STATUS_READY,
+        content_type=content_type,
+        size_bytes=len(data),
+        updated=timezone.now(),
+    )
+    if not updated:
+        # исходный файл удалили, пока мы генерировали
+        backend.delete(rel_path)
+        return None
+
+    return Rendition.objects.filter(id=rendition.id).first()
+
+# готовая или неудачная rendition. None — её ещё нет: запрос не ждёт,
+# генерация (если её никто ещё не делает) уходит в пул потоков
+def get_rendition(file_obj: File, kind: str):
+    rendition, claimed = claim_rendition(file_obj.relative_path, kind)
+    if claimed:
+        get_executor().submit(build_in_background, file_obj, rendition)
+        return None
+
+    if rendition is not None \
+            and rendition.status != Rendition.STATUS_RUNNING:
+        return rendition
+    return None
+
+def read_rendition(rendition: Rendition) -> bytes:
+    rel_path = rendition_relative_path(rendition.source_path, rendition.kind)
+    return b''.join(
+        get_storage_backend().iter_range(rel_path, 0, rendition.size_bytes - 1)
+    )
+
+def build_in_background(file_obj: File, rendition: Rendition) -> None:
+    try:
+        build_rendition(file_obj, rendition)
+    except Exception:
+        logger.exception('Rendition %s of file %s failed', rendition.kind, file_obj.id)
+    finally:
+        # соединения с БД у каждого потока свои
+        connections.close_all()
+
+def generate_renditions(file_obj: File, kinds: list[str]) -> None:
+    try:
+        for kind in kinds:
+            rendition, claimed = claim_rendition(file_obj.relative_path, kind)
+            if claimed:
+                build_rendition(file_obj, rendition)
+    except Exception:
+        logger.exception('Renditions of file %s failed', file_obj.id)
+    finally:
+        connections.close_all()
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+
+    # хотя бы один поток: по запросу renditions генерируются и при 0
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max(settings.RENDITION_WORKERS, 1), thread_name_prefix='renditions'
+        )
+    return _executor
+
+def schedule_renditions(file_obj: File) -> None:
+    kinds = rendition_kinds(file_obj)
+    if not kinds or settings.RENDITION_WORKERS <= 0:
+        return
+
+    get_executor().submit(generate_renditions, file_obj, kinds)
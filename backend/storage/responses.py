@@ -0,0 +1,276 @@
+import mimetypes
+from urllib.parse import quote
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import (
+    content_disposition_header,
+    http_date,
+    parse_http_date_safe,
+)
+
+from .backends import get_storage_backend
+from .compression import iter_content
+from .models import File
+from .threads import in_worker_thread
+
+MAX_RANGES = 16
+
+
+def file_etag(file_obj: File, encoding: str = '') -> str:
+    # stored_name не меняется за всю жизнь файла (rename меняет только
+    # original_name), поэтому годится как сильный валидатор.
+    # Сжатое представление — другие байты, у него свой ETag
+    if encoding:
+        return f'"{file_obj.stored_name}-{encoding}"'
+    return f'"{file_obj.stored_name}"'
+
+def file_last_modified(file_obj: File) -> int:
+    return int(file_obj.uploaded.timestamp())
+
+def file_content_type(file_obj: File) -> str:
+    content_type, _ = mimetypes.guess_type(file_obj.original_name)
+    return content_type or 'application/octet-stream'
+
+def set_file_headers(response, file_obj: File, as_attachment: bool,
+                     encoding: str = '') -> None:
+    response['Content-Disposition'] = content_disposition_header(
+        as_attachment, file_obj.original_name
+    )
+    response['ETag'] = file_etag(file_obj, encoding)
+    response['Last-Modified'] = http_date(file_last_modified(file_obj))
+    response['Accept-Ranges'] = 'bytes'
+    if file_obj.encoding:
+        # ответ зависит от Accept-Encoding — кешам нужно это знать
+        response['Vary'] = 'Accept-Encoding'
+
+def accepts_encoding(request, encoding: str) -> bool:
+    # Accept-Encoding: gzip;q=0.8, zstd, *;q=0
+    wildcard = False
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+
+        if name == encoding or (encoding == 'gzip' and name == 'x-gzip'):
+            return q > 0
+        if name == '*':
+            wildcard = q > 0
+
+    return wildcard
+
+def parse_range_header(header: str, size: int):
+    # None — заголовок некорректен и игнорируется (отдаём весь файл),
+    # [] — ни один диапазон не выполним (416)
+    if not header.startswith('bytes='):
+        return None
+
+    ranges = []
+    for spec in header[len('bytes='):].split(','):
+        first, sep, last = spec.strip().partition('-')
+        if not sep:
+            return None
+
+        if not first:
+            # suffix-range: последние N байт
+            if not last.isdigit():
+                return None
+            length = int(last)
+            if length and size:
+                ranges.append((max(size - length, 0), size - 1))
+            continue
+
+        if not first.isdigit() or (last and not last.isdigit()):
+            return None
+
+        start = int(first)
+        end = int(last) if last else size - 1
+        if last and end < start:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    return ranges
+
+def if_range_passes(request, file_obj: File) -> bool:
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+
+    if if_range.startswith(('"', 'W/')):
+        # If-Range допускает только сильное сравнение
+        return if_range == file_etag(file_obj)
+
+    return parse_http_date_safe(if_range) == file_last_modified(file_obj)
+
+async def iter_async(iterator):
+    # под ASGI синхронный итератор Django дочитал бы в память целиком
+    # (sync_to_async(list)); здесь каждое чтение идёт в пул потоков.
+    # Итератор архива ходит в БД — соединения закрывает in_worker_thread
+    done = object()
+    try:
+        while True:
+            chunk = await in_worker_thread(next)(iterator, done)
+            if chunk is done:
+                return
+            yield chunk
+    finally:
+        await in_worker_thread(iterator.close)()
+
+def iter_multipart_ranges(file_obj: File, ranges, part_headers, boundary: str):
+    for (start, end), header in zip(ranges, part_headers):
+        yield header
+        yield from iter_content(file_obj, start, end)
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+def stream_content(request, iterator):
+    if isinstance(request, ASGIRequest):
+        return iter_async(iterator)
+    return iterator
+
+def range_response(request, file_obj: File, ranges, size: int,
+                   as_attachment: bool):
+    # диапазоны всегда в исходных байтах: сжатый файл распаковывается
+    # на лету до конца нужного диапазона
+    content_type = file_content_type(file_obj)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(
+            stream_content(request, iter_content(file_obj, start, end)),
+            status=206,
+            content_type=content_type,
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+        set_file_headers(response, file_obj, as_attachment)
+        return response
+
+    boundary = uuid4().hex
+    part_headers = [
+        (
+            f'--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode()
+        for start, end in ranges
+    ]
+    content_length = sum(
+        len(header) + (end - start + 1) + 2
+        for (start, end), header in zip(ranges, part_headers)
+    ) + len(f'--{boundary}--\r\n')
+
+    response = StreamingHttpResponse(
+        stream_content(
+            request,
+            iter_multipart_ranges(file_obj, ranges, part_headers, boundary),
+        ),
+        status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}',
+    )
+    response['Content-Length'] = str(content_length)
+    set_file_headers(response, file_obj, as_attachment)
+    return response
+
+def accel_redirect_response(file_obj: File, as_attachment: bool) -> HttpResponse:
+    # тело пустое: nginx сам отдаст файл из internal location через sendfile,
+    # заголовки Content-Type/Content-Disposition он берёт из этого ответа.
+    # Range, If-Range и условные запросы nginx для статики обрабатывает сам
+    response = HttpResponse(content_type=file_content_type(file_obj))
+    response['Content-Disposition'] = content_disposition_header(
+        as_attachment, file_obj.original_name
+    )
+    response['X-Accel-Redirect'] = (
+        settings.STORAGE_ACCEL_REDIRECT_PREFIX + quote(file_obj.relative_path)
+    )
+    return response
+
+# FileNotFoundError, если файла нет в хранилище
+def file_response(request, file_obj: File, as_attachment: bool):
+    backend = get_storage_backend()
+
+    # nginx не знает о сжатии в хранилище, сжатые файлы отдаём сами
+    if (settings.STORAGE_ACCEL_REDIRECT_PREFIX and backend.is_local
+            and not file_obj.encoding):
+        return accel_redirect_response(file_obj, as_attachment)
+
+    range_header = request.headers.get('Range')
+
+    # сжатые байты отдаём как есть, если клиент их принимает; Range
+    # считается по исходному содержимому, такие запросы — без сжатия
+    encoding = ''
+    if (file_obj.encoding and not range_header
+            and accepts_encoding(request, file_obj.encoding)):
+        encoding = file_obj.encoding
+
+    conditional = get_conditional_response(
+        request,
+        etag=file_etag(file_obj, encoding),
+        last_modified=file_last_modified(file_obj),
+    )
+    if conditional is not None:
+        if conditional.status_code == 304:
+            conditional['ETag'] = file_etag(file_obj, encoding)
+            conditional['Last-Modified'] = http_date(
+                file_last_modified(file_obj)
+            )
+            if file_obj.encoding:
+                conditional['Vary'] = 'Accept-Encoding'
+        return conditional
+
+    size = backend.size(file_obj.relative_path)
+    if file_obj.encoding and not encoding:
+        size = file_obj.size_bytes
+
+    if range_header and if_range_passes(request, file_obj):
+        ranges = parse_range_header(range_header, size)
+
+        if ranges == []:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        if ranges:
+            return range_response(
+                request, file_obj, ranges, size, as_attachment
+            )
+
+    if file_obj.encoding and not encoding:
+        content = iter_content(file_obj)
+    elif backend.is_local and not isinstance(request, ASGIRequest):
+        # под WSGI FileResponse отдаёт файл через wsgi.file_wrapper (sendfile)
+        response = FileResponse(
+            backend.path(file_obj.relative_path).open('rb'),
+            as_attachment=as_attachment,
+            filename=file_obj.original_name,
+        )
+        set_file_headers(response, file_obj, as_attachment, encoding)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        return response
+    else:
+        content = backend.iter_range(file_obj.relative_path, 0, size - 1)
+
+    response = StreamingHttpResponse(
+        stream_content(request, content),
+        content_type=file_content_type(file_obj),
+    )
+    response['Content-Length'] = str(size)
+    set_file_headers(response, file_obj, as_attachment, encoding)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
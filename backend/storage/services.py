@@ -1,12 +1,47 @@
 import os
-from uuid import uuid4
+import re
+import json
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import timedelta
+from uuid import UUID, uuid4
 from pathlib import Path
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    TrigramStrictWordSimilarity,
+)
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, FloatField, OuterRef, Q, QuerySet, Subquery
+from django.db.models.functions import Cast
+from django.utils import timezone
 
-from users.services import can_manage_files
-from .models import File
+from users.services import (
+    can_manage_files,
+    get_user_rank,
+    manageable_users,
+    adjust_storage_usage,
+    release_storage,
+)
+from .backends import get_storage_backend
+from .buffers import last_downloaded_buffer
+from .compression import compress_file, is_compressible
+from .models import (
+    FILE_SEARCH_CONFIG,
+    Blob,
+    File,
+    Rendition,
+    StoragePurge,
+    UploadSession,
+    file_search_vector,
+)
 
 User = get_user_model()
 def make_stored_name(original_name: str) -> str:
@@ -16,13 +51,85 @@ def make_stored_name(original_name: str) -> str:
 def user_storage_abs_path(storage_rel_path: str) -> Path:
     return Path(settings.STORAGE_ROOT) / storage_rel_path
 
-def write_file(file_obj, target_path: Path) -> None:
+# <storage_rel_path>/ab/cd/abcd....ext при STORAGE_FANOUT_LEVELS = 2
+def stored_file_relative_path(storage_rel_path: str, stored_name: str) -> str:
+    levels = settings.STORAGE_FANOUT_LEVELS
+    fanout = ''.join(
+        f'{stored_name[i * 2:i * 2 + 2]}/' for i in range(levels)
+    )
+    return f'{storage_rel_path}{fanout}{stored_name}'
+
+def write_file(file_obj, target_path: Path) -> str:
     target_path.parent.mkdir(parents=True, exist_ok=True)
 
+    digest = hashlib.sha256()
     with target_path.open('wb') as out:
         for chunk in file_obj.chunks():
+            digest.update(chunk)
             out.write(chunk)
 
+    return digest.hexdigest()
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open('rb') as src:
+        for chunk in iter(lambda: src.read(UPLOAD_READ_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def record_download(file_obj: File) -> None:
+    now = timezone.now()
+
+    if settings.LAST_DOWNLOADED_FLUSH_INTERVAL <= 0:
+        file_obj.last_downloaded = now
+        file_obj.save(update_fields=['last_downloaded'])
+        return
+
+    last_downloaded_buffer.record(file_obj.id, now)
+
+SHARE_CACHE_MISS = 'missing'
+SHARE_CACHE_FIELDS = (
+    'id',
+    'owner_id',
+    'original_name',
+    'stored_name',
+    'relative_path',
+    'size_bytes',
+    'encoding',
+    'stored_bytes',
+    'uploaded',
+)
+
+def share_cache_key(token) -> str:
+    return f'share:{token}'
+
+# токен спецссылки -> File (не из БД, а собранный из кэша: только поля,
+# нужные для отдачи файла). None — такого токена нет
+def resolve_share_token(token):
+    cache = caches['shares']
+    key = share_cache_key(token)
+
+    cached = cache.get(key)
+    if cached == SHARE_CACHE_MISS:
+        return None
+
+    if cached is None:
+        file_obj = File.objects.filter(share_token=token)\
+            .only(*SHARE_CACHE_FIELDS).first()
+        if not file_obj:
+            cache.set(key, SHARE_CACHE_MISS, settings.SHARE_CACHE_NEGATIVE_TTL)
+            return None
+
+        cached = {name: getattr(file_obj, name) for name in SHARE_CACHE_FIELDS}
+        cache.set(key, cached)
+
+    return File(share_token=token, **cached)
+
+def invalidate_share_tokens(tokens) -> None:
+    keys = [share_cache_key(token) for token in tokens if token]
+    if keys:
+        caches['shares'].delete_many(keys)
+
 def get_file_for_user(request, file_id):
     file_obj = File.objects.select_related('owner')\
         .filter(id=file_id).first()
@@ -35,6 +142,97 @@ def get_file_for_user(request, file_id):
 
     return None
 
+# то же, что get_file_for_user, но для списка id и одним запросом
+def get_files_for_user(request, file_ids) -> list[File]:
+    return list(
+        File.objects.filter(
+            id__in=file_ids,
+            owner__in=manageable_users(request.user).values('id'),
+        )
+    )
+
+# все файлы, которые actor видит по can_manage_files. Для обычного
+# пользователя и суперпользователя — без подзапроса по рангам, чтобы
+# планировщик использовал owner в индексах
+def visible_files(actor) -> QuerySet:
+    rank = get_user_rank(actor)
+    if rank == 0:
+        return File.objects.all()
+    if rank == 3:
+        return File.objects.filter(owner=actor)
+    return File.objects.filter(
+        owner__in=manageable_users(actor).values('id')
+    )
+
+SEARCH_MAX_TERMS = 8
+# короче — триграммы ничего осмысленного не найдут
+SEARCH_TRIGRAM_MIN_LENGTH = 3
+
+# Совпадение — все слова запроса как префиксы слов имени или комментария
+# (tsvector, индекс storage_file_search), а у запроса из одного слова ещё
+# и похожее слово в имени (опечатки, pg_trgm, индекс storage_file_name_trgm).
+# score — ранг tsvector (имя весомее комментария) плюс триграммная
+# похожесть. None — в запросе нет ни слова
+def apply_file_search(files: QuerySet, q: str):
+    terms = re.findall(r'[^\W_]+', q.lower())[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+
+    # слова — только буквы и цифры, синтаксису tsquery они не мешают
+    query = SearchQuery(
+        ' & '.join(f"'{term}':*" for term in terms),
+        config=FILE_SEARCH_CONFIG,
+        search_type='raw',
+    )
+    vector = file_search_vector()
+    match = Q(search=query)
+    score = SearchRank(vector, query)
+
+    # у фразы триграммы есть почти у каждого имени: индекс отдаёт десятки
+    # тысяч кандидатов на перепроверку, а префиксы слов и так находят её
+    if len(terms) == 1 and len(terms[0]) >= SEARCH_TRIGRAM_MIN_LENGTH:
+        # strict: с целым словом имени, порог 0.5 — ловит одну опечатку
+        # в слове из 6-7 букв (у word_similar порог 0.6 — уже нет)
+        match |= Q(original_name__trigram_strict_word_similar=terms[0])
+        score += TrigramStrictWordSimilarity(terms[0], 'original_name')
+
+    # real -> double: в курсоре score без потерь, иначе keyset-сравнение
+    # с ним на границе страницы промахивается
+    return files.annotate(search=vector, score=Cast(score, FloatField()))\
+        .filter(match)
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str):
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except ValueError:
+        return None
+
+    return values if isinstance(values, list) else None
+
+def keyset_page(qs, field: str, descending: bool, after, limit: int):
+    # after — (значение field, id) последней строки предыдущей страницы.
+    # Лишнее условие field <= value (>=) даёт планировщику диапазон
+    # по индексу (owner, field, id) вместо фильтрации по OR
+    direction = '-' if descending else ''
+    qs = qs.order_by(f'{direction}{field}', f'{direction}id')
+
+    if after is not None:
+        value, last_id = after
+        op = 'lt' if descending else 'gt'
+        qs = qs.filter(
+            Q(**{f'{field}__{op}e': value}),
+            Q(**{f'{field}__{op}': value})
+            | Q(**{field: value, f'id__{op}': last_id}),
+        )
+
+    rows = list(qs[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
 def ensure_storage_root() -> Path:
     root = Path(settings.STORAGE_ROOT)
     root.mkdir(parents=True, exist_ok=True)
@@ -45,3 +243,630 @@ def ensure_user_storage_dir(storage_rel_path: str) -> Path:
     user_dir = root / storage_rel_path
     user_dir.mkdir(parents=True, exist_ok=True)
     return user_dir
+
+UPLOADS_DIR_NAME = '.uploads'
+UPLOAD_PART_MAX_NUMBER = 10000
+UPLOAD_READ_CHUNK = 1024 * 1024
+
+def upload_staging_dir(session_id) -> Path:
+    return Path(settings.STORAGE_ROOT) / UPLOADS_DIR_NAME / str(session_id)
+
+def new_staging_path() -> Path:
+    return Path(settings.STORAGE_ROOT) / UPLOADS_DIR_NAME / f'{uuid4().hex}.tmp'
+
+def upload_staging_file(session_id) -> Path:
+    return upload_staging_dir(session_id) / 'data'
+
+def upload_part_path(session_id, number: int) -> Path:
+    return upload_staging_dir(session_id) / f'{number:05d}.part'
+
+def get_upload_session_for_user(request, session_id):
+    return UploadSession.objects.filter(
+        id=session_id,
+        owner=request.user,
+    ).first()
+
+def upload_session_offset(session_id) -> int:
+    try:
+        return upload_staging_file(session_id).stat().st_size
+    except FileNotFoundError:
+        return 0
+
+def upload_session_parts(session_id) -> list[dict]:
+    staging_dir = upload_staging_dir(session_id)
+    if not staging_dir.exists():
+        return []
+
+    parts = []
+    with os.scandir(staging_dir) as entries:
+        for entry in entries:
+            stem, ext = os.path.splitext(entry.name)
+            if ext == '.part' and stem.isdigit():
+                parts.append({
+                    'number': int(stem),
+                    'size_bytes': entry.stat().st_size,
+                })
+
+    return sorted(parts, key=lambda p: p['number'])
+
+# читает тело запроса кусками, не загружая его целиком в память
+def read_request_stream(request, limit: int):
+    received = 0
+    while True:
+        chunk = request.read(UPLOAD_READ_CHUNK)
+        if not chunk:
+            return
+        received += len(chunk)
+        if received > limit:
+            raise ValueError('Chunk is too large')
+        yield chunk
+
+# Дозапись идёт вне транзакции (кусок может приходить минутами), поэтому
+# от параллельных PATCH и complete staging-файл защищает flock: ОС снимет
+# его и при падении процесса. Отдаёт открытый на дозапись файл или None,
+# если файл уже держит другой запрос
+@contextmanager
+def lock_upload_staging(session_id):
+    target = upload_staging_file(session_id)
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    with target.open('ab') as out:
+        try:
+            fcntl.flock(out, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield None
+            return
+        yield out
+
+def append_upload_chunk(request, out) -> int:
+    for chunk in read_request_stream(
+        request, settings.UPLOAD_CHUNK_MAX_BYTES
+    ):
+        out.write(chunk)
+    out.flush()
+
+    return os.fstat(out.fileno()).st_size
+
+def write_upload_part(request, session_id, number: int) -> int:
+    target = upload_part_path(session_id, number)
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    # part пишется во временный файл и атомарно подменяется,
+    # так что недокачанная часть никогда не видна как готовая
+    tmp_path = target.with_suffix(f'.tmp-{uuid4().hex}')
+    try:
+        with tmp_path.open('wb') as out:
+            for chunk in read_request_stream(
+                request, settings.UPLOAD_CHUNK_MAX_BYTES
+            ):
+                out.write(chunk)
+        os.replace(tmp_path, target)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    return target.stat().st_size
+
+def assemble_upload_parts(session_id) -> Path:
+    parts = upload_session_parts(session_id)
+    numbers = [p['number'] for p in parts]
+    if numbers != list(range(1, len(numbers) + 1)):
+        raise ValueError('Parts must be numbered 1..N without gaps')
+
+    target = upload_staging_file(session_id)
+    with target.open('ab') as out:
+        for number in numbers:
+            part = upload_part_path(session_id, number)
+            with part.open('rb') as src:
+                shutil.copyfileobj(src, out, UPLOAD_READ_CHUNK)
+            part.unlink()
+
+    return target
+
+def remove_upload_staging(session_id) -> None:
+    shutil.rmtree(upload_staging_dir(session_id), ignore_errors=True)
+
+# удаляет строку сессии и снимает резерв квоты; False — сессию уже
+# закрыл параллельный запрос. Вызывать под lock_upload_staging
+def delete_upload_session(session: UploadSession) -> bool:
+    with transaction.atomic():
+        deleted, _ = UploadSession.objects.filter(id=session.id).delete()
+        if deleted:
+            release_storage(session.owner_id, session.reserved_bytes)
+    return bool(deleted)
+
+# False — в сессию сейчас пишут кусок или её завершают
+def close_upload_session(session: UploadSession) -> bool:
+    with lock_upload_staging(session.id) as out:
+        if out is None:
+            return False
+        delete_upload_session(session)
+
+    remove_upload_staging(session.id)
+    return True
+
+def purge_stale_upload_sessions(max_age: timedelta) -> int:
+    cutoff = timezone.now() - max_age
+    purged = 0
+
+    stale = UploadSession.objects.filter(updated__lt=cutoff)
+    for session in stale.iterator():
+        if close_upload_session(session):
+            purged += 1
+
+    # каталоги без сессии (например, после ручного удаления строк в БД)
+    uploads_root = Path(settings.STORAGE_ROOT) / UPLOADS_DIR_NAME
+    if uploads_root.exists():
+        with os.scandir(uploads_root) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                if entry.stat().st_mtime > cutoff.timestamp():
+                    continue
+                try:
+                    session_id = UUID(entry.name)
+                except ValueError:
+                    continue
+                if not UploadSession.objects.filter(id=session_id).exists():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    purged += 1
+
+    return purged
+
+BLOBS_DIR_NAME = '.blobs'
+BLOB_PURGE_BATCH = 1000
+
+def blob_relative_path(digest: str) -> str:
+    return f'{BLOBS_DIR_NAME}/{digest[:2]}/{digest[2:4]}/{digest}'
+
+# renditions лежат рядом с данными: <relative_path>.<kind>
+def rendition_relative_path(source_path: str, kind: str) -> str:
+    return f'{source_path}.{kind}'
+
+RENDITION_DELETE_BATCH = 1000
+
+def delete_renditions(source_paths) -> None:
+    # путь вычисляется из source_path и kind, поэтому удаляются и файлы
+    # ещё генерируемых renditions (генератор увидит, что строки нет)
+    source_paths = list(source_paths)
+
+    for start in range(0, len(source_paths), RENDITION_DELETE_BATCH):
+        batch = source_paths[start:start + RENDITION_DELETE_BATCH]
+        renditions = list(
+            Rendition.objects.filter(source_path__in=batch)
+            .values_list('id', 'source_path', 'kind')
+        )
+        if not renditions:
+            continue
+
+        Rendition.objects.filter(id__in=[r[0] for r in renditions]).delete()
+        get_storage_backend().delete_many(
+            rendition_relative_path(source_path, kind)
+            for _, source_path, kind in renditions
+        )
+
+# сжимает staged-файл, если включено и выгодно. Возвращает
+# (что сохранять, encoding, stored_bytes, compress_ms); сжатая копия —
+# новый файл в staging, исходный тогда удаляется
+def compress_staged_file(staged_path: Path, original_name: str, size_bytes: int):
+    if not is_compressible(original_name, size_bytes):
+        return staged_path, '', size_bytes, 0
+
+    encoding = settings.STORAGE_COMPRESSION
+    compressed_path = new_staging_path()
+    stored_bytes, compress_ms = compress_file(
+        staged_path, compressed_path, encoding
+    )
+    if stored_bytes is None:
+        return staged_path, '', size_bytes, compress_ms
+
+    staged_path.unlink(missing_ok=True)
+    return compressed_path, encoding, stored_bytes, compress_ms
+
+# данные blob-а уже есть — сжимать загрузку незачем (без блокировок:
+# окончательно это решает store_blob)
+def blob_stored(digest: str) -> bool:
+    return (
+        Blob.objects.filter(digest=digest, ref_count__gt=0).exists()
+        and get_storage_backend().exists(blob_relative_path(digest))
+    )
+
+# Короткая транзакция: ссылка на blob засчитывается сразу и коммитится,
+# поэтому purge_unreferenced_blobs не тронет данные, пока они пишутся вне
+# транзакции. (blob, нужно ли записать данные) или None — данных нет,
+# а сжатой копии (prepared) ещё нет. IntegrityError — тот же blob
+# создали параллельно, повторить
+def reserve_blob(digest: str, size_bytes: int, prepared):
+    rel_path = blob_relative_path(digest)
+
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(digest=digest).first()
+
+        if blob and get_storage_backend().exists(rel_path):
+            Blob.objects.filter(id=blob.id).update(ref_count=F('ref_count') + 1)
+            return blob, False
+
+        if prepared is None:
+            return None
+
+        _, encoding, stored_bytes, _ = prepared
+        if not blob:
+            return Blob.objects.create(
+                digest=digest,
+                relative_path=rel_path,
+                size_bytes=size_bytes,
+                encoding=encoding,
+                stored_bytes=stored_bytes,
+                ref_count=1,
+            ), True
+
+        # данные blob-а потерялись и будут записаны заново, возможно
+        # с другим сжатием — файлы на него должны это видеть
+        Blob.objects.filter(id=blob.id).update(
+            ref_count=F('ref_count') + 1,
+            encoding=encoding,
+            stored_bytes=stored_bytes,
+        )
+        files = File.objects.filter(blob=blob)
+        files.update(encoding=encoding, stored_bytes=stored_bytes)
+        # и кэш спецссылок: там encoding и stored_bytes тоже есть
+        share_tokens = list(
+            files.filter(share_token__isnull=False)
+            .values_list('share_token', flat=True)
+        )
+        transaction.on_commit(lambda: invalidate_share_tokens(share_tokens))
+
+        blob.encoding, blob.stored_bytes = encoding, stored_bytes
+        return blob, True
+
+def release_blob(blob_id: int) -> None:
+    Blob.objects.filter(id=blob_id).update(ref_count=F('ref_count') - 1)
+    purge_unreferenced_blobs([blob_id])
+
+def store_blob(
+    staged_path: Path,
+    digest: str,
+    size_bytes: int,
+    original_name: str = '',
+):
+    # (blob, compress_ms); ссылка на blob уже засчитана — если файл
+    # создать не удалось, её снимает release_blob. Сжатие (только для
+    # нового blob-а) и запись данных — вне транзакций: загрузка в S3
+    # на гигабайты не держит ни транзакцию, ни блокировку строки
+    prepared = None
+    if not blob_stored(digest):
+        prepared = compress_staged_file(staged_path, original_name, size_bytes)
+
+    try:
+        while True:
+            try:
+                reserved = reserve_blob(digest, size_bytes, prepared)
+            except IntegrityError:
+                continue
+            if reserved:
+                break
+            # blob пропал между проверкой и блокировкой
+            prepared = compress_staged_file(staged_path, original_name, size_bytes)
+
+        blob, needs_data = reserved
+        if not needs_data:
+            return blob, 0
+
+        save_path, _, _, compress_ms = prepared
+        try:
+            get_storage_backend().save(blob.relative_path, save_path)
+        except Exception:
+            release_blob(blob.id)
+            raise
+        return blob, compress_ms
+    finally:
+        staged_path.unlink(missing_ok=True)
+        if prepared:
+            prepared[0].unlink(missing_ok=True)
+
+def purge_unreferenced_blobs(blob_ids) -> int:
+    blob_ids = list(blob_ids)
+    purged = 0
+
+    for start in range(0, len(blob_ids), BLOB_PURGE_BATCH):
+        batch = blob_ids[start:start + BLOB_PURGE_BATCH]
+
+        with transaction.atomic():
+            dead = Blob.objects.select_for_update()\
+                .filter(id__in=batch, ref_count__lte=0)
+            paths = [b.relative_path for b in dead]
+            dead.delete()
+
+            # удаляем данные до commit, пока строки ещё заблокированы:
+            # иначе store_blob мог бы успеть положить тот же digest заново
+            get_storage_backend().delete_many(paths)
+            delete_renditions(paths)
+            purged += len(paths)
+
+    return purged
+
+# снимает ссылки files на blob-ы одним UPDATE (до удаления самих files).
+# Строки files вызывающий уже заблокировал: подзапрос в SET при повторной
+# проверке после чужого коммита не перевыполняется, и два параллельных
+# удаления одного файла иначе сняли бы ссылку дважды
+def release_file_blobs(files) -> list[int]:
+    refs = files.filter(blob=OuterRef('pk'))\
+        .order_by().values('blob').annotate(n=Count('pk')).values('n')
+
+    blob_ids = list(
+        files.filter(blob__isnull=False)
+        .order_by().values_list('blob_id', flat=True).distinct()
+    )
+
+    Blob.objects.filter(id__in=blob_ids)\
+        .update(ref_count=F('ref_count') - Subquery(refs))
+
+    return blob_ids
+
+FILE_LOCK_CHUNK = 2000
+
+def lock_files(files) -> None:
+    # SELECT ... FOR UPDATE без загрузки строк в память
+    ids = files.select_for_update().order_by('id')\
+        .values_list('id', flat=True).iterator(chunk_size=FILE_LOCK_CHUNK)
+    for _ in ids:
+        pass
+
+def release_owner_blobs(owner) -> list[int]:
+    files = File.objects.filter(owner=owner)
+    lock_files(files)
+    return release_file_blobs(files)
+
+def finalize_upload(
+    owner,
+    staged_path: Path,
+    original_name: str,
+    size_bytes: int,
+    comment=None,
+    digest=None,
+) -> File:
+    stored_name = make_stored_name(original_name)
+    blob = None
+
+    # sha256, сжатие и запись данных — до транзакции (store_blob),
+    # сама транзакция только создаёт строку файла
+    if settings.STORAGE_DEDUP:
+        if digest is None:
+            digest = file_digest(staged_path)
+        blob, compress_ms = store_blob(
+            staged_path, digest, size_bytes, original_name
+        )
+        relative_path = blob.relative_path
+        encoding = blob.encoding
+        stored_bytes = blob.stored_bytes
+    else:
+        relative_path = stored_file_relative_path(
+            owner.storage_rel_path, stored_name
+        )
+        save_path, encoding, stored_bytes, compress_ms = \
+            compress_staged_file(staged_path, original_name, size_bytes)
+        try:
+            get_storage_backend().save(relative_path, save_path)
+        finally:
+            save_path.unlink(missing_ok=True)
+
+    try:
+        with transaction.atomic():
+            obj = File.objects.create(
+                owner=owner,
+                original_name=original_name,
+                stored_name=stored_name,
+                relative_path=relative_path,
+                size_bytes=size_bytes,
+                encoding=encoding,
+                stored_bytes=stored_bytes,
+                compress_ms=compress_ms,
+                blob=blob,
+                comment=comment,
+                uploaded=timezone.now(),
+            )
+            adjust_storage_usage(owner.id, 1, size_bytes)
+    except Exception:
+        if blob:
+            release_blob(blob.id)
+        else:
+            get_storage_backend().delete(relative_path)
+        raise
+
+    return obj
+
+def store_uploaded_file(owner, uploaded_file, comment=None) -> File:
+    # StagedUploadedFile уже лежит в staging и посчитан sha256
+    staged_path = getattr(uploaded_file, 'staging_path', None)
+    digest = getattr(uploaded_file, 'digest', None)
+
+    if staged_path is None:
+        staged_path = new_staging_path()
+        digest = write_file(uploaded_file, staged_path)
+
+    try:
+        return finalize_upload(
+            owner,
+            staged_path,
+            uploaded_file.name,
+            uploaded_file.size,
+            comment=comment,
+            digest=digest,
+        )
+    finally:
+        staged_path.unlink(missing_ok=True)
+
+STORAGE_PURGE_BATCH = 1000
+# задача в running без прогресса дольше этого — воркер упал, подхватываем
+STORAGE_PURGE_STALE = timedelta(minutes=5)
+
+def schedule_storage_purge(user) -> StoragePurge:
+    return StoragePurge.objects.create(
+        user_id=user.id,
+        username=user.username,
+        user_rank=get_user_rank(user),
+        relative_path=user.storage_rel_path,
+    )
+
+def claim_storage_purge():
+    stale = timezone.now() - STORAGE_PURGE_STALE
+    candidates = StoragePurge.objects.filter(
+        Q(status=StoragePurge.STATUS_PENDING)
+        | Q(status=StoragePurge.STATUS_RUNNING, updated__lt=stale)
+    ).order_by('id')
+
+    for purge in candidates[:10]:
+        # условный UPDATE: из нескольких воркеров задачу получит один
+        claimed = StoragePurge.objects.filter(
+            id=purge.id, status=purge.status, updated=purge.updated
+        ).update(status=StoragePurge.STATUS_RUNNING, updated=timezone.now())
+        if claimed:
+            purge.refresh_from_db()
+            return purge
+
+    return None
+
+def run_storage_purge(purge: StoragePurge, batch_size=STORAGE_PURGE_BATCH) -> None:
+    backend = get_storage_backend()
+    batch = []
+
+    def flush():
+        backend.delete_many(batch)
+        StoragePurge.objects.filter(id=purge.id).update(
+            files_deleted=F('files_deleted') + len(batch),
+            updated=timezone.now(),
+        )
+        batch.clear()
+
+    # после падения просто проходим каталог заново: удалённого там уже нет
+    try:
+        for rel_path in backend.iter_files(purge.relative_path):
+            batch.append(rel_path)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+
+        backend.remove_tree(purge.relative_path)
+        # файлы renditions лежали в том же каталоге и уже удалены
+        Rendition.objects.filter(
+            source_path__startswith=purge.relative_path
+        ).delete()
+    except OSError as exc:
+        StoragePurge.objects.filter(id=purge.id).update(
+            status=StoragePurge.STATUS_FAILED,
+            error=str(exc),
+            updated=timezone.now(),
+            finished=timezone.now(),
+        )
+        return
+
+    StoragePurge.objects.filter(id=purge.id).update(
+        status=StoragePurge.STATUS_DONE,
+        updated=timezone.now(),
+        finished=timezone.now(),
+    )
+
+# перенос файла в раскладку STORAGE_FANOUT_LEVELS без простоя: сначала
+# hardlink по новому пути, потом условный UPDATE relative_path. Старый путь
+# остаётся рабочим (его ещё могут держать кэш спецссылок и уже начатые
+# запросы), удалять его — забота вызывающего, после паузы
+def relayout_stored_file(file_id: int, old_rel: str, new_rel: str,
+                         share_token=None) -> bool:
+    backend = get_storage_backend()
+    old_path = backend.path(old_rel)
+    new_path = backend.path(new_rel)
+    new_path.parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        os.link(old_path, new_path)
+    except FileExistsError:
+        # остался от прерванного запуска: stored_name уникален
+        pass
+    except FileNotFoundError:
+        return False
+
+    updated = File.objects.filter(id=file_id, relative_path=old_rel)\
+        .update(relative_path=new_rel)
+    if not updated:
+        # файл удалили или перенесли параллельно
+        new_path.unlink(missing_ok=True)
+        return False
+
+    # relative_path есть и в кэше спецссылок
+    transaction.on_commit(lambda: invalidate_share_tokens([share_token]))
+    return True
+
+BULK_UPDATE_BATCH = 500
+
+# False — файл уже удалил параллельный запрос, счётчики не тронуты
+def delete_stored_file(file_obj: File) -> bool:
+    return bool(delete_stored_files([file_obj]))
+
+# возвращает удалённые файлы — без тех, что уже удалил параллельный запрос
+def delete_stored_files(files: list[File]) -> list[File]:
+    if not files:
+        return []
+
+    with transaction.atomic():
+        # счётчики, ссылки на blob-ы и пути — только по строкам, которые
+        # удаляет эта транзакция, а не по переданному (возможно, уже
+        # устаревшему) списку
+        files = list(
+            File.objects.select_for_update()
+            .filter(id__in=[f.id for f in files]).order_by('id')
+        )
+        if not files:
+            return []
+
+        usage = {}
+        for f in files:
+            count, size = usage.get(f.owner_id, (0, 0))
+            usage[f.owner_id] = (count + 1, size + f.size_bytes)
+
+        share_tokens = [f.share_token for f in files if f.share_token]
+        # без дедупликации у файла свой путь в хранилище, с ней — общий blob
+        paths = [f.relative_path for f in files if not f.blob_id]
+
+        qs = File.objects.filter(id__in=[f.id for f in files])
+        blob_ids = release_file_blobs(qs)
+        qs.delete()
+
+        for owner_id, (count, size) in usage.items():
+            adjust_storage_usage(owner_id, -count, -size)
+
+        purge_unreferenced_blobs(blob_ids)
+        transaction.on_commit(lambda: invalidate_share_tokens(share_tokens))
+
+    get_storage_backend().delete_many(paths)
+    delete_renditions(paths)
+    return files
+
+def share_files(files: list[File]) -> None:
+    now = timezone.now()
+    changed = [f for f in files if not f.share_token]
+
+    for f in changed:
+        f.share_token = uuid4()
+        f.share_created = now
+
+    File.objects.bulk_update(
+        changed, ['share_token', 'share_created'], batch_size=BULK_UPDATE_BATCH
+    )
+    # вдруг эти токены уже пробовали и они попали в негативный кэш
+    invalidate_share_tokens([f.share_token for f in changed])
+
+def unshare_files(files: list[File]) -> None:
+    share_tokens = [f.share_token for f in files if f.share_token]
+
+    File.objects.filter(id__in=[f.id for f in files])\
+        .update(share_token=None, share_created=None)
+    invalidate_share_tokens(share_tokens)
+
+    for f in files:
+        f.share_token = None
+        f.share_created = None
+
+def comment_files(files: list[File], comment) -> None:
+    File.objects.filter(id__in=[f.id for f in files]).update(comment=comment)
+
+    for f in files:
+        f.comment = comment
@@ -1,3 +1,372 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from storage.backends import LocalStorageBackend, get_storage_backend
+from storage.middleware import UploadBodyGate
+from storage.models import Blob, File, UploadSession
+from storage.responses import MAX_RANGES, parse_range_header
+from storage.services import (
+    decode_cursor,
+    delete_stored_files,
+    encode_cursor,
+    finalize_upload,
+    lock_upload_staging,
+    new_staging_path,
+    upload_staging_dir,
+)
+from users.models import User
+
+# кэши на время тестов — в памяти процесса: файловый 'auth' общий
+# с запущенным сервером и пережил бы пересоздание тестовой БД
+TEST_CACHES = {
+    alias: {
+        **options,
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': f'test-{alias}',
+    }
+    for alias, options in settings.CACHES.items()
+}
+
+
+class ParseRangeHeaderTests(SimpleTestCase):
+    def test_single_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(parse_range_header('bytes=900-', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=990-5000', 1000), [(990, 999)])
+
+    def test_suffix_range(self):
+        self.assertEqual(parse_range_header('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=-5000', 1000), [(0, 999)])
+        self.assertEqual(parse_range_header('bytes=-0', 1000), [])
+        self.assertEqual(parse_range_header('bytes=-10', 0), [])
+
+    def test_multiple_ranges(self):
+        self.assertEqual(
+            parse_range_header('bytes=0-0, 10-19,-1', 100),
+            [(0, 0), (10, 19), (99, 99)],
+        )
+
+    def test_unsatisfiable(self):
+        self.assertEqual(parse_range_header('bytes=1000-', 1000), [])
+        self.assertEqual(parse_range_header('bytes=20-,30-40', 10), [])
+        # выполнимые диапазоны остаются, невыполнимые отбрасываются
+        self.assertEqual(parse_range_header('bytes=5000-,0-1', 1000), [(0, 1)])
+
+    def test_invalid_header_is_ignored(self):
+        for header in ('', 'items=0-1', 'bytes=', 'bytes=abc', 'bytes=5-1',
+                       'bytes=-', 'bytes=1-x', 'bytes=0-1;2-3'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range_header(header, 1000))
+
+    def test_too_many_ranges(self):
+        header = 'bytes=' + ','.join(f'{i}-{i}' for i in range(MAX_RANGES + 1))
+        self.assertIsNone(parse_range_header(header, 1000))
+
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        values = ['Файл №1.txt', 42, None, 1.5, '2026-10-17T12:00:00+00:00']
+        cursor = encode_cursor(values)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), values)
+
+    def test_invalid_cursor(self):
+        for cursor in ('', '!!!', 'e30', encode_cursor(['x'])[:-3], '_-_-'):
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(decode_cursor(cursor))
+
+
+@override_settings(ASGI_UPLOAD_MAX_BYTES=100)
+class UploadBodyGateTests(SimpleTestCase):
+    async def call(self, method, path, headers):
+        passed, sent = [], []
+
+        async def app(scope, receive, send):
+            passed.append(scope['path'])
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'headers': headers}
+        await UploadBodyGate(app)(scope, None, send)
+        return (sent[0]['status'] if sent else None), passed
+
+    async def test_limits_only_single_request_uploads(self):
+        upload = '/api/files/upload/'
+        self.assertEqual(
+            await self.call('POST', upload, [(b'content-length', b'100')]),
+            (None, [upload]),
+        )
+        self.assertEqual(
+            await self.call('POST', upload, [(b'content-length', b'101')]),
+            (413, []),
+        )
+        self.assertEqual(await self.call('POST', upload, []), (411, []))
+
+        other = '/api/files/uploads/'
+        self.assertEqual(
+            await self.call('POST', other, [(b'content-length', b'101')]),
+            (None, [other]),
+        )
+
+
+class StorageTestCase(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+
+        overrides = self.settings(
+            STORAGE_ROOT=root,
+            STORAGE_BACKEND='storage.backends.LocalStorageBackend',
+            STORAGE_DEDUP=True,
+            STORAGE_COMPRESSION='',
+            RENDITION_WORKERS=0,
+            CACHES=TEST_CACHES,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        get_storage_backend.cache_clear()
+        self.addCleanup(get_storage_backend.cache_clear)
+
+        self.user = User.objects.create_user(username='alice', password='x')
+
+    def refresh_user(self):
+        return User.objects.get(id=self.user.id)
+
+
+class BlobRefCountTests(StorageTestCase):
+    def store(self, data: bytes, name='a.txt', owner=None):
+        staged = new_staging_path()
+        staged.parent.mkdir(parents=True, exist_ok=True)
+        staged.write_bytes(data)
+        return finalize_upload(owner or self.user, staged, name, len(data))
+
+    def test_same_content_shares_one_blob(self):
+        backend = get_storage_backend()
+        bob = User.objects.create_user(username='bob', password='x')
+
+        first = self.store(b'same data')
+        second = self.store(b'same data', 'b.txt', owner=bob)
+        other = self.store(b'other data')
+
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertNotEqual(first.blob_id, other.blob_id)
+        self.assertEqual(first.relative_path, second.relative_path)
+        blob = Blob.objects.get(id=first.blob_id)
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(backend.path(blob.relative_path).read_bytes(), b'same data')
+
+        self.assertEqual(delete_stored_files([first]), [first])
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(backend.exists(blob.relative_path))
+
+        delete_stored_files([second])
+        self.assertFalse(Blob.objects.filter(id=blob.id).exists())
+        self.assertFalse(backend.exists(blob.relative_path))
+        self.assertEqual(Blob.objects.get(id=other.blob_id).ref_count, 1)
+
+    def test_delete_updates_usage_once(self):
+        first = self.store(b'12345')
+        second = self.store(b'12345', 'b.txt')
+        user = self.refresh_user()
+        self.assertEqual((user.files_count, user.used_bytes), (2, 10))
+
+        self.assertEqual(delete_stored_files([first, second]), [first, second])
+        # устаревший список: файлы уже удалены, повторно ничего не снимается
+        self.assertEqual(delete_stored_files([first, second]), [])
+
+        user = self.refresh_user()
+        self.assertEqual((user.files_count, user.used_bytes), (0, 0))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_lost_blob_data_is_written_again(self):
+        backend = get_storage_backend()
+        first = self.store(b'precious')
+        backend.delete(first.relative_path)
+
+        second = self.store(b'precious', 'copy.txt')
+
+        self.assertEqual(second.blob_id, first.blob_id)
+        self.assertEqual(Blob.objects.get(id=first.blob_id).ref_count, 2)
+        self.assertEqual(backend.path(first.relative_path).read_bytes(), b'precious')
+
+    def test_failed_write_releases_the_blob(self):
+        kept = self.store(b'kept')
+
+        with mock.patch.object(LocalStorageBackend, 'save', side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.store(b'lost')
+            with self.assertRaises(OSError):
+                # данные есть, но пропали: перезапись тоже не удалась
+                get_storage_backend().delete(kept.relative_path)
+                self.store(b'kept', 'again.txt')
+
+        self.assertEqual(list(Blob.objects.values_list('id', 'ref_count')),
+                         [(kept.blob_id, 1)])
+        user = self.refresh_user()
+        self.assertEqual((user.files_count, user.used_bytes), (1, 4))
+
+    @override_settings(STORAGE_DEDUP=False)
+    def test_without_dedup_file_owns_its_data(self):
+        backend = get_storage_backend()
+        first = self.store(b'data')
+        second = self.store(b'data', 'b.txt')
+
+        self.assertIsNone(first.blob_id)
+        self.assertNotEqual(first.relative_path, second.relative_path)
+
+        delete_stored_files([first])
+        self.assertFalse(backend.exists(first.relative_path))
+        self.assertTrue(backend.exists(second.relative_path))
+
+
+class UploadSessionTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def create(self, **payload):
+        payload.setdefault('name', 'notes.txt')
+        return self.client.post(
+            '/api/files/uploads/', payload, content_type='application/json'
+        )
+
+    def patch(self, session_id, offset, data: bytes):
+        return self.client.patch(
+            f'/api/files/uploads/{session_id}/', data,
+            content_type='application/offset+octet-stream',
+            headers={'Upload-Offset': str(offset)},
+        )
+
+    def put_part(self, session_id, number, data: bytes):
+        return self.client.put(
+            f'/api/files/uploads/{session_id}/parts/{number}/', data,
+            content_type='application/octet-stream',
+        )
+
+    def complete(self, session_id):
+        return self.client.post(f'/api/files/uploads/{session_id}/complete/')
+
+    def test_offset_upload(self):
+        response = self.create(size_bytes=11, comment='draft')
+        self.assertEqual(response.status_code, 201)
+        session = response.json()
+        self.assertEqual(session['offset'], 0)
+        session_id = session['id']
+
+        response = self.patch(session_id, 0, b'hello ')
+        self.assertEqual(response.json(), {'id': session_id, 'offset': 6})
+
+        # повтор уже принятого куска: клиент узнаёт текущее смещение
+        response = self.patch(session_id, 0, b'hello ')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 6)
+
+        response = self.patch(session_id, 6, b'world and more')
+        self.assertEqual(response.status_code, 413)
+
+        self.assertEqual(
+            self.client.get(f'/api/files/uploads/{session_id}/').json()['offset'], 6
+        )
+
+        response = self.patch(session_id, 6, b'world')
+        self.assertEqual(response.json()['offset'], 11)
+
+        response = self.complete(session_id)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['size_bytes'], 11)
+        self.assertEqual(data['comment'], 'draft')
+
+        f = File.objects.get(id=data['id'])
+        self.assertEqual(get_storage_backend().path(f.relative_path).read_bytes(),
+                         b'hello world')
+        self.assertFalse(UploadSession.objects.filter(id=session_id).exists())
+        self.assertFalse(upload_staging_dir(session_id).exists())
+
+        user = self.refresh_user()
+        self.assertEqual((user.files_count, user.used_bytes), (1, 11))
+        self.assertEqual(user.reserved_bytes, 0)
+
+    def test_complete_before_all_data_keeps_session(self):
+        session_id = self.create(size_bytes=4).json()['id']
+        self.patch(session_id, 0, b'ab')
+
+        response = self.complete(session_id)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 2)
+
+        self.assertEqual(self.patch(session_id, 2, b'cd').json()['offset'], 4)
+        self.assertEqual(self.complete(session_id).status_code, 201)
+        self.assertFalse(File.objects.filter(size_bytes=2).exists())
+
+    def test_numbered_parts(self):
+        session_id = self.create(size_bytes=9).json()['id']
+
+        self.assertEqual(self.put_part(session_id, 2, b'def').json()['size_bytes'], 3)
+        self.assertEqual(self.put_part(session_id, 3, b'ghi').status_code, 200)
+        self.assertEqual(self.put_part(session_id, 1, b'abc').status_code, 200)
+
+        parts = self.client.get(f'/api/files/uploads/{session_id}/').json()['parts']
+        self.assertEqual([p['number'] for p in parts], [1, 2, 3])
+
+        # смешивать дозапись по смещению и части нельзя
+        self.patch(session_id, 0, b'x')
+        self.assertEqual(self.complete(session_id).status_code, 409)
+        self.client.delete(f'/api/files/uploads/{session_id}/')
+
+        # пропуск в номерах — 409, и части остаются для повторной попытки
+        session_id = self.create(size_bytes=6).json()['id']
+        self.put_part(session_id, 1, b'abc')
+        self.put_part(session_id, 3, b'def')
+        self.assertEqual(self.complete(session_id).status_code, 409)
+
+        self.put_part(session_id, 3, b'')
+        self.put_part(session_id, 2, b'def')
+        response = self.complete(session_id)
+        self.assertEqual(response.status_code, 201)
+        f = File.objects.get(id=response.json()['id'])
+        self.assertEqual(get_storage_backend().path(f.relative_path).read_bytes(),
+                         b'abcdef')
+
+    def test_quota_is_reserved_for_the_session(self):
+        User.objects.filter(id=self.user.id).update(quota_bytes=10)
+
+        self.assertEqual(self.create().status_code, 400)
+        self.assertEqual(self.create(size_bytes=11).status_code, 413)
+
+        session_id = self.create(size_bytes=6).json()['id']
+        self.assertEqual(self.refresh_user().reserved_bytes, 6)
+        self.assertEqual(self.create(size_bytes=5).status_code, 413)
+
+        self.client.delete(f'/api/files/uploads/{session_id}/')
+        self.assertEqual(self.refresh_user().reserved_bytes, 0)
+        self.assertEqual(self.create(size_bytes=10).status_code, 201)
+
+    def test_abort_waits_for_complete_and_chunks(self):
+        session_id = self.create(size_bytes=1).json()['id']
+
+        with lock_upload_staging(session_id):
+            response = self.client.delete(f'/api/files/uploads/{session_id}/')
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(self.complete(session_id).status_code, 409)
+
+        self.assertEqual(self.patch(session_id, 0, b'x').status_code, 200)
+        self.assertEqual(self.complete(session_id).status_code, 201)
+        self.assertEqual(self.complete(session_id).status_code, 404)
+        response = self.client.delete(f'/api/files/uploads/{session_id}/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_other_users_session_is_not_found(self):
+        session_id = self.create(size_bytes=1).json()['id']
+
+        bob = User.objects.create_user(username='bob', password='x')
+        self.client.force_login(bob)
+
+        self.assertEqual(self.patch(session_id, 0, b'x').status_code, 404)
+        self.assertEqual(self.complete(session_id).status_code, 404)
@@ -0,0 +1,16 @@
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+
+# sync_to_async(thread_sensitive=False): функция идёт в пул потоков, а не
+# в общий sync-поток, где она встала бы в очередь за всеми синхронными
+# view и ORM-вызовами процесса. Соединения с БД, открытые в потоке пула,
+# Django сам не закрывает — закрываем после каждого вызова
+def in_worker_thread(func):
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+
+    return sync_to_async(run, thread_sensitive=False)
@@ -0,0 +1,103 @@
+import hashlib
+
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+
+from users.services import reserve_storage
+from .services import new_staging_path
+
+
+class StagedUploadedFile(UploadedFile):
+    def __init__(self, file, staging_path, name, content_type, size, charset,
+                 digest, content_type_extra=None):
+        super().__init__(
+            file, name, content_type, size, charset, content_type_extra
+        )
+        self.staging_path = staging_path
+        self.digest = digest
+
+    def temporary_file_path(self):
+        return str(self.staging_path)
+
+    def close(self):
+        try:
+            return self.file.close()
+        finally:
+            # после finalize_upload файла здесь уже нет (os.replace)
+            self.staging_path.unlink(missing_ok=True)
+
+
+class StagingFileUploadHandler(FileUploadHandler):
+    # Пишет тело файла сразу в STORAGE_ROOT/.uploads (та же ФС, что и
+    # хранилище) и попутно считает sha256: финализация — это rename,
+    # без второй копии и без повторного чтения для дедупликации
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.received = 0
+        self.allowance = None
+        self.completed = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        # квота проверяется по Content-Length до чтения тела:
+        # при отказе возвращаем пустые POST/FILES и ничего не пишем на диск
+        user = self.request.user
+        if not user.is_authenticated:
+            return None
+
+        reserved = reserve_storage(user, content_length)
+        if reserved is None:
+            self.request.storage_quota_exceeded = True
+            return QueryDict(encoding=encoding), MultiValueDict()
+
+        # резерв снимет StorageReservationMiddleware после ответа
+        self.request.storage_reserved = reserved
+        if reserved:
+            self.allowance = reserved
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.completed = False
+        self.staging_path = new_staging_path()
+        self.staging_path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = self.staging_path.open('wb+')
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.allowance is not None and self.received > self.allowance:
+            # тело оказалось больше, чем было зарезервировано
+            self.request.storage_quota_exceeded = True
+            raise StopUpload(connection_reset=True)
+
+        self.file.write(raw_data)
+        self.digest.update(raw_data)
+
+    def file_complete(self, file_size):
+        self.completed = True
+        self.file.flush()
+        self.file.seek(0)
+        return StagedUploadedFile(
+            file=self.file,
+            staging_path=self.staging_path,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            digest=self.digest.hexdigest(),
+            content_type_extra=self.content_type_extra,
+        )
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+            self.staging_path.unlink(missing_ok=True)
+
+    def upload_complete(self):
+        # файл, оборванный StopUpload, Django только закрывает
+        if hasattr(self, 'file') and not self.completed:
+            self.file.close()
+            self.staging_path.unlink(missing_ok=True)
@@ -2,21 +2,42 @@ from django.urls import path
 from .views import (
     upload_file,
     list_files,
+    search_files,
     delete_file,
+    bulk_files,
     rename_file,
     download_file,
+    file_rendition,
+    download_archive,
     comment_file,
     enable_share,
     disable_share,
     download_shared,
+    upload_session_create,
+    upload_session_detail,
+    upload_session_part,
+    upload_session_complete,
 )
 
 urlpatterns = [
     path('files/upload/', upload_file, name='files-upload'),
+    path('files/uploads/', upload_session_create,
+         name='files-upload-session-create'),
+    path('files/uploads/<uuid:session_id>/', upload_session_detail,
+         name='files-upload-session'),
+    path('files/uploads/<uuid:session_id>/parts/<int:number>/',
+         upload_session_part, name='files-upload-session-part'),
+    path('files/uploads/<uuid:session_id>/complete/', upload_session_complete,
+         name='files-upload-session-complete'),
     path('files/', list_files, name='files-list'),
+    path('files/search/', search_files, name='files-search'),
+    path('files/bulk/', bulk_files, name='files-bulk'),
+    path('files/archive/', download_archive, name='files-archive'),
     path('files/<int:file_id>/', delete_file, name='files-delete'),
     path('files/<int:file_id>/rename/', rename_file, name='files-rename'),
     path('files/<int:file_id>/download/', download_file, name='files-download'),
+    path('files/<int:file_id>/renditions/<str:kind>/', file_rendition,
+         name='files-rendition'),
     path('files/<int:file_id>/comment/', comment_file, name='files-comment'),
     path('files/<int:file_id>/share/', enable_share,
          name='files-share-enable'),
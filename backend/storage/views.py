@@ -1,62 +1,114 @@
 import os
 from pathlib import Path
+import time
 import uuid
 import json
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.http import (
     HttpRequest,
+    HttpResponse,
     JsonResponse,
     HttpResponseNotAllowed,
-    FileResponse
+    StreamingHttpResponse,
 )
+from django.db.models.functions import Lower
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header
 from django.views.decorators.http import (
     require_POST,
     require_GET,
     require_http_methods
 )
 
-from .models import File
+from .models import File, Rendition, UploadSession
+from .archives import iter_files_by_id, iter_zip
+from .metrics import (
+    metrics_response,
+    record_upload,
+    track_download,
+    upload_in_flight,
+)
+from .renditions import (
+    get_rendition,
+    read_rendition,
+    rendition_kinds,
+    schedule_renditions,
+)
+from .responses import file_response, stream_content
 from .services import (
-    make_stored_name,
-    user_storage_abs_path,
-    write_file,
     get_file_for_user,
+    get_files_for_user,
+    visible_files,
+    apply_file_search,
     can_manage_files,
-    ensure_user_storage_dir
+    store_uploaded_file,
+    finalize_upload,
+    delete_stored_file,
+    delete_stored_files,
+    share_files,
+    unshare_files,
+    comment_files,
+    record_download,
+    resolve_share_token,
+    invalidate_share_tokens,
+    get_upload_session_for_user,
+    upload_session_offset,
+    upload_session_parts,
+    upload_staging_file,
+    lock_upload_staging,
+    append_upload_chunk,
+    write_upload_part,
+    assemble_upload_parts,
+    remove_upload_staging,
+    close_upload_session,
+    delete_upload_session,
+    encode_cursor,
+    decode_cursor,
+    keyset_page,
+    UPLOAD_PART_MAX_NUMBER,
 )
+from .threads import in_worker_thread
 
 from users.models import User
+from users.services import get_storage_quota, reserve_storage
+
+# upload_file, download_file и download_shared асинхронные: под ASGI
+# (см. config/asgi.py) медленные клиенты не держат поток воркера,
+# а ORM и работа с диском уходят в sync_to_async / пул потоков
 
 @require_POST
-def upload_file(request):
-    if not request.user.is_authenticated:
+async def upload_file(request):
+    user = await request.auser()
+    if not user.is_authenticated:
         return JsonResponse({'detail': 'Authentication required'}, status=401)
 
-    uploaded_file = request.FILES.get('file')
-    if not uploaded_file:
-        return JsonResponse({'detail': 'Missing file'}, status=400)
-
-    ensure_user_storage_dir(request.user.storage_rel_path)
+    # разбор multipart пишет тело на диск, а upload handler резервирует
+    # квоту в БД — поэтому не в event loop, и не в общем sync-потоке:
+    # большая загрузка не должна держать остальные запросы процесса
+    started = time.perf_counter()
+    with upload_in_flight():
+        files, post = await in_worker_thread(
+            lambda: (request.FILES, request.POST)
+        )()
+    uploaded_file = files.get('file')
 
-    comment = request.POST.get('comment') or None
+    # флаг ставит StagingFileUploadHandler, тело при этом не читается
+    if getattr(request, 'storage_quota_exceeded', False):
+        return JsonResponse({'detail': 'Storage quota exceeded'}, status=413)
 
-    stored_name = make_stored_name(uploaded_file.name)
-    rel_dir = request.user.storage_rel_path
-    abs_path = user_storage_abs_path(rel_dir) / stored_name
+    if not uploaded_file:
+        return JsonResponse({'detail': 'Missing file'}, status=400)
 
-    write_file(uploaded_file, abs_path)
+    comment = post.get('comment') or None
 
-    obj = File.objects.create(
-        owner=request.user,
-        original_name=uploaded_file.name,
-        stored_name=stored_name,
-        relative_path=str(rel_dir) + stored_name,
-        size_bytes=uploaded_file.size,
-        comment=comment,
-        uploaded=timezone.now(),
+    obj = await in_worker_thread(store_uploaded_file)(
+        user, uploaded_file, comment=comment
     )
+    record_upload(request, obj.size_bytes, time.perf_counter() - started)
+    schedule_renditions(obj)
 
     return JsonResponse(
         {
@@ -69,6 +121,27 @@ def upload_file(request):
         status=201,
     )
 
+FILE_SORT_FIELDS = {
+    'uploaded': 'uploaded',
+    'name': 'original_name',
+    'size': 'size_bytes',
+}
+FILES_PAGE_DEFAULT = 100
+FILES_PAGE_MAX = 1000
+
+def file_data(request, f: File) -> dict:
+    return {
+        'id': f.id,
+        'original_name': f.original_name,
+        'size_bytes': f.size_bytes,
+        'stored_bytes': f.stored_bytes,
+        'comment': f.comment,
+        'uploaded': f.uploaded.isoformat(),
+        'last_downloaded': f.last_downloaded.isoformat() if f.last_downloaded else None,
+        'share_url': request.build_absolute_uri(f'/api/share/{f.share_token}/') if f.share_token else None,
+        'share_created': f.share_created.isoformat() if f.share_created else None,
+    }
+
 @require_GET
 def list_files(request):
     if not request.user.is_authenticated:
@@ -91,22 +164,144 @@ def list_files(request):
     else:
         files = File.objects.filter(owner=request.user)
 
-    files = files.order_by('-uploaded')
+    name_prefix = request.GET.get('name_prefix')
+    if name_prefix:
+        files = files.alias(name_lower=Lower('original_name'))\
+            .filter(name_lower__startswith=name_prefix.lower())
+
+    for param, lookup in (('size_min', 'gte'), ('size_max', 'lte')):
+        value = request.GET.get(param)
+        if value is None:
+            continue
+        if not value.isdigit():
+            return JsonResponse(
+                {'detail': f'Invalid {param}: expected integer'},
+                status=400
+            )
+        files = files.filter(**{f'size_bytes__{lookup}': int(value)})
+
+    if request.GET.get('shared') == '1':
+        files = files.filter(share_token__isnull=False)
+
+    sort = request.GET.get('sort', '-uploaded')
+    if sort.lstrip('-') not in FILE_SORT_FIELDS:
+        return JsonResponse({'detail': 'Invalid sort'}, status=400)
+    sort_field = FILE_SORT_FIELDS[sort.lstrip('-')]
+    descending = sort.startswith('-')
+
+    limit = request.GET.get('limit')
+    cursor = request.GET.get('cursor')
+
+    # без limit/cursor — прежний ответ массивом
+    if limit is None and cursor is None:
+        files = files.order_by(
+            f'{"-" if descending else ""}{sort_field}',
+            f'{"-" if descending else ""}id',
+        )
+        return JsonResponse(
+            [file_data(request, f) for f in files], safe=False
+        )
+
+    limit = limit or str(FILES_PAGE_DEFAULT)
+    if not limit.isdigit() or not 1 <= int(limit) <= FILES_PAGE_MAX:
+        return JsonResponse(
+            {'detail': f'Invalid limit: expected 1..{FILES_PAGE_MAX}'},
+            status=400
+        )
+
+    after = None
+    if cursor:
+        after = decode_cursor(cursor)
+        if not after or after[0] != sort or len(after) != 3:
+            return JsonResponse({'detail': 'Invalid cursor'}, status=400)
+        after = after[1:]
+
+    page, has_more = keyset_page(
+        files, sort_field, descending, after, int(limit)
+    )
 
-    data = [
-        {
-            'id': f.id,
-            'original_name': f.original_name,
-            'size_bytes': f.size_bytes,
-            'comment': f.comment,
-            'uploaded': f.uploaded.isoformat(),
-            'last_downloaded': f.last_downloaded.isoformat() if f.last_downloaded else None,
-            'share_url': request.build_absolute_uri(f'/api/share/{f.share_token}/') if f.share_token else None,
-            'share_created': f.share_created.isoformat() if f.share_created else None,
-        }
-        for f in files
-    ]
-    return JsonResponse(data, safe=False)
+    next_cursor = None
+    if has_more:
+        last = page[-1]
+        value = getattr(last, sort_field)
+        if sort_field == 'uploaded':
+            value = value.isoformat()
+        next_cursor = encode_cursor([sort, value, last.id])
+
+    return JsonResponse({
+        'results': [file_data(request, f) for f in page],
+        'next_cursor': next_cursor,
+    })
+
+SEARCH_MAX_QUERY = 200
+
+# поиск по имени и комментарию среди всех файлов, доступных actor-у
+# (или одного пользователя — user_id), по убыванию релевантности
+@require_GET
+def search_files(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication required'}, status=401)
+
+    q = request.GET.get('q', '').strip()
+    if not q or len(q) > SEARCH_MAX_QUERY:
+        return JsonResponse(
+            {'detail': f'Invalid q: expected 1..{SEARCH_MAX_QUERY} chars'},
+            status=400
+        )
+
+    user_id = request.GET.get('user_id')
+    if user_id is not None:
+        if not user_id.isdigit():
+            return JsonResponse({'detail': 'Invalid user_id: expected integer'}, status=400)
+
+        target_user = User.objects.filter(id=int(user_id)).first()
+        if not target_user:
+            return JsonResponse({'detail': 'User not found'}, status=404)
+
+        if not can_manage_files(request.user, target_user):
+            return JsonResponse({'detail': 'Forbidden'}, status=403)
+
+        files = File.objects.filter(owner_id=int(user_id))
+    else:
+        files = visible_files(request.user)
+
+    files = apply_file_search(files.select_related('owner'), q)
+    if files is None:
+        return JsonResponse({'detail': 'Invalid q: no words to search'}, status=400)
+
+    limit = request.GET.get('limit') or str(FILES_PAGE_DEFAULT)
+    if not limit.isdigit() or not 1 <= int(limit) <= FILES_PAGE_MAX:
+        return JsonResponse(
+            {'detail': f'Invalid limit: expected 1..{FILES_PAGE_MAX}'},
+            status=400
+        )
+
+    # в курсоре и сам запрос: со страницей другого запроса он не сочетается
+    after = None
+    cursor = request.GET.get('cursor')
+    if cursor:
+        after = decode_cursor(cursor)
+        if not after or after[0] != q or len(after) != 3:
+            return JsonResponse({'detail': 'Invalid cursor'}, status=400)
+        after = after[1:]
+
+    page, has_more = keyset_page(files, 'score', True, after, int(limit))
+
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor([q, page[-1].score, page[-1].id])
+
+    return JsonResponse({
+        'results': [
+            {
+                **file_data(request, f),
+                'owner': {'id': f.owner_id, 'username': f.owner.username},
+                'score': f.score,
+            }
+            for f in page
+        ],
+        'next_cursor': next_cursor,
+    })
 
 @require_http_methods(['DELETE'])
 def delete_file(request, file_id):
@@ -117,14 +312,89 @@ def delete_file(request, file_id):
     if not file_obj:
         return JsonResponse({'detail': 'File not found'}, status=404)
 
-    full_path = user_storage_abs_path(file_obj.relative_path)
-    if full_path.exists():
-        full_path.unlink()
-
-    file_obj.delete()
+    if not delete_stored_file(file_obj):
+        return JsonResponse({'detail': 'File not found'}, status=404)
 
     return JsonResponse({'detail': 'File deleted'})
 
+BULK_ACTIONS = ('delete', 'share', 'unshare', 'comment')
+BULK_MAX_IDS = 1000
+
+@require_POST
+def bulk_files(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication required'}, status=401)
+
+    try:
+        payload = json.loads(request.body.decode('utf-8') or '{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'detail': 'Invalid JSON'}, status=400)
+
+    action = payload.get('action')
+    if action not in BULK_ACTIONS:
+        return JsonResponse(
+            {'detail': f'Invalid action: expected one of {", ".join(BULK_ACTIONS)}'},
+            status=400,
+        )
+
+    file_ids = payload.get('ids')
+    if (
+        not isinstance(file_ids, list)
+        or not file_ids
+        or not all(type(i) is int for i in file_ids)
+    ):
+        return JsonResponse(
+            {'detail': 'Invalid ids: expected non-empty list of integers'},
+            status=400,
+        )
+
+    if len(file_ids) > BULK_MAX_IDS:
+        return JsonResponse(
+            {'detail': f'Too many ids: max {BULK_MAX_IDS}'},
+            status=400,
+        )
+
+    # comment может быть пустой строкой — разрешим очистку
+    if action == 'comment' and 'comment' not in payload:
+        return JsonResponse({'detail': 'Missing comment'}, status=400)
+
+    file_ids = list(dict.fromkeys(file_ids))
+    files = get_files_for_user(request, file_ids)
+
+    # без общей транзакции: каждое действие атомарно само, а
+    # delete_stored_files удаляет данные из хранилища после своего commit
+    if action == 'delete':
+        # удалённые параллельным запросом — not_found
+        files = delete_stored_files(files)
+    elif action == 'share':
+        share_files(files)
+    elif action == 'unshare':
+        unshare_files(files)
+    else:
+        comment_files(files, payload.get('comment'))
+
+    # чужие (без прав) и несуществующие неразличимы, как и в одиночных view
+    by_id = {f.id: f for f in files}
+    results = []
+    for file_id in file_ids:
+        f = by_id.get(file_id)
+        if not f:
+            results.append({'id': file_id, 'status': 'not_found'})
+            continue
+
+        item = {'id': file_id, 'status': 'ok'}
+        if action in ('share', 'unshare'):
+            item['share_url'] = request.build_absolute_uri(
+                f'/api/share/{f.share_token}/'
+            ) if f.share_token else None
+            item['share_created'] = f.share_created.isoformat() if f.share_created else None
+            item['share_token'] = str(f.share_token) if f.share_token else None
+        elif action == 'comment':
+            item['comment'] = f.comment
+        results.append(item)
+
+    return JsonResponse({'action': action, 'results': results})
+
 @require_http_methods(['PATCH'])
 def rename_file(request, file_id):
     if not request.user.is_authenticated:
@@ -145,6 +415,7 @@ def rename_file(request, file_id):
 
     file_obj.original_name = new_name
     file_obj.save(update_fields=['original_name'])
+    invalidate_share_tokens([file_obj.share_token])
 
     return JsonResponse({
         'id': file_obj.id,
@@ -152,7 +423,38 @@ def rename_file(request, file_id):
     })
 
 @require_GET
-def download_file(request, file_id):
+async def download_file(request, file_id):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication required'}, status=401)
+
+    file_obj = await sync_to_async(get_file_for_user)(request, file_id)
+    if not file_obj:
+        return JsonResponse({'detail': 'File not found'}, status=404)
+
+    mode = request.GET.get('mode', 'download')
+    as_attachment = mode != 'preview'
+
+    try:
+        # stat/open — блокирующие вызовы, их делаем вне event loop
+        response = await in_worker_thread(file_response)(
+            request, file_obj, as_attachment
+        )
+    except FileNotFoundError:
+        return JsonResponse({'detail': 'File not found'}, status=404)
+
+    # 304/412/416 — тело не отдаётся, это не скачивание
+    if response.status_code < 300:
+        await sync_to_async(record_download)(file_obj)
+
+    return track_download(request, response)
+
+# содержимое файла не меняется, поэтому rendition по его id можно
+# кешировать в браузере сколько угодно
+RENDITION_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+@require_GET
+def file_rendition(request, file_id, kind):
     if not request.user.is_authenticated:
         return JsonResponse({'detail': 'Authentication required'}, status=401)
 
@@ -160,21 +462,110 @@ def download_file(request, file_id):
     if not file_obj:
         return JsonResponse({'detail': 'File not found'}, status=404)
 
-    full_path = user_storage_abs_path(file_obj.relative_path)
-    if not full_path.exists():
-        return JsonResponse({'detail': 'File not found'}, status=404)
+    if kind not in rendition_kinds(file_obj):
+        return JsonResponse({'detail': 'Rendition not available'}, status=404)
+
+    etag = f'"{file_obj.stored_name}-{kind}"'
+    conditional = get_conditional_response(request, etag=etag)
+    if conditional is not None:
+        conditional['ETag'] = etag
+        conditional['Cache-Control'] = RENDITION_CACHE_CONTROL
+        return conditional
+
+    # вторая попытка — если данные rendition потерялись из хранилища
+    # (тогда она заново уходит на генерацию)
+    for _ in range(2):
+        rendition = get_rendition(file_obj, kind)
+        if rendition is None:
+            response = JsonResponse(
+                {'detail': 'Rendition is being generated'}, status=503
+            )
+            response['Retry-After'] = '1'
+            return response
+
+        if rendition.status == Rendition.STATUS_FAILED:
+            return JsonResponse({'detail': 'Rendition failed'}, status=404)
+
+        try:
+            data = read_rendition(rendition)
+            break
+        except FileNotFoundError:
+            Rendition.objects.filter(id=rendition.id).delete()
+    else:
+        return JsonResponse({'detail': 'Rendition not available'}, status=404)
 
-    mode = request.GET.get('mode', 'download')
-    as_attachment = mode != 'preview'
+    response = HttpResponse(data, content_type=rendition.content_type)
+    response['ETag'] = etag
+    response['Cache-Control'] = RENDITION_CACHE_CONTROL
+    return track_download(request, response)
 
-    file_obj.last_downloaded = timezone.now()
-    file_obj.save(update_fields=['last_downloaded'])
+ARCHIVE_MAX_IDS = 1000
+ARCHIVE_FIELDS = (
+    'id', 'original_name', 'relative_path', 'size_bytes', 'encoding',
+    'stored_bytes', 'uploaded',
+)
 
-    return FileResponse(
-        full_path.open('rb'),
-        as_attachment=as_attachment,
-        filename=file_obj.original_name,
+@require_GET
+def download_archive(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication required'}, status=401)
+
+    ids = request.GET.get('ids')
+    user_id = request.GET.get('user_id')
+
+    if (ids is None) == (user_id is None):
+        return JsonResponse(
+            {'detail': 'Expected either ids or user_id'}, status=400
+        )
+
+    if user_id is not None:
+        if not user_id.isdigit():
+            return JsonResponse({'detail': 'Invalid user_id: expected integer'}, status=400)
+
+        target_user = User.objects.filter(id=int(user_id)).first()
+        if not target_user:
+            return JsonResponse({'detail': 'User not found'}, status=404)
+
+        if not can_manage_files(request.user, target_user):
+            return JsonResponse({'detail': 'Forbidden'}, status=403)
+
+        files = iter_files_by_id(
+            File.objects.filter(owner=target_user).only(*ARCHIVE_FIELDS)
+        )
+        archive_name = f'{target_user.username}.zip'
+    else:
+        file_ids = ids.split(',')
+        if not all(i.isdigit() for i in file_ids):
+            return JsonResponse(
+                {'detail': 'Invalid ids: expected comma-separated integers'},
+                status=400,
+            )
+
+        file_ids = list(dict.fromkeys(int(i) for i in file_ids))
+        if len(file_ids) > ARCHIVE_MAX_IDS:
+            return JsonResponse(
+                {'detail': f'Too many ids: max {ARCHIVE_MAX_IDS}'},
+                status=400,
+            )
+
+        by_id = {f.id: f for f in get_files_for_user(request, file_ids)}
+        if len(by_id) != len(file_ids):
+            return JsonResponse({'detail': 'File not found'}, status=404)
+
+        files = [by_id[i] for i in file_ids]
+        archive_name = 'files.zip'
+
+    # размер архива заранее неизвестен — chunked, без Content-Length
+    response = StreamingHttpResponse(
+        stream_content(request, iter_zip(files)),
+        content_type='application/zip',
+    )
+    response['Content-Disposition'] = content_disposition_header(
+        True, archive_name
     )
+    # nginx иначе может копить ответ в proxy-буфере
+    response['X-Accel-Buffering'] = 'no'
+    return track_download(request, response)
 
 @require_http_methods(['PATCH'])
 def comment_file(request, file_id):
@@ -216,6 +607,8 @@ def enable_share(request, file_id):
         file_obj.share_token = uuid.uuid4()
         file_obj.share_created = timezone.now()
         file_obj.save(update_fields=['share_token', 'share_created'])
+        # вдруг этот токен уже пробовали и он попал в негативный кэш
+        invalidate_share_tokens([file_obj.share_token])
 
     url = request.build_absolute_uri(f'/api/share/{file_obj.share_token}/')
 
@@ -236,9 +629,11 @@ def disable_share(request, file_id):
     if not file_obj:
         return JsonResponse({'detail': 'File not found'}, status=404)
 
+    old_token = file_obj.share_token
     file_obj.share_token = None
     file_obj.share_created = None
     file_obj.save(update_fields=['share_token', 'share_created'])
+    invalidate_share_tokens([old_token])
 
     return JsonResponse({
         'id': file_obj.id,
@@ -248,21 +643,280 @@ def disable_share(request, file_id):
     })
 
 @require_http_methods(['GET'])
-def download_shared(request, token):
-    try:
-        file_obj = File.objects.get(share_token=token)
-    except File.DoesNotExist:
+async def download_shared(request, token):
+    file_obj = await sync_to_async(resolve_share_token)(token)
+    if not file_obj:
         return JsonResponse({'detail': 'File not found'}, status=404)
 
-    full_path = user_storage_abs_path(file_obj.relative_path)
-    if not full_path.exists():
+    # без отдельного exists(): отсутствие файла видно при открытии
+    try:
+        response = await in_worker_thread(file_response)(
+            request, file_obj, as_attachment=True
+        )
+    except FileNotFoundError:
+        await sync_to_async(invalidate_share_tokens)([token])
         return JsonResponse({'detail': 'File not found'}, status=404)
 
-    file_obj.last_downloaded = timezone.now()
-    file_obj.save(update_fields=['last_downloaded'])
+    if response.status_code < 300:
+        await sync_to_async(record_download)(file_obj)
+
+    return track_download(request, response)
+
+def upload_session_data(session: UploadSession) -> dict:
+    return {
+        'id': str(session.id),
+        'original_name': session.original_name,
+        'size_bytes': session.size_bytes,
+        'offset': upload_session_offset(session.id),
+        'parts': upload_session_parts(session.id),
+        'created': session.created.isoformat(),
+        'updated': session.updated.isoformat(),
+    }
+
+@require_POST
+def upload_session_create(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication required'}, status=401)
+
+    try:
+        payload = json.loads(request.body.decode('utf-8') or '{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'detail': 'Invalid JSON'}, status=400)
+
+    name = (payload.get('name') or '').strip()
+    if not name:
+        return JsonResponse({'detail': 'Missing name'}, status=400)
+
+    size_bytes = payload.get('size_bytes')
+    if size_bytes is not None and (
+        not isinstance(size_bytes, int) or size_bytes < 0
+    ):
+        return JsonResponse({'detail': 'Invalid size_bytes'}, status=400)
+
+    if get_storage_quota(request.user) is not None and size_bytes is None:
+        return JsonResponse(
+            {'detail': 'size_bytes is required when storage quota is set'},
+            status=400
+        )
+
+    # место резервируется сразу под весь заявленный размер
+    reserved = reserve_storage(request.user, size_bytes or 0)
+    if reserved is None:
+        return JsonResponse({'detail': 'Storage quota exceeded'}, status=413)
 
-    return FileResponse(
-        full_path.open('rb'),
-        as_attachment=True,
-        filename=file_obj.original_name,
+    session = UploadSession.objects.create(
+        owner=request.user,
+        original_name=name,
+        comment=payload.get('comment') or None,
+        size_bytes=size_bytes,
+        reserved_bytes=reserved,
+    )
+
+    return JsonResponse(upload_session_data(session), status=201)
+
+@require_http_methods(['GET', 'PATCH', 'DELETE'])
+def upload_session_detail(request, session_id):
+    if not request.user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication required'}, status=401)
+
+    if request.method == 'GET':
+        session = get_upload_session_for_user(request, session_id)
+        if not session:
+            return JsonResponse({'detail': 'Upload not found'}, status=404)
+        return JsonResponse(upload_session_data(session))
+
+    if request.method == 'DELETE':
+        session = get_upload_session_for_user(request, session_id)
+        if not session:
+            return JsonResponse({'detail': 'Upload not found'}, status=404)
+        if not close_upload_session(session):
+            return JsonResponse({'detail': 'Upload is busy'}, status=409)
+        return JsonResponse({'detail': 'Upload aborted'})
+
+    # PATCH: дописать кусок в конец staging-файла (смещение как в tus)
+    offset = request.headers.get('Upload-Offset', '')
+    if not offset.isdigit():
+        return JsonResponse(
+            {'detail': 'Missing or invalid Upload-Offset header'},
+            status=400
+        )
+
+    session = get_upload_session_for_user(request, session_id)
+    if not session:
+        return JsonResponse({'detail': 'Upload not found'}, status=404)
+
+    # смещение проверяется и кусок пишется под flock staging-файла, без
+    # транзакции: медленный клиент не держит соединение с БД и блокировку
+    with lock_upload_staging(session.id) as out:
+        if out is None:
+            return JsonResponse(
+                {'detail': 'Upload is busy', 'offset': upload_session_offset(session.id)},
+                status=409
+            )
+
+        current = upload_session_offset(session.id)
+        if int(offset) != current:
+            return JsonResponse(
+                {'detail': 'Offset mismatch', 'offset': current},
+                status=409
+            )
+
+        content_length = request.headers.get('Content-Length', '')
+        if (
+            session.size_bytes is not None
+            and content_length.isdigit()
+            and current + int(content_length) > session.size_bytes
+        ):
+            return JsonResponse(
+                {'detail': 'Chunk exceeds declared size', 'offset': current},
+                status=413
+            )
+
+        started = time.perf_counter()
+        try:
+            with upload_in_flight():
+                current = append_upload_chunk(request, out)
+        except ValueError:
+            return JsonResponse(
+                {
+                    'detail': 'Chunk is too large',
+                    'offset': upload_session_offset(session.id),
+                },
+                status=413
+            )
+
+    record_upload(
+        request, current - int(offset), time.perf_counter() - started
+    )
+
+    # сессию могли отменить, пока шёл кусок
+    updated = UploadSession.objects.filter(id=session.id)\
+        .update(updated=timezone.now())
+    if not updated:
+        return JsonResponse({'detail': 'Upload not found'}, status=404)
+
+    return JsonResponse({'id': str(session.id), 'offset': current})
+
+@require_http_methods(['PUT'])
+def upload_session_part(request, session_id, number):
+    if not request.user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication required'}, status=401)
+
+    if not 1 <= number <= UPLOAD_PART_MAX_NUMBER:
+        return JsonResponse(
+            {'detail': f'Part number must be 1..{UPLOAD_PART_MAX_NUMBER}'},
+            status=400
+        )
+
+    session = get_upload_session_for_user(request, session_id)
+    if not session:
+        return JsonResponse({'detail': 'Upload not found'}, status=404)
+
+    content_length = request.headers.get('Content-Length', '')
+    if session.size_bytes is not None and content_length.isdigit():
+        other_parts = sum(
+            p['size_bytes'] for p in upload_session_parts(session.id)
+            if p['number'] != number
+        )
+        if other_parts + int(content_length) > session.size_bytes:
+            return JsonResponse(
+                {'detail': 'Part exceeds declared size'},
+                status=413
+            )
+
+    # части пишутся в отдельные файлы, поэтому их можно грузить параллельно
+    started = time.perf_counter()
+    try:
+        with upload_in_flight():
+            size_bytes = write_upload_part(request, session.id, number)
+    except ValueError:
+        return JsonResponse({'detail': 'Part is too large'}, status=413)
+    record_upload(request, size_bytes, time.perf_counter() - started)
+
+    UploadSession.objects.filter(id=session.id)\
+        .update(updated=timezone.now())
+
+    return JsonResponse({
+        'id': str(session.id),
+        'number': number,
+        'size_bytes': size_bytes,
+    })
+
+@require_POST
+def upload_session_complete(request, session_id):
+    if not request.user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication required'}, status=401)
+
+    session = get_upload_session_for_user(request, session_id)
+    if not session:
+        return JsonResponse({'detail': 'Upload not found'}, status=404)
+
+    # от параллельных PATCH, complete и отмены защищает flock staging-файла,
+    # а не блокировка строки: сжатие и запись в хранилище идут без транзакции
+    with lock_upload_staging(session.id) as out:
+        if out is None:
+            return JsonResponse(
+                {'detail': 'Upload is busy: a chunk is still being written'},
+                status=409
+            )
+
+        # сессию могли завершить или отменить до того, как мы взяли flock
+        if not UploadSession.objects.filter(id=session.id).exists():
+            return JsonResponse({'detail': 'Upload not found'}, status=404)
+
+        size_bytes = upload_session_offset(session.id)
+        parts = upload_session_parts(session.id)
+        if parts:
+            if size_bytes:
+                return JsonResponse(
+                    {'detail': 'Cannot mix offset chunks and numbered parts'},
+                    status=409
+                )
+            size_bytes = sum(p['size_bytes'] for p in parts)
+
+        # до склейки: она расходует части, и после 409 сессию
+        # уже нельзя было бы дозагрузить
+        if session.size_bytes is not None and size_bytes != session.size_bytes:
+            return JsonResponse(
+                {'detail': 'Size mismatch', 'offset': size_bytes},
+                status=409
+            )
+
+        if parts:
+            try:
+                assemble_upload_parts(session.id)
+            except ValueError as e:
+                return JsonResponse({'detail': str(e)}, status=409)
+
+        obj = finalize_upload(
+            request.user,
+            upload_staging_file(session.id),
+            session.original_name,
+            size_bytes,
+            comment=session.comment,
+        )
+        delete_upload_session(session)
+
+    remove_upload_staging(session_id)
+    schedule_renditions(obj)
+
+    return JsonResponse(
+        {
+            'id': obj.id,
+            'original_name': obj.original_name,
+            'size_bytes': obj.size_bytes,
+            'comment': obj.comment,
+            'uploaded': obj.uploaded.isoformat(),
+        },
+        status=201,
     )
+
+# Prometheus; с PROMETHEUS_MULTIPROC_DIR — сумма по всем воркерам gunicorn
+@require_GET
+def metrics(request):
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return JsonResponse({'detail': 'Authentication required'}, status=401)
+
+    data, content_type = metrics_response()
+    return HttpResponse(data, content_type=content_type)
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from .models import User
+        from .services import drop_cached_user
+
+        post_save.connect(drop_cached_user, sender=User)
+        post_delete.connect(drop_cached_user, sender=User)
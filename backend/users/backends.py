@@ -0,0 +1,47 @@
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+from .models import User
+from .services import CACHED_USER_DEFERRED, cached_user_key
+
+
+class CachedModelBackend(ModelBackend):
+    # AuthenticationMiddleware загружает пользователя на каждый запрос;
+    # здесь он сначала ищется в кэше 'auth'. Сброс — invalidate_cached_user
+
+    def get_user(self, user_id):
+        cache = caches['auth']
+        key = cached_user_key(user_id)
+
+        user = cache.get(key)
+        if user is None:
+            user = self.load_user(user_id)
+            if user is not None:
+                cache.set(key, user)
+        return user
+
+    async def aget_user(self, user_id):
+        cache = caches['auth']
+        key = cached_user_key(user_id)
+
+        user = await cache.aget(key)
+        if user is None:
+            user = await self.aload_user(user_id)
+            if user is not None:
+                await cache.aset(key, user)
+        return user
+
+    def load_user(self, user_id):
+        try:
+            user = User.objects.defer(*CACHED_USER_DEFERRED).get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    async def aload_user(self, user_id):
+        try:
+            user = await User.objects.defer(*CACHED_USER_DEFERRED)\
+                .aget(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from storage.models import UploadSession
+from users.models import User
+from users.services import storage_usage_drift
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-user files_count / used_bytes counters ' \
+           'from the files table and fix the ones that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report drifted users',
+        )
+        parser.add_argument(
+            '--reset-reservations',
+            action='store_true',
+            help='Recompute reserved_bytes from open upload sessions. '
+                 'Run only when no multipart upload is in flight',
+        )
+
+    def handle(self, *args, **options):
+        fixed = 0
+
+        for user, actual_count, actual_bytes in storage_usage_drift():
+            self.stdout.write(
+                f'{user.username}: files {user.files_count} -> {actual_count}, '
+                f'bytes {user.used_bytes} -> {actual_bytes}'
+            )
+            if not options['dry_run']:
+                # если счётчики успели измениться, пропустим до следующего запуска
+                User.objects.filter(
+                    id=user.id,
+                    files_count=user.files_count,
+                    used_bytes=user.used_bytes,
+                ).update(
+                    files_count=actual_count,
+                    used_bytes=actual_bytes,
+                )
+            fixed += 1
+
+        verb = 'Drifted' if options['dry_run'] else 'Fixed'
+        self.stdout.write(f'{verb} users: {fixed}')
+
+        if options['reset_reservations'] and not options['dry_run']:
+            sessions = UploadSession.objects.filter(owner=OuterRef('pk'))\
+                .order_by().values('owner')\
+                .annotate(total=Sum('reserved_bytes')).values('total')
+            reset = User.objects.update(
+                reserved_bytes=Coalesce(Subquery(sessions), 0)
+            )
+            self.stdout.write(f'Reset reservations of users: {reset}')
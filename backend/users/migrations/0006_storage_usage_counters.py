@@ -0,0 +1,76 @@
+# Generated by Django 5.2.10 on 2026-10-17 21:49
+
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+BACKFILL_BATCH = 1000
+
+
+def backfill_storage_usage(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    File = apps.get_model('storage', 'File')
+
+    files = File.objects.filter(owner=OuterRef('pk')).order_by().values('owner')
+    last_id = 0
+
+    # пачками по id: каждый UPDATE коммитится сам и держит блокировку
+    # только своих строк. Расхождения с параллельными загрузками
+    # исправит reconcile_storage_usage
+    while True:
+        ids = list(
+            User.objects.filter(id__gt=last_id).order_by('id')
+            .values_list('id', flat=True)[:BACKFILL_BATCH]
+        )
+        if not ids:
+            return
+
+        User.objects.filter(id__in=ids).update(
+            files_count=Coalesce(
+                Subquery(files.annotate(n=Count('pk')).values('n')), 0
+            ),
+            used_bytes=Coalesce(
+                Subquery(files.annotate(b=Sum('size_bytes')).values('b')), 0
+            ),
+        )
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+    # таблица пользователей под нагрузкой — без долгой транзакции,
+    # индексы строим без блокировки записи и после заполнения счётчиков
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0005_remove_user_users_user_storage_rel_path_not_empty'),
+        ('storage', '0005_file_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='files_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='used_bytes',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_storage_usage, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(django.db.models.functions.text.Lower('username'), models.F('id'), name='users_user_username_lower'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['files_count', 'id'], name='users_user_files_count'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['used_bytes', 'id'], name='users_user_used_bytes'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.10 on 2026-10-17 21:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_storage_usage_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='quota_bytes',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='reserved_bytes',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Lower, Upper
 import uuid
 
 
@@ -13,10 +15,42 @@ class User(AbstractUser):
         editable=False
     )
 
+    # денормализованные счётчики хранилища, ведутся в storage.services
+    # (finalize_upload / delete_stored_file), сверка —
+    # manage.py reconcile_storage_usage
+    files_count = models.PositiveIntegerField(default=0, editable=False)
+    used_bytes = models.BigIntegerField(default=0, editable=False)
+
+    # квота: None — по умолчанию для уровня (settings.STORAGE_QUOTAS);
+    # reserved_bytes — место, занятое загрузками, которые ещё идут
+    quota_bytes = models.BigIntegerField(blank=True, null=True)
+    reserved_bytes = models.BigIntegerField(default=0, editable=False)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(Lower('username'), 'id', name='users_user_username_lower'),
+            models.Index(fields=['files_count', 'id'], name='users_user_files_count'),
+            models.Index(fields=['used_bytes', 'id'], name='users_user_used_bytes'),
+            # поиск в админке — icontains, т.е. UPPER(...) LIKE '%...%'
+            GinIndex(OpClass(Upper('username'), name='gin_trgm_ops'),
+                     name='users_user_username_trgm'),
+            GinIndex(OpClass(Upper('email'), name='gin_trgm_ops'),
+                     name='users_user_email_trgm'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.storage_rel_path:
             self.storage_rel_path = f'{self.username}__{uuid.uuid4()}/'
         super().save(*args, **kwargs)
 
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        # у закэшированного request.user счётчики отложены
+        # (CachedModelBackend): дочитываем их все одним запросом
+        if fields is not None:
+            deferred = self.get_deferred_fields()
+            if deferred.intersection(fields):
+                fields = deferred.union(fields)
+        super().refresh_from_db(using, fields, **kwargs)
+
     def __str__(self):
         return self.username
@@ -1,3 +1,22 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    IntegerField,
+    OuterRef,
+    Q,
+    QuerySet,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+
+from storage.models import File
 from .models import User
 
 def validate_password(pw: str) -> list[str]:
@@ -60,6 +79,46 @@ def get_user_rank(user: User) -> int:
         return 2
     return 3
 
+# то же, что get_user_rank, но на стороне БД
+def user_rank_expression() -> Case:
+    return Case(
+        When(is_superuser=True, then=Value(0)),
+        When(is_admin=True, is_staff=True, then=Value(1)),
+        When(is_admin=True, then=Value(2)),
+        default=Value(3),
+        output_field=IntegerField(),
+    )
+
+# пользователи, которыми actor может управлять (и сам actor),
+# с аннотацией rank — одним запросом, без перебора в Python
+def manageable_users(actor: User) -> QuerySet:
+    qs = User.objects.annotate(rank=user_rank_expression())
+
+    actor_rank = get_user_rank(actor)
+    if actor_rank == 0:
+        return qs
+
+    return qs.filter(Q(rank__gt=actor_rank) | Q(id=actor.id))
+
+# request.user читается через кэш 'auth' (users.backends.CachedModelBackend).
+# save() и delete() пользователя (в том числе из Django admin) сбрасывают
+# запись сами, сигналами; queryset.update() — нет. Поэтому счётчики,
+# которые меняются только через update(), в кэш не попадают вовсе:
+# они отложены и читаются из БД при обращении
+CACHED_USER_DEFERRED = ('files_count', 'used_bytes', 'reserved_bytes')
+
+def cached_user_key(user_id) -> str:
+    return f'user:{user_id}'
+
+def invalidate_cached_user(user_id) -> None:
+    caches['auth'].delete(cached_user_key(user_id))
+
+def drop_cached_user(sender, instance, **kwargs):
+    # после commit: иначе параллельный запрос успел бы закэшировать
+    # ещё старую строку
+    user_id = instance.id
+    transaction.on_commit(lambda: invalidate_cached_user(user_id))
+
 def set_user_level(user: User, level: str):
     if level == 'user':
         user.is_admin = False
@@ -87,8 +146,10 @@ def set_user_level(user: User, level: str):
     user.save(update_fields=['is_admin', 'is_staff', 'is_superuser'])
 
 def can_manage_user(actor: User, target: User) -> bool:
+    return can_manage_rank(actor, get_user_rank(target))
+
+def can_manage_rank(actor: User, target_rank: int) -> bool:
     actor_rank = get_user_rank(actor)
-    target_rank = get_user_rank(target)
 
     if actor_rank == 0:
         return True
@@ -116,3 +177,53 @@ def can_change_level(actor: User, target: User, new_level: str) -> bool:
         return min(target_rank, new_rank) > 1 and target_rank != new_rank
 
     return False
+
+def adjust_storage_usage(user_id: int, files_delta: int, bytes_delta: int):
+    User.objects.filter(id=user_id).update(
+        files_count=F('files_count') + files_delta,
+        used_bytes=F('used_bytes') + bytes_delta,
+    )
+
+def get_storage_quota(user: User):
+    if user.quota_bytes is not None:
+        return user.quota_bytes
+    return settings.STORAGE_QUOTAS.get(get_user_level(user))
+
+# атомарно резервирует место под загрузку: условный UPDATE не даст
+# параллельным загрузкам одного пользователя вместе превысить квоту.
+# Возвращает зарезервированный объём (0 — квоты нет) или None — не влезает
+def reserve_storage(user: User, nbytes: int):
+    quota = get_storage_quota(user)
+    if quota is None:
+        return 0
+
+    updated = User.objects.filter(
+        id=user.id,
+        used_bytes__lte=Value(quota - nbytes) - F('reserved_bytes'),
+    ).update(reserved_bytes=F('reserved_bytes') + nbytes)
+
+    return nbytes if updated else None
+
+def release_storage(user_id: int, nbytes: int):
+    if nbytes:
+        User.objects.filter(id=user_id)\
+            .update(reserved_bytes=F('reserved_bytes') - nbytes)
+
+def storage_usage_drift(batch_size: int = 1000):
+    # пары (user, фактическое число файлов, фактический объём),
+    # у которых счётчики разошлись с таблицей файлов
+    files = File.objects.filter(owner=OuterRef('pk')).order_by()\
+        .values('owner')
+    actual = User.objects.annotate(
+        actual_count=Coalesce(
+            Subquery(files.annotate(n=Count('pk')).values('n')), 0
+        ),
+        actual_bytes=Coalesce(
+            Subquery(files.annotate(b=Sum('size_bytes')).values('b')), 0
+        ),
+    ).filter(
+        ~Q(files_count=F('actual_count')) | ~Q(used_bytes=F('actual_bytes'))
+    ).order_by('id')
+
+    for user in actual.iterator(chunk_size=batch_size):
+        yield user, user.actual_count, user.actual_bytes
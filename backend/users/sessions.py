@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.contrib.sessions.backends import cached_db
+
+
+class CappedCache:
+    # cached_db кладёт сессию в кэш на весь её срок (SESSION_COOKIE_AGE,
+    # две недели). Сессию, удалённую мимо SessionStore (clearsessions,
+    # руками в БД), кэш помнил бы столько же, поэтому срок в кэше
+    # не больше TIMEOUT алиаса
+
+    def __init__(self, cache, max_timeout):
+        self.cache = cache
+        self.max_timeout = max_timeout
+
+    def set(self, key, value, timeout):
+        return self.cache.set(key, value, min(timeout, self.max_timeout))
+
+    async def aset(self, key, value, timeout):
+        return await self.cache.aset(key, value, min(timeout, self.max_timeout))
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def __getattr__(self, name):
+        return getattr(self.cache, name)
+
+
+class SessionStore(cached_db.SessionStore):
+    # SESSION_ENGINE: сессии читаются из кэша, пишутся в БД и в кэш
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._cache = CappedCache(
+            self._cache,
+            settings.CACHES[settings.SESSION_CACHE_ALIAS]['TIMEOUT'],
+        )
@@ -1,3 +1,98 @@
-from django.test import TestCase
+from django.conf import settings
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from users.backends import CachedModelBackend
+from users.models import User
+from users.services import adjust_storage_usage, release_storage, reserve_storage
+
+TEST_CACHES = {
+    alias: {
+        **options,
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': f'test-{alias}',
+    }
+    for alias, options in settings.CACHES.items()
+}
+
+
+class StorageReservationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='x')
+
+    def usage(self):
+        user = User.objects.get(id=self.user.id)
+        return user.used_bytes, user.reserved_bytes
+
+    def set_quota(self, quota_bytes, used_bytes=0):
+        User.objects.filter(id=self.user.id)\
+            .update(quota_bytes=quota_bytes, used_bytes=used_bytes)
+        self.user.refresh_from_db()
+
+    @override_settings(STORAGE_QUOTAS={'user': None})
+    def test_no_quota_reserves_nothing(self):
+        self.assertEqual(reserve_storage(self.user, 10 ** 12), 0)
+        self.assertEqual(self.usage(), (0, 0))
+
+    def test_reservations_share_the_quota(self):
+        self.set_quota(100, used_bytes=40)
+
+        self.assertEqual(reserve_storage(self.user, 30), 30)
+        self.assertEqual(reserve_storage(self.user, 30), 30)
+        self.assertIsNone(reserve_storage(self.user, 1))
+        self.assertEqual(self.usage(), (40, 60))
+
+        release_storage(self.user.id, 30)
+        self.assertEqual(self.usage(), (40, 30))
+        self.assertIsNone(reserve_storage(self.user, 31))
+        self.assertEqual(reserve_storage(self.user, 30), 30)
+        self.assertEqual(self.usage(), (40, 60))
+
+    def test_exact_fit_and_zero(self):
+        self.set_quota(100, used_bytes=100)
+
+        self.assertEqual(reserve_storage(self.user, 0), 0)
+        self.assertIsNone(reserve_storage(self.user, 1))
+
+        release_storage(self.user.id, 0)
+        self.assertEqual(self.usage(), (100, 0))
+
+    @override_settings(STORAGE_QUOTAS={'user': 50})
+    def test_level_quota_applies_without_personal_quota(self):
+        self.assertIsNone(reserve_storage(self.user, 51))
+        self.assertEqual(reserve_storage(self.user, 50), 50)
+
+        # личная квота важнее квоты уровня
+        self.set_quota(200)
+        self.assertEqual(reserve_storage(self.user, 150), 150)
+        self.assertEqual(self.usage(), (0, 200))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CachedUserTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='x')
+
+    def test_counters_are_not_cached(self):
+        backend = CachedModelBackend()
+        backend.get_user(self.user.id)
+
+        adjust_storage_usage(self.user.id, 2, 100)
+        reserve_storage(self.user, 0)
+
+        # из кэша — без запроса; счётчики дочитываются из БД
+        with self.assertNumQueries(0):
+            user = backend.get_user(self.user.id)
+            self.assertEqual(user.username, 'alice')
+        with self.assertNumQueries(1):
+            self.assertEqual((user.files_count, user.used_bytes), (2, 100))
+
+    def test_save_of_cached_user_keeps_counters(self):
+        backend = CachedModelBackend()
+        user = backend.get_user(self.user.id)
+        adjust_storage_usage(self.user.id, 1, 10)
+
+        user.full_name = 'Alice'
+        user.save()
+
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.full_name, self.user.used_bytes), ('Alice', 10))
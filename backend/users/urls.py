@@ -8,6 +8,8 @@ from .views import (
     admin_users_list,
     admin_user_delete,
     admin_user_set_level,
+    admin_user_set_quota,
+    admin_storage_purge,
 )
 
 urlpatterns = [
@@ -21,4 +23,8 @@ urlpatterns = [
          name='admin-user-delete'),
     path('admin/users/<int:user_id>/level/', admin_user_set_level,
          name='admin-user-set-level'),
+    path('admin/users/<int:user_id>/quota/', admin_user_set_quota,
+         name='admin-user-set-quota'),
+    path('admin/purges/<int:purge_id>/', admin_storage_purge,
+         name='admin-storage-purge'),
 ]
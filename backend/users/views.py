@@ -3,6 +3,7 @@ from re import compile as make_regex
 from uuid import uuid4
 
 from django.contrib.auth import authenticate, login, logout
+from django.db import transaction
 from django.http import HttpRequest, JsonResponse
 from django.views.decorators.http import (
     require_GET,
@@ -12,19 +13,35 @@ from django.views.decorators.http import (
 from django.views.decorators.csrf import ensure_csrf_cookie
 
 from .models import User
-from storage.services import user_storage_abs_path, ensure_user_storage_dir
+from storage.metrics import AUTH_ATTEMPTS
+from storage.models import StoragePurge
+from storage.services import (
+    ensure_user_storage_dir,
+    schedule_storage_purge,
+    release_owner_blobs,
+    purge_unreferenced_blobs,
+    invalidate_share_tokens,
+    encode_cursor,
+    decode_cursor,
+    keyset_page,
+)
 from .services import (
     validate_password,
     get_user_rank,
     get_user_level,
     can_manage_user,
+    can_manage_rank,
     can_delete_user,
     can_change_level,
-    set_user_level
+    set_user_level,
+    rank_to_level,
+    manageable_users,
+    get_storage_quota,
+    invalidate_cached_user,
 )
 
-from django.db.models import Count, Sum, Case, When, Value, IntegerField
-from django.db.models.functions import Coalesce, Lower
+from django.db.models import Case, When, Value, IntegerField, Q
+from django.db.models.functions import Lower
 
 USERNAME_RE = make_regex(r'^[A-Za-z][A-Za-z0-9]{3,19}$')
 EMAIL_RE = make_regex(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
@@ -69,6 +86,7 @@ def register(request: HttpRequest) -> JsonResponse:
         errors['password'] = pw_errors
 
     if errors:
+        AUTH_ATTEMPTS.labels('register', 'invalid').inc()
         return JsonResponse({'detail': 'Validation error', 'errors': errors}, status=400)
 
     storage_rel_path = f'{username}_{uuid4()}/'
@@ -84,6 +102,7 @@ def register(request: HttpRequest) -> JsonResponse:
     user.set_password(password)
     user.save()
     ensure_user_storage_dir(user.storage_rel_path)
+    AUTH_ATTEMPTS.labels('register', 'success').inc()
 
     return JsonResponse(
         {
@@ -111,11 +130,14 @@ def login_view(request: HttpRequest) -> JsonResponse:
     if not username or not password:
         return JsonResponse({'detail': 'Missing username or password'}, status=400)
 
+    # всплеск failure — подбор паролей
     user = authenticate(request, username=username, password=password)
     if user is None:
+        AUTH_ATTEMPTS.labels('login', 'failure').inc()
         return JsonResponse({'detail': 'Invalid credentials'}, status=401)
 
     login(request, user)
+    AUTH_ATTEMPTS.labels('login', 'success').inc()
 
     return JsonResponse(
         {
@@ -141,7 +163,9 @@ def logout_view(request: HttpRequest) -> JsonResponse:
     if not request.user.is_authenticated:
         return JsonResponse({'detail': 'Not authenticated'}, status=401)
 
+    user_id = request.user.id
     logout(request)
+    invalidate_cached_user(user_id)
 
     return JsonResponse({'detail': 'Logout successful'}, status=200)
 
@@ -170,6 +194,35 @@ def me_view(request: HttpRequest) -> JsonResponse:
         status=200,
     )
 
+USER_SORT_FIELDS = {
+    'username': 'username_lower',
+    'files_count': 'files_count',
+    'total_storage_bytes': 'used_bytes',
+}
+USERS_PAGE_DEFAULT = 50
+USERS_PAGE_MAX = 500
+
+def user_data(u: User) -> dict:
+    return {
+        'id': u.id,
+        'username': u.username,
+        'full_name': u.full_name,
+        'email': u.email,
+
+        'is_admin': u.is_admin,
+        'is_staff': u.is_staff,
+        'is_superuser': u.is_superuser,
+
+        'level': rank_to_level(u.rank),
+        'rank': u.rank,
+
+        'storage_rel_path': u.storage_rel_path,
+
+        'files_count': u.files_count,
+        'total_storage_bytes': u.used_bytes,
+        'quota_bytes': get_storage_quota(u),
+    }
+
 @require_GET
 def admin_users_list(request: HttpRequest) -> JsonResponse:
     if not request.user.is_authenticated:
@@ -181,53 +234,66 @@ def admin_users_list(request: HttpRequest) -> JsonResponse:
 
     actor = request.user
 
-    qs = User.objects.all()
-
-    manageable_ids = [u.id for u in qs if u.id == actor.id or can_manage_user(
-        actor, u)]
-
-    # querry set of manageable users with metadata of their files agregated:
-    # files count and total bytes of them
-    # in orded by "the actor's goeing first,
-    # the rest are goein with lower username order"
-    qs2 = (
-        User.objects
-        .filter(id__in=manageable_ids)
-        .annotate(
-            files_count=Count('files', distinct=True),
-            total_space=Coalesce(Sum('files__size_bytes'), 0),
+    # files_count / used_bytes — счётчики в самой строке пользователя,
+    # без JOIN и GROUP BY по таблице файлов
+    qs = manageable_users(actor).annotate(username_lower=Lower('username'))
+
+    search = (request.GET.get('search') or '').strip()
+    if search:
+        qs = qs.filter(
+            Q(username__icontains=search) | Q(email__icontains=search)
+        )
+
+    sort = request.GET.get('sort', 'username')
+    if sort.lstrip('-') not in USER_SORT_FIELDS:
+        return JsonResponse({'detail': 'Invalid sort'}, status=400)
+    sort_field = USER_SORT_FIELDS[sort.lstrip('-')]
+    descending = sort.startswith('-')
+
+    limit = request.GET.get('limit')
+    cursor = request.GET.get('cursor')
+
+    # без limit/cursor — прежний ответ массивом,
+    # in orded by "the actor's goeing first, the rest are goein by sort"
+    if limit is None and cursor is None:
+        qs = qs.annotate(
             is_actor=Case(
                 When(id=actor.id, then=Value(0)),
                 default=Value(1),
                 output_field=IntegerField()
             )
+        ).order_by(
+            'is_actor',
+            f'{"-" if descending else ""}{sort_field}',
+            f'{"-" if descending else ""}id',
         )
-        .order_by('is_actor', Lower('username'))
-    )
-
-    data = [
-        {
-            'id': u.id,
-            'username': u.username,
-            'full_name': u.full_name,
-            'email': u.email,
+        return JsonResponse([user_data(u) for u in qs], safe=False)
 
-            'is_admin': u.is_admin,
-            'is_staff': u.is_staff,
-            'is_superuser': u.is_superuser,
+    limit = limit or str(USERS_PAGE_DEFAULT)
+    if not limit.isdigit() or not 1 <= int(limit) <= USERS_PAGE_MAX:
+        return JsonResponse(
+            {'detail': f'Invalid limit: expected 1..{USERS_PAGE_MAX}'},
+            status=400
+        )
 
-            'level': get_user_level(u),
-            'rank': get_user_rank(u),
+    after = None
+    if cursor:
+        after = decode_cursor(cursor)
+        if not after or after[0] != sort or len(after) != 3:
+            return JsonResponse({'detail': 'Invalid cursor'}, status=400)
+        after = after[1:]
 
-            'storage_rel_path': u.storage_rel_path,
+    page, has_more = keyset_page(qs, sort_field, descending, after, int(limit))
 
-            'files_count': u.files_count,
-            'total_storage_bytes': u.total_space,
-        }
-        for u in qs2
-    ]
+    next_cursor = None
+    if has_more:
+        last = page[-1]
+        next_cursor = encode_cursor([sort, getattr(last, sort_field), last.id])
 
-    return JsonResponse(data, safe=False)
+    return JsonResponse({
+        'results': [user_data(u) for u in page],
+        'next_cursor': next_cursor,
+    })
 
 @require_http_methods(['DELETE'])
 def admin_user_delete(request: HttpRequest, user_id: int) -> JsonResponse:
@@ -255,32 +321,69 @@ def admin_user_delete(request: HttpRequest, user_id: int) -> JsonResponse:
 
     delete_files = request.GET.get('delete_files') == '1'
 
-    if delete_files:
-        try:
-            root = user_storage_abs_path(target.storage_rel_path)
-            if root.exists():
-                for p in sorted(root.rglob('*'), reverse=True):
-                    if p.is_file():
-                        p.unlink()
-                    else:
-                        p.rmdir()
-                root.rmdir()
-        except Exception:
-            return JsonResponse(
-                {'detail': 'Failed to delete user files'},
-                status=500
-            )
+    share_tokens = list(
+        target.files.filter(share_token__isnull=False)
+        .values_list('share_token', flat=True)
+    )
 
-    target.delete()
+    # blob-и общие для всех пользователей: снимаем только ссылки,
+    # данные удаляются, когда на blob больше никто не ссылается
+    with transaction.atomic():
+        # каталог пользователя удаляет фоновый воркер
+        # (manage.py purge_user_storage) пачками, вне запроса
+        purge = schedule_storage_purge(target) if delete_files else None
+        blob_ids = release_owner_blobs(target)
+        target.delete()
+        purge_unreferenced_blobs(blob_ids)
+
+    invalidate_share_tokens(share_tokens)
+
+    if purge is None:
+        return JsonResponse(
+            {
+                'detail': 'User deleted',
+                'files_deleted': False,
+            },
+            status=200,
+        )
 
     return JsonResponse(
         {
             'detail': 'User deleted',
-            'files_deleted': delete_files
+            'files_deleted': True,
+            'purge': storage_purge_data(purge),
         },
-        status=200,
+        status=202,
     )
 
+def storage_purge_data(purge: StoragePurge) -> dict:
+    return {
+        'id': purge.id,
+        'user_id': purge.user_id,
+        'username': purge.username,
+        'status': purge.status,
+        'files_deleted': purge.files_deleted,
+        'error': purge.error or None,
+        'created': purge.created.isoformat(),
+        'updated': purge.updated.isoformat(),
+        'finished': purge.finished.isoformat() if purge.finished else None,
+    }
+
+@require_GET
+def admin_storage_purge(request: HttpRequest, purge_id: int) -> JsonResponse:
+    if not request.user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication required'}, status=401)
+
+    if get_user_level(request.user) == 'user':
+        return JsonResponse({'detail': 'Admin rights required'}, status=403)
+
+    # как и у пользователей: чужие по рангу неотличимы от несуществующих
+    purge = StoragePurge.objects.filter(id=purge_id).first()
+    if not purge or not can_manage_rank(request.user, purge.user_rank):
+        return JsonResponse({'detail': 'Purge not found'}, status=404)
+
+    return JsonResponse(storage_purge_data(purge))
+
 @require_http_methods(['PATCH'])
 def admin_user_set_level(request: HttpRequest, user_id: int) -> JsonResponse:
     if not request.user.is_authenticated:
@@ -338,3 +441,51 @@ def admin_user_set_level(request: HttpRequest, user_id: int) -> JsonResponse:
         },
         status=200,
     )
+
+@require_http_methods(['PATCH'])
+def admin_user_set_quota(request: HttpRequest, user_id: int) -> JsonResponse:
+    if not request.user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication required'}, status=401)
+
+    actor = request.user
+    if get_user_level(actor) == 'user':
+        return JsonResponse({'detail': 'Admin rights required'}, status=403)
+
+    try:
+        target = User.objects.get(id=user_id)
+    except User.DoesNotExist:
+        return JsonResponse({'detail': 'User not found'}, status=404)
+
+    if not can_manage_user(actor, target):
+        return JsonResponse({'detail': 'Permission denied'}, status=403)
+
+    try:
+        payload = loads(request.body.decode('utf-8') or '{}')
+    except JSONDecodeError:
+        return JsonResponse({'detail': 'Invalid JSON'}, status=400)
+
+    # null — вернуть квоту по умолчанию для уровня пользователя
+    if 'quota_bytes' not in payload:
+        return JsonResponse({'detail': 'Missing quota_bytes'}, status=400)
+
+    quota_bytes = payload.get('quota_bytes')
+    if quota_bytes is not None and (
+        not isinstance(quota_bytes, int) or quota_bytes < 0
+    ):
+        return JsonResponse({'detail': 'Invalid quota_bytes'}, status=400)
+
+    target.quota_bytes = quota_bytes
+    target.save(update_fields=['quota_bytes'])
+
+    return JsonResponse(
+        {
+            'detail': 'User quota updated',
+            'user': {
+                'id': target.id,
+                'username': target.username,
+                'quota_bytes': get_storage_quota(target),
+                'used_bytes': target.used_bytes,
+            },
+        },
+        status=200,
+    )
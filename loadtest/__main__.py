@@ -0,0 +1,145 @@
+import argparse
+import dataclasses
+import json
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .scenarios import SCENARIOS, Options, prepare, run
+from .stats import format_summary, regressions
+
+BASELINES_DIR = Path(__file__).resolve().parent / 'baselines'
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+# при других значениях этих опций сравнение с базовой линией бессмысленно
+COMPARABLE_OPTIONS = (
+    'scenario', 'duration', 'concurrency', 'users', 'small_files',
+    'small_size', 'list_files', 'list_user', 'shared_size', 'upload_size',
+    'page_size',
+)
+
+
+def size(value: str) -> int:
+    unit = SIZE_UNITS.get(value[-1:].upper())
+    return int(value[:-1]) * unit if unit else int(value)
+
+def user_password(value: str) -> tuple[str, str]:
+    username, sep, password = value.partition(':')
+    if not sep:
+        raise argparse.ArgumentTypeError('expected username:password')
+    return username, password
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def comparable(options: Options) -> dict:
+    values = {name: getattr(options, name) for name in COMPARABLE_OPTIONS}
+    # пароль в файл базовой линии не пишем
+    if values['list_user']:
+        values['list_user'] = values['list_user'][0]
+    return values
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog='python -m loadtest',
+        description='Load test against a running My Cloud stack',
+    )
+    parser.add_argument('scenario', choices=SCENARIOS)
+    parser.add_argument('--base-url', default='http://localhost')
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--warmup', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--username-prefix', default='loadtest')
+    parser.add_argument('--password', default='Load#test1')
+    parser.add_argument('--small-files', type=int, default=50,
+                        help='Files per user for the download operation')
+    parser.add_argument('--small-size', type=size, default='64K')
+    parser.add_argument('--list-files', type=int, default=5000,
+                        help='Files of the user whose list is requested')
+    parser.add_argument('--list-user', type=user_password,
+                        help='username:password of an existing user with '
+                             'many files instead of uploading --list-files')
+    parser.add_argument('--shared-size', type=size, default='1M')
+    parser.add_argument('--upload-size', type=size, default='50M')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', type=Path,
+                        help='Write the result as JSON to this file')
+    parser.add_argument('--baseline', default=None,
+                        help='Baseline name (default: scenario name)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store the result as the baseline')
+    parser.add_argument('--compare', action='store_true',
+                        help='Compare with the baseline, exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed p95 growth / rps drop for --compare')
+    return parser.parse_args()
+
+def main() -> int:
+    args = parse_args()
+    options = Options(**{
+        f.name: getattr(args, f.name) for f in dataclasses.fields(Options)
+    })
+    baseline_path = BASELINES_DIR / f'{args.baseline or args.scenario}.json'
+
+    baseline = None
+    if args.compare:
+        if not baseline_path.exists():
+            print(f'No baseline {baseline_path}', file=sys.stderr)
+            return 2
+        baseline = json.loads(baseline_path.read_text())
+        changed = [
+            name for name, value in comparable(options).items()
+            if baseline['options'].get(name) != value
+        ]
+        if changed:
+            print(f'Warning: options differ from baseline: {", ".join(changed)}',
+                  file=sys.stderr)
+
+    print(f'Preparing users and files on {options.base_url}')
+    fixture = prepare(options)
+
+    print(f'Running {options.scenario}: {options.concurrency} clients, '
+          f'{args.warmup:g}s warmup, {options.duration:g}s')
+    summary = run(options, fixture, args.warmup)
+
+    result = {
+        'commit': git_commit(),
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'base_url': options.base_url,
+        'options': comparable(options),
+        'results': summary,
+    }
+
+    print()
+    if baseline:
+        print(f'Compared with baseline of {baseline["commit"] or "?"} '
+              f'({baseline["created"]})')
+    print(format_summary(summary, baseline and baseline['results']))
+
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2))
+
+    if args.save_baseline:
+        BASELINES_DIR.mkdir(exist_ok=True)
+        baseline_path.write_text(json.dumps(result, indent=2) + '\n')
+        print(f'\nBaseline saved to {baseline_path}')
+
+    if baseline:
+        found = regressions(summary, baseline['results'], args.tolerance)
+        if found:
+            print('\nRegressions:\n  ' + '\n  '.join(found))
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
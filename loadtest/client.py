@@ -0,0 +1,137 @@
+import http.client
+import json
+import os
+import time
+import uuid
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit
+
+READ_CHUNK = 256 * 1024
+UPLOAD_CHUNK = 1024 * 1024
+# тело загрузок — повторяющийся случайный мегабайт: не сжимается и
+# не дедуплицируется (в каждом файле свой префикс), памяти не тратит
+RANDOM_CHUNK = os.urandom(UPLOAD_CHUNK)
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, body: bytes):
+        super().__init__(f'HTTP {status}: {body[:200]!r}')
+        self.status = status
+
+
+class Session:
+    # Один пользователь: keep-alive соединение, cookies sessionid/csrftoken.
+    # Не потокобезопасен — у каждого потока нагрузки свои сессии
+
+    def __init__(self, base_url: str, timeout: float = 120):
+        url = urlsplit(base_url)
+        self.https = url.scheme == 'https'
+        self.host = url.netloc
+        self.prefix = url.path.rstrip('/')
+        self.timeout = timeout
+        self.cookies = {}
+        self.conn = None
+
+    def connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, timeout=self.timeout)
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    # (status, тело или None, байт тела, секунд до последнего байта);
+    # с keep=False тело читается и выбрасывается — для скачиваний
+    def request(self, method: str, path: str, body=None, headers=None,
+                keep: bool = True):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(
+                f'{k}={v}' for k, v in self.cookies.items()
+            )
+        if method not in ('GET', 'HEAD') and 'csrftoken' in self.cookies:
+            headers['X-CSRFToken'] = self.cookies['csrftoken']
+            headers['Referer'] = f'{"https" if self.https else "http"}://{self.host}/'
+
+        started = time.perf_counter()
+        for attempt in (1, 2):
+            if self.conn is None:
+                self.conn = self.connect()
+            try:
+                self.conn.request(method, self.prefix + path, body, headers)
+                response = self.conn.getresponse()
+                break
+            except (ConnectionError, http.client.HTTPException):
+                # сервер закрыл keep-alive соединение между запросами;
+                # тело-генератор повторно не отправить
+                self.close()
+                if attempt == 2 or not isinstance(body, (bytes, type(None))):
+                    raise
+
+        for header in response.headers.get_all('Set-Cookie') or ():
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+
+        data = []
+        size = 0
+        while chunk := response.read(READ_CHUNK):
+            size += len(chunk)
+            if keep:
+                data.append(chunk)
+        seconds = time.perf_counter() - started
+
+        if response.will_close:
+            self.close()
+
+        return response.status, b''.join(data) if keep else None, size, seconds
+
+    def json(self, method: str, path: str, payload=None, ok=(200, 201)):
+        body = None if payload is None else json.dumps(payload).encode()
+        headers = {} if body is None else {'Content-Type': 'application/json'}
+        status, data, _, _ = self.request(method, path, body, headers)
+        if status not in ok:
+            raise HTTPError(status, data)
+        return json.loads(data) if data else None
+
+    def ensure_user(self, username: str, password: str) -> None:
+        # пользователи нагрузки постоянные: регистрация при первом запуске
+        self.json('GET', '/api/auth/csrf/')
+        self.json('POST', '/api/auth/register/', {
+            'username': username,
+            'full_name': 'Load Test',
+            'email': f'{username}@loadtest.invalid',
+            'password': password,
+        }, ok=(201, 400))
+        self.json('POST', '/api/auth/login/', {
+            'username': username, 'password': password,
+        })
+
+    def upload(self, name: str, size: int):
+        # multipart собирается потоком: файл в сотни МиБ не держим в памяти
+        boundary = uuid.uuid4().hex
+        head = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="file"; filename="{name}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode()
+        tail = f'\r\n--{boundary}--\r\n'.encode()
+        salt = uuid.uuid4().bytes
+
+        def body():
+            yield head
+            left = size
+            first = True
+            while left > 0:
+                chunk = RANDOM_CHUNK[:left]
+                if first:
+                    chunk = (salt + chunk[len(salt):])[:len(chunk)]
+                    first = False
+                left -= len(chunk)
+                yield chunk
+            yield tail
+
+        return self.request('POST', '/api/files/upload/', body(), {
+            'Content-Type': f'multipart/form-data; boundary={boundary}',
+            'Content-Length': str(len(head) + size + len(tail)),
+        })
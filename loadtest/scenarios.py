@@ -0,0 +1,259 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import quote
+
+from .client import HTTPError, Session
+from .stats import Recorder
+
+# веса операций в смеси; операции — методы Worker с префиксом op_
+SCENARIOS = {
+    # типичный день: скачивания и просмотр списка, изредка большие загрузки
+    'mixed': {'upload': 1, 'download': 40, 'list': 2, 'list_page': 8, 'shared': 40},
+    'upload': {'upload': 1},
+    'download': {'download': 1},
+    'list': {'list': 1, 'list_page': 1},
+    # ссылку на один файл раздали всем
+    'viral': {'shared': 1},
+}
+
+SMALL_PREFIX = 'lt-small-'
+LIST_PREFIX = 'lt-list-'
+SHARED_NAME = 'lt-shared.bin'
+UPLOAD_PREFIX = 'lt-upload-'
+PAGE_SIZE = 1000
+BULK_MAX_IDS = 1000
+
+
+@dataclass
+class Options:
+    base_url: str
+    scenario: str
+    duration: float
+    concurrency: int
+    users: int
+    username_prefix: str
+    password: str
+    small_files: int
+    small_size: int
+    list_files: int
+    list_user: tuple[str, str] | None
+    shared_size: int
+    upload_size: int
+    page_size: int
+    seed: int
+
+
+@dataclass
+class Fixture:
+    # пользователи и файлы, которые нагрузка читает
+    users: list[str] = field(default_factory=list)
+    small_ids: dict[str, list[int]] = field(default_factory=dict)
+    list_user: tuple[str, str] = ('', '')
+    share_token: str = ''
+
+
+def login(options: Options, username: str, password: str) -> Session:
+    session = Session(options.base_url)
+    session.ensure_user(username, password)
+    return session
+
+def file_ids(session: Session, name_prefix: str) -> list[int]:
+    ids = []
+    cursor = ''
+    while True:
+        page = session.json(
+            'GET',
+            f'/api/files/?name_prefix={quote(name_prefix)}&limit={PAGE_SIZE}'
+            + (f'&cursor={cursor}' if cursor else ''),
+        )
+        ids.extend(f['id'] for f in page['results'])
+        cursor = page['next_cursor']
+        if not cursor:
+            return ids
+
+def upload_files(options: Options, username: str, password: str,
+                 prefix: str, count: int, size: int) -> None:
+    # недостающие файлы грузятся параллельно, каждый поток со своей сессией
+    local = threading.local()
+
+    def upload(n: int) -> int:
+        if not hasattr(local, 'session'):
+            local.session = login(options, username, password)
+        status, data, _, _ = local.session.upload(f'{prefix}{n}.bin', size)
+        if status != 201:
+            raise HTTPError(status, data)
+        return n
+
+    with ThreadPoolExecutor(options.concurrency) as pool:
+        for done, _ in enumerate(pool.map(upload, range(count)), 1):
+            if done % 500 == 0:
+                print(f'  {username}: {done}/{count} files')
+
+def prepare(options: Options) -> Fixture:
+    # Идемпотентно: пользователи и файлы с прошлых прогонов переиспользуются,
+    # догружается только недостающее
+    fixture = Fixture()
+
+    for n in range(options.users):
+        username = f'{options.username_prefix}{n}'
+        session = login(options, username, options.password)
+        ids = file_ids(session, SMALL_PREFIX)
+        missing = options.small_files - len(ids)
+        if missing > 0:
+            print(f'Uploading {missing} small files for {username}')
+            upload_files(options, username, options.password,
+                         f'{SMALL_PREFIX}{len(ids)}-', missing, options.small_size)
+            ids = file_ids(session, SMALL_PREFIX)
+        fixture.users.append(username)
+        fixture.small_ids[username] = ids
+
+        if n == 0:
+            shared = file_ids(session, SHARED_NAME)
+            if not shared:
+                print(f'Uploading shared file for {username}')
+                status, data, _, _ = session.upload(SHARED_NAME, options.shared_size)
+                if status != 201:
+                    raise HTTPError(status, data)
+                shared = file_ids(session, SHARED_NAME)
+            share = session.json('POST', f'/api/files/{shared[0]}/share/')
+            fixture.share_token = share['share_token']
+        session.close()
+
+    if options.list_user:
+        # готовый пользователь с большим числом файлов, ничего не догружаем
+        fixture.list_user = options.list_user
+    else:
+        username = f'{options.username_prefix}list'
+        fixture.list_user = (username, options.password)
+        session = login(options, username, options.password)
+        missing = options.list_files - len(file_ids(session, LIST_PREFIX))
+        session.close()
+        if missing > 0:
+            print(f'Uploading {missing} files for {username}')
+            upload_files(options, username, options.password,
+                         f'{LIST_PREFIX}{time.time_ns()}-', missing, 1024)
+
+    return fixture
+
+
+class Worker:
+    # Поток нагрузки: замкнутый цикл, следующая операция — сразу после
+    # ответа на предыдущую. Сессии свои, пользователь — по номеру потока
+
+    def __init__(self, n: int, options: Options, fixture: Fixture,
+                 recorder: Recorder):
+        self.options = options
+        self.fixture = fixture
+        self.recorder = recorder
+        self.random = random.Random(options.seed + n)
+        self.username = fixture.users[n % len(fixture.users)]
+        self.sessions = {}
+        self.uploaded = []
+
+    def session(self, kind: str) -> Session:
+        if kind not in self.sessions:
+            if kind == 'own':
+                session = login(self.options, self.username, self.options.password)
+            elif kind == 'list':
+                session = login(self.options, *self.fixture.list_user)
+            else:
+                # спецссылку открывают без входа
+                session = Session(self.options.base_url)
+            self.sessions[kind] = session
+        return self.sessions[kind]
+
+    def run(self, deadline: float) -> None:
+        weights = SCENARIOS[self.options.scenario]
+        ops = list(weights)
+
+        while time.monotonic() < deadline:
+            op = self.random.choices(ops, [weights[o] for o in ops])[0]
+            started = time.perf_counter()
+            try:
+                size = getattr(self, f'op_{op}')()
+            except HTTPError as exc:
+                self.recorder.record(op, 0, error=exc.status)
+            except Exception as exc:
+                self.recorder.record(op, 0, error=exc.__class__.__name__)
+                # соединение могло остаться в непонятном состоянии
+                for session in self.sessions.values():
+                    session.close()
+            else:
+                self.recorder.record(op, time.perf_counter() - started, size)
+
+    def get(self, kind: str, path: str, keep: bool = False) -> int:
+        status, data, size, _ = self.session(kind).request('GET', path, keep=keep)
+        if status != 200:
+            raise HTTPError(status, data or b'')
+        return size
+
+    def op_upload(self) -> int:
+        status, data, _, _ = self.session('own').upload(
+            f'{UPLOAD_PREFIX}{self.random.getrandbits(64):x}.bin',
+            self.options.upload_size,
+        )
+        if status != 201:
+            raise HTTPError(status, data)
+        self.uploaded.append(json.loads(data)['id'])
+        return self.options.upload_size
+
+    def op_download(self) -> int:
+        file_id = self.random.choice(self.fixture.small_ids[self.username])
+        return self.get('own', f'/api/files/{file_id}/download/')
+
+    def op_list(self) -> int:
+        # весь список одним ответом, как его грузит фронтенд
+        return self.get('list', '/api/files/')
+
+    def op_list_page(self) -> int:
+        return self.get('list', f'/api/files/?limit={self.options.page_size}')
+
+    def op_shared(self) -> int:
+        return self.get('shared', f'/api/share/{self.fixture.share_token}/')
+
+    def cleanup(self) -> None:
+        # загруженное за прогон удаляется, иначе квота и диск кончатся
+        session = self.session('own')
+        for start in range(0, len(self.uploaded), BULK_MAX_IDS):
+            session.json('POST', '/api/files/bulk/', {
+                'action': 'delete',
+                'ids': self.uploaded[start:start + BULK_MAX_IDS],
+            })
+        for session in self.sessions.values():
+            session.close()
+
+def run_workers(workers: list[Worker], seconds: float) -> float:
+    started = time.monotonic()
+    threads = [
+        threading.Thread(target=w.run, args=(started + seconds,), daemon=True)
+        for w in workers
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.monotonic() - started
+
+def run(options: Options, fixture: Fixture, warmup: float) -> dict:
+    workers = [
+        Worker(n, options, fixture, Recorder())
+        for n in range(options.concurrency)
+    ]
+    try:
+        # прогрев (соединения, кэши, пул БД) в результат не попадает
+        if warmup > 0:
+            run_workers(workers, warmup)
+
+        recorder = Recorder()
+        for worker in workers:
+            worker.recorder = recorder
+        duration = run_workers(workers, options.duration)
+    finally:
+        for worker in workers:
+            worker.cleanup()
+
+    return recorder.summary(duration)
@@ -0,0 +1,87 @@
+import math
+import threading
+from collections import Counter, defaultdict
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: list[float], q: float) -> float:
+    # nearest-rank по отсортированному списку
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+class Recorder:
+    # Латентности всех операций за прогон; потоки нагрузки пишут сюда
+    # параллельно. Ошибки — по HTTP-статусу или имени исключения
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.bytes = Counter()
+        self.errors = defaultdict(Counter)
+
+    def record(self, op: str, seconds: float, size: int = 0, error=None) -> None:
+        with self.lock:
+            if error is None:
+                self.latencies[op].append(seconds)
+                self.bytes[op] += size
+            else:
+                self.errors[op][str(error)] += 1
+
+    def summary(self, duration: float) -> dict:
+        result = {}
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies[op])
+            errors = self.errors[op]
+            result[op] = {
+                'count': len(values),
+                'errors': sum(errors.values()),
+                'error_kinds': dict(errors),
+                'rps': len(values) / duration,
+                'mb_per_s': self.bytes[op] / duration / 1024 / 1024,
+                **{
+                    f'p{q}_ms': percentile(values, q) * 1000
+                    for q in PERCENTILES
+                },
+            }
+        return result
+
+
+def format_summary(summary: dict, baseline: dict | None = None) -> str:
+    columns = ['count', 'errors', 'rps', 'mb_per_s',
+               *(f'p{q}_ms' for q in PERCENTILES)]
+    lines = [f'{"op":<14}' + ''.join(f'{c:>18}' for c in columns)]
+
+    for op, row in summary.items():
+        cells = []
+        for column in columns:
+            value = row[column]
+            cell = f'{value:.1f}' if isinstance(value, float) else str(value)
+            base = (baseline or {}).get(op, {}).get(column)
+            if base and column not in ('count', 'errors'):
+                cell += f' ({(value - base) / base:+.0%})'
+            cells.append(f'{cell:>18}')
+        lines.append(f'{op:<14}' + ''.join(cells))
+
+        for kind, count in row['error_kinds'].items():
+            lines.append(f'{"":<14}  {count} x {kind}')
+
+    return '\n'.join(lines)
+
+# операции, которые хуже базовой линии больше чем на tolerance
+# (p95 выше или rps ниже)
+def regressions(summary: dict, baseline: dict, tolerance: float) -> list[str]:
+    found = []
+    for op, base in baseline.items():
+        row = summary.get(op)
+        if row is None:
+            continue
+        if base['p95_ms'] and row['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            found.append(
+                f'{op}: p95 {base["p95_ms"]:.1f} -> {row["p95_ms"]:.1f} ms'
+            )
+        if base['rps'] and row['rps'] < base['rps'] * (1 - tolerance):
+            found.append(f'{op}: rps {base["rps"]:.1f} -> {row["rps"]:.1f}')
+    return found